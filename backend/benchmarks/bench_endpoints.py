@@ -0,0 +1,238 @@
+'''
+Endpoint latency benchmark on synthetic question banks
+
+Seeds a fresh SQLite DB with each size of synthetic question bank, drives
+every endpoint through the Flask test client and writes the throughput and
+p50/p95/p99 latency of each to a JSON file. The compare mode flags the
+endpoints that got slower between two such files.
+
+run from the backend folder:
+python benchmarks/bench_endpoints.py --output before.json
+python benchmarks/bench_endpoints.py --sizes 10000 --requests 100 \
+    --output after.json
+python benchmarks/bench_endpoints.py --compare before.json after.json
+'''
+
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+os.environ.setdefault('DB_USER', 'student')
+os.environ.setdefault('DB_PASSWORD', 'student')
+
+from flaskr import create_app  # noqa: E402
+from models import db, hash_question, Question, Category  # noqa: E402
+
+DEFAULT_SIZES = [10000, 100000, 1000000]
+DEFAULT_REQUESTS = 200
+DEFAULT_WARMUP = 20
+DEFAULT_THRESHOLD = 0.10
+NUM_CATEGORIES = 6
+INSERT_BATCH_SIZE = 50000
+RANDOM_SEED = 42
+WORDS = ['river', 'planet', 'painter', 'empire', 'league', 'novel',
+         'mountain', 'element', 'composer', 'island', 'battle', 'museum',
+         'treaty', 'galaxy', 'stadium', 'sculptor', 'volcano', 'dynasty',
+         'orbit', 'festival']
+OK = 200
+
+
+def synthetic_question(question_id, rng):
+    words = rng.sample(WORDS, 3)
+    return {
+        'id': question_id,
+        'question': f'Which {words[0]} is linked to the {words[1]} of '
+                    f'{words[2]} number {question_id}?',
+        'answer': f'{rng.choice(WORDS).title()} {question_id}',
+        'category': question_id % NUM_CATEGORIES + 1,
+        'difficulty': rng.randint(1, 5),
+    }
+
+
+def seed(num_questions):
+    '''
+    Fills the DB with num_questions synthetic questions spread evenly over
+    the categories, the same questions on every run
+    '''
+    db.create_all()
+    rng = random.Random(RANDOM_SEED)
+    db.session.execute(Category.__table__.insert(), [
+        {'id': category_id, 'type': f'Category {category_id}'}
+        for category_id in range(1, NUM_CATEGORIES + 1)])
+    for start in range(1, num_questions + 1, INSERT_BATCH_SIZE):
+        stop = min(start + INSERT_BATCH_SIZE, num_questions + 1)
+        rows = [synthetic_question(question_id, rng)
+                for question_id in range(start, stop)]
+        for row in rows:
+            row['question_hash'] = hash_question(row['question'])
+        db.session.execute(Question.__table__.insert(), rows)
+    db.session.commit()
+
+
+def scenarios(num_questions):
+    '''
+    Returns the endpoints to time as (name, method, path, json body)
+    functions of a random number generator
+    '''
+    def page(rng):
+        return f'/questions?page={rng.randint(1, 50)}'
+
+    def cursor(rng):
+        return f'/questions?after={rng.randint(1, num_questions)}&limit=10'
+
+    def category_page(rng):
+        return f'/categories/{rng.randint(1, NUM_CATEGORIES)}/questions' \
+            f'?page={rng.randint(1, 10)}'
+
+    def quiz_body(rng):
+        return {'previous_questions': [
+                    rng.randint(1, num_questions) for _ in range(5)],
+                'quiz_category': {'type': 'click',
+                                  'id': rng.randint(0, NUM_CATEGORIES)}}
+
+    return [
+        ('GET /questions', 'GET', page, None),
+        ('GET /questions cursor', 'GET', cursor, None),
+        ('GET /categories/<id>/questions', 'GET', category_page, None),
+        ('POST /questions search', 'POST', lambda rng: '/questions',
+         lambda rng: {'searchTerm': rng.choice(WORDS)}),
+        ('POST /quizzes', 'POST', lambda rng: '/quizzes', quiz_body),
+        ('POST /quizzes/deck', 'POST', lambda rng: '/quizzes/deck',
+         quiz_body),
+    ]
+
+
+def percentile(sorted_values, fraction):
+    index = min(int(len(sorted_values) * fraction), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def time_endpoint(client, method, path, body, num_requests, warmup, rng):
+    '''
+    Returns the latency percentiles and throughput of one endpoint
+    '''
+    latencies = []
+    errors = 0
+    for request_number in range(warmup + num_requests):
+        request_path = path(rng)
+        request_body = body(rng) if body else None
+        start = time.perf_counter()
+        response = client.open(request_path, method=method,
+                               json=request_body)
+        elapsed = time.perf_counter() - start
+        if request_number < warmup:
+            continue
+        latencies.append(elapsed)
+        if response.status_code != OK:
+            errors += 1
+    latencies.sort()
+    return {
+        'requests': num_requests,
+        'errors': errors,
+        'requests_per_second': num_requests / sum(latencies),
+        'mean_ms': sum(latencies) / num_requests * 1000,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+    }
+
+
+def run(sizes, num_requests, warmup, output):
+    report = {
+        'created_at': datetime.utcnow().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'requests': num_requests,
+        'results': {},
+    }
+    print(f'{"questions":>10} {"endpoint":<32} {"req/s":>8} {"p50 ms":>8}'
+          f' {"p95 ms":>8} {"p99 ms":>8} {"errors":>6}')
+    for num_questions in sizes:
+        database_file = tempfile.NamedTemporaryFile(
+            suffix='.db', delete=False)
+        database_file.close()
+        app = create_app({
+            'SQLALCHEMY_DATABASE_URI': f'sqlite:///{database_file.name}'})
+        with app.app_context():
+            seed(num_questions)
+        client = app.test_client()
+        rng = random.Random(RANDOM_SEED)
+        results = report['results'][f'{num_questions}'] = {}
+        for name, method, path, body in scenarios(num_questions):
+            result = results[name] = time_endpoint(
+                client, method, path, body, num_requests, warmup, rng)
+            print(f'{num_questions:>10} {name:<32}'
+                  f' {result["requests_per_second"]:>8.0f}'
+                  f' {result["p50_ms"]:>8.2f} {result["p95_ms"]:>8.2f}'
+                  f' {result["p99_ms"]:>8.2f} {result["errors"]:>6}')
+        with app.app_context():
+            db.session.remove()
+            db.get_engine(app).dispose()
+        os.remove(database_file.name)
+    with open(output, 'w') as output_file:
+        json.dump(report, output_file, indent=2)
+    print(f'wrote {output}')
+
+
+def compare(baseline_path, current_path, threshold):
+    '''
+    Prints how each endpoint's latency changed between two runs
+
+        Returns:
+                regressions: the number of endpoints whose p50, p95 or p99
+                 latency grew, or whose throughput fell, by more than
+                 threshold
+    '''
+    with open(baseline_path) as baseline_file:
+        baseline = json.load(baseline_file)['results']
+    with open(current_path) as current_file:
+        current = json.load(current_file)['results']
+    regressions = 0
+    print(f'{"questions":>10} {"endpoint":<32} {"p50":>8} {"p95":>8}'
+          f' {"p99":>8} {"req/s":>8}')
+    for size, endpoints in current.items():
+        for name, result in endpoints.items():
+            before = baseline.get(size, {}).get(name)
+            if before is None:
+                continue
+            changes = {key: result[key] / before[key] - 1 for key in (
+                'p50_ms', 'p95_ms', 'p99_ms', 'requests_per_second')}
+            regressed = any(changes[key] > threshold for key in (
+                'p50_ms', 'p95_ms', 'p99_ms')) or \
+                changes['requests_per_second'] < -threshold
+            regressions += regressed
+            print(f'{size:>10} {name:<32}'
+                  f' {changes["p50_ms"]:>+8.1%} {changes["p95_ms"]:>+8.1%}'
+                  f' {changes["p99_ms"]:>+8.1%}'
+                  f' {changes["requests_per_second"]:>+8.1%}'
+                  f'{"  REGRESSION" if regressed else ""}')
+    print(f'{regressions} regression(s) above {threshold:.0%}')
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=DEFAULT_SIZES)
+    parser.add_argument('--requests', type=int, default=DEFAULT_REQUESTS,
+                        help='timed requests per endpoint and size')
+    parser.add_argument('--warmup', type=int, default=DEFAULT_WARMUP)
+    parser.add_argument('--output', default='bench_endpoints.json')
+    parser.add_argument('--compare', nargs=2,
+                        metavar=('BASELINE', 'CURRENT'),
+                        help='compare two result files instead of running')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='relative slowdown flagged as a regression')
+    args = parser.parse_args()
+    if args.compare:
+        sys.exit(1 if compare(*args.compare, args.threshold) else 0)
+    run(args.sizes, args.requests, args.warmup, args.output)
@@ -0,0 +1,90 @@
+'''
+Micro-benchmark of serializing and compressing a /questions payload
+
+run from the backend folder:
+python benchmarks/bench_json.py
+python benchmarks/bench_json.py --sizes 10 100 --repeat 500
+'''
+
+import argparse
+import gzip
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+os.environ.setdefault('DB_USER', 'student')
+os.environ.setdefault('DB_PASSWORD', 'student')
+
+from flask import Flask  # noqa: E402
+
+from flaskr.compression import brotli  # noqa: E402
+from flaskr.json_provider import (  # noqa: E402
+    StdlibJSONProvider, OrjsonProvider, orjson)
+
+DEFAULT_SIZES = [10, 100, 1000, 10000]
+DEFAULT_REPEAT = 50
+NUM_CATEGORIES = 6
+
+
+def questions_payload(num_questions):
+    '''Returns a payload shaped like a GET /questions response'''
+    categories = {f'{category_id}': f'Category {category_id}'
+                  for category_id in range(1, NUM_CATEGORIES + 1)}
+    return {
+        'success': True,
+        'questions': [{
+            'id': question_id,
+            'question': f'What is the answer to question number {question_id}'
+                        f' of the synthetic trivia question bank?',
+            'answer': f'Answer {question_id}',
+            'category': f'{question_id % NUM_CATEGORIES + 1}',
+            'difficulty': question_id % 5 + 1
+        } for question_id in range(1, num_questions + 1)],
+        'total_questions': num_questions,
+        'categories': categories,
+        'current_category': 'Science'
+    }
+
+
+def time_ms(function, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = function()
+    return (time.perf_counter() - start) / repeat * 1000, result
+
+
+def run(sizes, repeat):
+    app = Flask(__name__)
+    providers = [StdlibJSONProvider(app)]
+    if orjson is not None:
+        providers.append(OrjsonProvider(app))
+    else:
+        print('orjson is not installed, only timing the stdlib provider')
+    print(f'{"questions":>10} {"provider":>9} {"dumps ms":>9} {"bytes":>9}'
+          f' {"gzip ms":>8} {"gzip bytes":>11} {"br ms":>7} {"br bytes":>9}')
+    for num_questions in sizes:
+        payload = questions_payload(num_questions)
+        for provider in providers:
+            dumps_ms, body = time_ms(
+                lambda: provider.dumps(payload), repeat)
+            gzip_ms, gzipped = time_ms(
+                lambda: gzip.compress(body, compresslevel=6), repeat)
+            br_ms, br_bytes = '', ''
+            if brotli is not None:
+                br_ms, compressed = time_ms(
+                    lambda: brotli.compress(body, quality=4), repeat)
+                br_ms, br_bytes = f'{br_ms:.3f}', len(compressed)
+            print(f'{num_questions:>10} {provider.name:>9} {dumps_ms:>9.3f}'
+                  f' {len(body):>9} {gzip_ms:>8.3f} {len(gzipped):>11}'
+                  f' {br_ms:>7} {br_bytes:>9}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=DEFAULT_SIZES)
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT)
+    args = parser.parse_args()
+    run(args.sizes, args.repeat)
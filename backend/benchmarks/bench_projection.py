@@ -0,0 +1,108 @@
+'''
+Benchmark for turning question rows into response dicts
+
+Compares loading Question instances and formatting them, the way the list
+routes used to, with selecting only the needed columns and formatting the
+rows directly, with every field and without the answer. Reports the CPU
+time and the peak memory allocated per row for one response of --rows
+questions.
+
+run from the backend folder:
+python benchmarks/bench_projection.py
+python benchmarks/bench_projection.py --rows 1000 --repeat 20
+'''
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+os.environ.setdefault('DB_USER', 'student')
+os.environ.setdefault('DB_PASSWORD', 'student')
+
+from sqlalchemy import select  # noqa: E402
+
+from flaskr import create_app  # noqa: E402
+from flaskr.queries import (  # noqa: E402
+    question_columns, format_question, QUESTION_FIELDS)
+from flaskr.seed import seed_questions  # noqa: E402
+from models import db, Question  # noqa: E402
+
+DEFAULT_ROWS = 10000
+DEFAULT_REPEAT = 5
+WITHOUT_ANSWER = ('id', 'question', 'category', 'difficulty')
+
+
+def orm_page(num_rows):
+    '''the list routes before column projection: load Questions, format'''
+    question_selection = Question.query.order_by(Question.id).limit(
+        num_rows).all()
+    return [question.format() for question in question_selection]
+
+
+def projected_page(num_rows, fields=QUESTION_FIELDS):
+    '''select only the columns of the fields and format the rows'''
+    rows = db.session.execute(select(question_columns(fields)).order_by(
+        Question.id).limit(num_rows))
+    return [format_question(row, fields) for row in rows]
+
+
+def measure(page, num_rows, repeat):
+    '''
+    Returns the median milliseconds of a page and the peak bytes it
+    allocates, with a fresh session each time
+    '''
+    timings = []
+    for _ in range(repeat):
+        db.session.remove()
+        start = time.perf_counter()
+        page()
+        timings.append((time.perf_counter() - start) * 1000)
+    db.session.remove()
+    tracemalloc.start()
+    page()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    db.session.remove()
+    return statistics.median(timings), peak
+
+
+def run(num_rows, repeat):
+    database_file = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+    database_file.close()
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{database_file.name}'})
+    with app.app_context():
+        db.create_all()
+        for _ in seed_questions(num_rows):
+            pass
+        pages = [
+            ('Question.format()', lambda: orm_page(num_rows)),
+            ('columns, every field', lambda: projected_page(num_rows)),
+            ('columns, no answer',
+             lambda: projected_page(num_rows, WITHOUT_ANSWER)),
+        ]
+        print(f'{num_rows} rows per response')
+        print(f'{"":<22} {"ms":>8} {"us/row":>8} {"peak KiB":>9}'
+              f' {"bytes/row":>10}')
+        for name, page in pages:
+            page_ms, peak = measure(page, num_rows, repeat)
+            print(f'{name:<22} {page_ms:>8.1f}'
+                  f' {page_ms * 1000 / num_rows:>8.2f}'
+                  f' {peak / 1024:>9.0f} {peak / num_rows:>10.0f}')
+        db.session.remove()
+        db.get_engine(app).dispose()
+    os.remove(database_file.name)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=DEFAULT_ROWS)
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT)
+    args = parser.parse_args()
+    run(args.rows, args.repeat)
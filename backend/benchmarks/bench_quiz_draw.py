@@ -0,0 +1,103 @@
+'''
+Benchmark for drawing quiz questions as the question bank grows
+
+run from the backend folder:
+python benchmarks/bench_quiz_draw.py
+python benchmarks/bench_quiz_draw.py --sizes 100 10000 --legacy
+'''
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+os.environ.setdefault('DB_USER', 'student')
+os.environ.setdefault('DB_PASSWORD', 'student')
+
+from flaskr import create_app  # noqa: E402
+from flaskr.quiz import QuizDrawEngine  # noqa: E402
+from models import db, Question, Category  # noqa: E402
+
+DEFAULT_SIZES = [100, 1000, 10000, 100000, 1000000]
+NUM_CATEGORIES = 6
+NUM_DRAWS = 200
+NUM_PREVIOUS_QUESTIONS = 20
+INSERT_BATCH_SIZE = 50000
+
+
+def seed(num_questions):
+    '''
+    Fills the DB with num_questions synthetic questions spread evenly over
+    the categories
+    '''
+    db.create_all()
+    db.session.execute(Category.__table__.insert(), [
+        {'id': category_id, 'type': f'Category {category_id}'}
+        for category_id in range(1, NUM_CATEGORIES + 1)])
+    for start in range(1, num_questions + 1, INSERT_BATCH_SIZE):
+        stop = min(start + INSERT_BATCH_SIZE, num_questions + 1)
+        db.session.execute(Question.__table__.insert(), [
+            {'id': question_id,
+             'question': f'Question {question_id}?',
+             'answer': f'Answer {question_id}',
+             'category': question_id % NUM_CATEGORIES + 1,
+             'difficulty': question_id % 5 + 1}
+            for question_id in range(start, stop)])
+    db.session.commit()
+
+
+def legacy_draw(category_id, excluded):
+    '''the draw used before the id index: load every remaining row'''
+    question_selection = Question.query.filter_by(
+        category=category_id).filter(
+        Question.id.notin_(list(excluded))).all()
+    return [question.format() for question in question_selection]
+
+
+def time_draws(draw):
+    '''Returns the mean latency of a draw in milliseconds'''
+    excluded = set(range(1, NUM_PREVIOUS_QUESTIONS + 1))
+    start = time.perf_counter()
+    for draw_number in range(NUM_DRAWS):
+        category_id = draw_number % NUM_CATEGORIES + 1
+        draw(category_id, excluded)
+    return (time.perf_counter() - start) / NUM_DRAWS * 1000
+
+
+def run(sizes, include_legacy):
+    print(f'{"questions":>10} {"index build ms":>15} {"draw ms":>10}'
+          f'{" legacy ms":>12}')
+    for num_questions in sizes:
+        database_file = tempfile.NamedTemporaryFile(
+            suffix='.db', delete=False)
+        database_file.close()
+        app = create_app({
+            'SQLALCHEMY_DATABASE_URI': f'sqlite:///{database_file.name}'})
+        with app.app_context():
+            seed(num_questions)
+            engine = QuizDrawEngine(max_age=None)
+            start = time.perf_counter()
+            engine.get_ids(0)
+            build_ms = (time.perf_counter() - start) * 1000
+            draw_ms = time_draws(engine.draw)
+            legacy_ms = ''
+            if include_legacy:
+                legacy_ms = f'{time_draws(legacy_draw):.3f}'
+            db.session.remove()
+            db.get_engine(app).dispose()
+        os.remove(database_file.name)
+        print(f'{num_questions:>10} {build_ms:>15.1f} {draw_ms:>10.3f}'
+              f'{legacy_ms:>12}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=DEFAULT_SIZES)
+    parser.add_argument('--legacy', action='store_true',
+                        help='also time the full-selection draw')
+    args = parser.parse_args()
+    run(args.sizes, args.legacy)
@@ -0,0 +1,167 @@
+'''
+Closed-loop load test of the Flask (WSGI) and async (ASGI) serving modes
+
+Runs a rising number of concurrent clients, each playing the quiz and
+paging through questions back to back, against every given server and
+reports the most clients each sustains with a p99 latency under the
+target.
+
+start the servers from the backend folder, one worker each, e.g.:
+gunicorn --threads 16 -b 127.0.0.1:5000 "flaskr:create_app()"
+uvicorn --factory flaskr.asgi:create_asgi_app --port 8000
+
+then run:
+python benchmarks/load_test.py --url sync=http://127.0.0.1:5000 \
+    --url async=http://127.0.0.1:8000
+'''
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from urllib.parse import urlsplit
+
+DEFAULT_CLIENTS = [1, 8, 32, 128, 512]
+DEFAULT_DURATION = 10  # seconds per step
+DEFAULT_P99_MS = 100
+NUM_CATEGORIES = 6
+NUM_PAGES = 2
+
+
+class Connection:
+    '''A minimal keep-alive HTTP/1.1 client connection'''
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = self.writer = None
+
+    async def request(self, method, path, body=None):
+        '''Sends a request and returns the response status'''
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(
+                self.host, self.port)
+        payload = b'' if body is None else json.dumps(body).encode()
+        head = f'{method} {path} HTTP/1.1\r\nHost: {self.host}\r\n' \
+            f'Content-Length: {len(payload)}\r\n'
+        if body is not None:
+            head += 'Content-Type: application/json\r\n'
+        self.writer.write(head.encode() + b'\r\n' + payload)
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionError('server closed the connection')
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b''):
+                break
+            name, _, value = line.decode().partition(':')
+            headers[name.strip().lower()] = value.strip()
+        keep_alive = status_line.startswith(b'HTTP/1.1') and \
+            headers.get('connection', '').lower() != 'close'
+        if 'content-length' in headers:
+            await self.reader.readexactly(int(headers['content-length']))
+        else:
+            await self.reader.read()
+            keep_alive = False
+        if not keep_alive:
+            self.close()
+        return int(status_line.split()[1])
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+async def play(connection, deadline, latencies, errors):
+    '''Plays quiz rounds and pages questions until the deadline'''
+    previous_questions = []
+    while time.monotonic() < deadline:
+        if random.random() < 0.5:
+            method, path = 'GET', f'/questions?page=' \
+                f'{random.randint(1, NUM_PAGES)}'
+            body = None
+        else:
+            method, path = 'POST', '/quizzes'
+            body = {'previous_questions': previous_questions[-5:],
+                    'quiz_category': {
+                        'type': 'click',
+                        'id': random.randint(0, NUM_CATEGORIES)}}
+        start = time.monotonic()
+        try:
+            status = await connection.request(method, path, body)
+        except (OSError, asyncio.IncompleteReadError):
+            connection.close()
+            errors.append(1)
+            continue
+        latencies.append(time.monotonic() - start)
+        if status >= 400:
+            errors.append(status)
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return float('nan')
+    index = min(int(len(sorted_values) * fraction), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+async def run_step(host, port, num_clients, duration):
+    latencies, errors = [], []
+    connections = [Connection(host, port) for _ in range(num_clients)]
+    deadline = time.monotonic() + duration
+    await asyncio.gather(*(play(connection, deadline, latencies, errors)
+                           for connection in connections))
+    for connection in connections:
+        connection.close()
+    latencies.sort()
+    return {
+        'clients': num_clients,
+        'requests_per_second': len(latencies) / duration,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'errors': len(errors),
+    }
+
+
+async def run(urls, client_counts, duration, p99_ms):
+    sustained = {}
+    print(f'{"mode":>8} {"clients":>8} {"req/s":>9} {"p50 ms":>9}'
+          f' {"p99 ms":>9} {"errors":>7}')
+    for name, url in urls:
+        parts = urlsplit(url)
+        sustained[name] = 0
+        for num_clients in client_counts:
+            step = await run_step(parts.hostname, parts.port or 80,
+                                  num_clients, duration)
+            print(f'{name:>8} {step["clients"]:>8}'
+                  f' {step["requests_per_second"]:>9.0f}'
+                  f' {step["p50_ms"]:>9.1f} {step["p99_ms"]:>9.1f}'
+                  f' {step["errors"]:>7}')
+            if step['p99_ms'] > p99_ms or step['errors']:
+                break
+            sustained[name] = num_clients
+    for name, num_clients in sustained.items():
+        print(f'{name} sustains {num_clients} clients at p99 <= {p99_ms} ms')
+
+
+def parse_url(value):
+    name, _, url = value.partition('=')
+    if not url:
+        raise argparse.ArgumentTypeError('expected name=url')
+    return name, url
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--url', type=parse_url, action='append',
+                        required=True, help='name=base url of a server')
+    parser.add_argument('--clients', type=int, nargs='+',
+                        default=DEFAULT_CLIENTS)
+    parser.add_argument('--duration', type=float, default=DEFAULT_DURATION)
+    parser.add_argument('--p99-ms', type=float, default=DEFAULT_P99_MS)
+    args = parser.parse_args()
+    asyncio.run(run(args.url, args.clients, args.duration, args.p99_ms))
@@ -4,15 +4,63 @@ export FLASK_ENV=development
 flask run
 '''
 
+import io
+import json
 import os
-from flask import Flask, request, abort, jsonify
+import time
+import click
+from flask import (
+    Flask, Response, g, request, abort, stream_with_context)
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
-import random
+from sqlalchemy.exc import IntegrityError, TimeoutError as PoolTimeoutError
 
-from models import setup_db, Question, Category
+from models import (
+    setup_db, replica_bind_keys, db, Question)
+from .admission import (
+    AdmissionControl, is_overload_error, READS, WRITES, QUIZ_DRAWS,
+    RATE_LIMITED, DEFAULT_QUEUE_TIMEOUT, DEFAULT_RETRY_AFTER)
+from .bulk_import import (
+    import_questions, IMPORT_BATCH_SIZE, MAX_IMPORT_BATCH_SIZE,
+    IMPORT_FORMATS, NDJSON, CSV)
+from .categories import CategoryCache
+from .compression import (
+    compress_response, DEFAULT_COMPRESS_MIN_SIZE, DEFAULT_COMPRESS_LEVEL)
+from .conditional import (
+    InProcessContentVersion, SqliteContentVersion, track_content_version,
+    make_etag, is_not_modified)
+from .export import export_questions, EXPORT_FORMATS, EXPORT_MIMETYPES
+from .json_provider import create_json_provider, jsonify
+from .metrics import (
+    RequestMetrics, start_request_timer, current_timer, add_time,
+    METRICS_MIMETYPE)
+from .migrations import create_schema
+from .pagination import fetch_page, COUNT_MODES, EXACT
+from .quiz import (
+    QuizDrawEngine, ALL_CATEGORIES, DEFAULT_INDEX_MAX_AGE, DEFAULT_DECK_SIZE,
+    MAX_DECK_SIZE)
+from .queries import (
+    count_questions_statement, questions_statement, question_columns,
+    format_question, QUESTION_FIELDS)
+from .quiz_sessions import (
+    InProcessSessionStore, QuizSession, new_session_id, DEFAULT_SESSION_TTL)
+from .response_cache import (
+    ResponseCache, InProcessResponseStore, normalize_term,
+    DEFAULT_RESPONSE_CACHE_TTL, DEFAULT_RESPONSE_CACHE_MAX_ENTRIES,
+    DEFAULT_RESPONSE_CACHE_MAX_BYTES)
+from .replicas import (
+    ReplicaRouter, route_reads, has_written, DEFAULT_STICKY_SECONDS)
+from .results import (
+    ResultWriter, Leaderboard, new_result, ALL_GAMES, MAX_PLAYER_LENGTH,
+    MAX_TOTAL_QUESTIONS, DEFAULT_FLUSH_SIZE, DEFAULT_FLUSH_INTERVAL,
+    DEFAULT_MAX_PENDING, DEFAULT_LEADERBOARD_SIZE,
+    DEFAULT_LEADERBOARD_MAX_AGE)
+from .search import create_search_backend
+from .seed import seed_questions, DEFAULT_SEED, SEED_BATCH_SIZE
+from .startup import add_warm_up_hook
 
 OK = 200
+ACCEPTED = 202
 BAD_REQUEST = 400
 BAD_REQUEST_MSG = "Bad Request"
 RESOURCE_NOT_FOUND = 404
@@ -21,20 +69,257 @@ METHOD_NOT_ALLOWED = 405
 METHOD_NOT_ALLOWED_MSG = "Method Not Allowed"
 UNPROCESSABLE_ENTITY = 422
 UNPROCESSABLE_ENTITY_MSG = "Unprocessable Entity"
+TOO_MANY_REQUESTS = 429
+TOO_MANY_REQUESTS_MSG = "Too Many Requests"
+SERVICE_UNAVAILABLE = 503
+SERVICE_UNAVAILABLE_MSG = "Service Unavailable"
+NOT_MODIFIED = 304
 QUESTIONS_PER_PAGE = 10
+MAX_QUESTIONS_PER_PAGE = 100
+# endpoints whose responses don't follow the question bank content version
+UNVERSIONED_ENDPOINTS = ('get_metrics', 'get_leaderboard')
+# endpoints served whatever the load, None for requests matching no route
+UNADMITTED_ENDPOINTS = ('get_metrics', 'static', None)
+QUIZ_ENDPOINTS = ('get_new_quiz_question', 'get_quiz_deck',
+                  'create_quiz_session', 'get_next_session_question',
+                  'end_quiz_session')
+SEARCH_ENDPOINT = 'search_questions_by_string_or_add_question'
 current_category = "Science"
 
 
 def create_app(test_config=None):
     # create and configure the app
     app = Flask(__name__)
-    setup_db(app)
+    if test_config is not None:
+        app.config.from_mapping(test_config)
+    setup_db(app, app.config.get('SQLALCHEMY_DATABASE_URI'))
+    app.json_provider = create_json_provider(app)
+    replica_router = ReplicaRouter(
+        replica_bind_keys(app),
+        app.config.get('REPLICA_STICKY_SECONDS', DEFAULT_STICKY_SECONDS))
+    category_cache = CategoryCache(ttl=app.config.get('CATEGORY_CACHE_TTL'))
+    quiz_engine = QuizDrawEngine(
+        max_age=app.config.get('QUIZ_INDEX_MAX_AGE', DEFAULT_INDEX_MAX_AGE))
+    quiz_sessions = app.config.get('QUIZ_SESSION_STORE') or \
+        InProcessSessionStore(
+            ttl=app.config.get('QUIZ_SESSION_TTL', DEFAULT_SESSION_TTL))
+    question_search = create_search_backend(app)
+    content_version = app.config.get('CONTENT_VERSION_STORE')
+    if content_version is None and app.config.get('CONTENT_VERSION_PATH'):
+        content_version = SqliteContentVersion(
+            app.config['CONTENT_VERSION_PATH'])
+    elif content_version is None:
+        content_version = InProcessContentVersion()
+    track_content_version(content_version)
+    cache_control = app.config.get('CACHE_CONTROL', 'no-cache')
+    compress_min_size = app.config.get(
+        'COMPRESS_MIN_SIZE', DEFAULT_COMPRESS_MIN_SIZE)
+    compress_level = app.config.get('COMPRESS_LEVEL', DEFAULT_COMPRESS_LEVEL)
+    response_cache = None
+    if app.config.get('RESPONSE_CACHE', True):
+        response_cache = ResponseCache(
+            app.config.get('RESPONSE_CACHE_STORE') or InProcessResponseStore(
+                ttl=app.config.get(
+                    'RESPONSE_CACHE_TTL', DEFAULT_RESPONSE_CACHE_TTL),
+                max_entries=app.config.get(
+                    'RESPONSE_CACHE_MAX_ENTRIES',
+                    DEFAULT_RESPONSE_CACHE_MAX_ENTRIES),
+                max_bytes=app.config.get(
+                    'RESPONSE_CACHE_MAX_BYTES',
+                    DEFAULT_RESPONSE_CACHE_MAX_BYTES)),
+            content_version)
+    admission = None
+    if app.config.get('ADMISSION_CONTROL', True):
+        admission = AdmissionControl(
+            limits=app.config.get('ADMISSION_LIMITS'),
+            queue_timeout=app.config.get(
+                'ADMISSION_QUEUE_TIMEOUT', DEFAULT_QUEUE_TIMEOUT),
+            rate_limits=app.config.get('RATE_LIMITS'),
+            retry_after=app.config.get(
+                'ADMISSION_RETRY_AFTER', DEFAULT_RETRY_AFTER))
+    request_metrics = RequestMetrics() if app.config.get('METRICS', True) \
+        else None
+    result_writer = ResultWriter(
+        app,
+        flush_size=app.config.get('RESULTS_FLUSH_SIZE', DEFAULT_FLUSH_SIZE),
+        flush_interval=app.config.get(
+            'RESULTS_FLUSH_INTERVAL', DEFAULT_FLUSH_INTERVAL),
+        max_pending=app.config.get(
+            'RESULTS_MAX_PENDING', DEFAULT_MAX_PENDING))
+    leaderboard = Leaderboard(
+        result_writer,
+        size=app.config.get('LEADERBOARD_SIZE', DEFAULT_LEADERBOARD_SIZE),
+        max_age=app.config.get(
+            'LEADERBOARD_MAX_AGE', DEFAULT_LEADERBOARD_MAX_AGE))
+    # filled on first use, or before the first request by startup.warm_up
+    add_warm_up_hook(app, 'categories', category_cache.get_formatted)
+    add_warm_up_hook(app, 'quiz', lambda: quiz_engine.get_ids(ALL_CATEGORIES))
+    add_warm_up_hook(app, 'search', question_search.warm_up)
+    add_warm_up_hook(app, 'leaderboard', leaderboard.load)
     # //future reference for configuration
     # https://flask-cors.corydolphin.com/en/latest/api.html#extension
     # https://flask-cors.readthedocs.io/en/latest/
     CORS(app, origin='*')
     # CORS Headers
 
+    @app.cli.command('create-search-index')
+    def create_search_index():
+        '''Creates the indexes used by question search'''
+        question_search.create_index()
+
+    @app.cli.command('migrate')
+    def migrate_command():
+        '''Creates the tables, and columns and indexes, missing from the DB'''
+        for name in create_schema():
+            click.echo(f'applied {name}')
+
+    @app.cli.command('import-questions')
+    @click.argument('file', type=click.File('r', encoding='utf-8'))
+    @click.option('--format', 'import_format', type=click.Choice(
+        IMPORT_FORMATS), help='defaults to the file extension')
+    @click.option('--batch-size', default=IMPORT_BATCH_SIZE)
+    def import_questions_command(file, import_format, batch_size):
+        '''Imports questions from an NDJSON or CSV file, - for stdin'''
+        if import_format is None:
+            import_format = CSV if file.name.endswith('.csv') else NDJSON
+        for batch in import_questions(
+                file, import_format, batch_size,
+                category_cache.get_formatted().keys()):
+            click.echo(json.dumps(batch))
+
+    @app.cli.command('export-questions')
+    @click.argument('file', type=click.File('w', encoding='utf-8'))
+    @click.option('--format', 'export_format', type=click.Choice(
+        EXPORT_FORMATS), help='defaults to the file extension')
+    @click.option('--category', type=int)
+    @click.option('--difficulty', type=int)
+    def export_questions_command(file, export_format, category, difficulty):
+        '''Exports questions to an NDJSON or CSV file, - for stdout'''
+        if export_format is None:
+            export_format = CSV if file.name.endswith('.csv') else NDJSON
+        for chunk in export_questions(export_format, category, difficulty):
+            file.write(chunk)
+
+    @app.cli.command('seed')
+    @click.option('--questions', 'num_questions', default=10000)
+    @click.option('--seed', 'random_seed', default=DEFAULT_SEED,
+                  help='the same seed loads the same questions')
+    @click.option('--batch-size', default=SEED_BATCH_SIZE)
+    def seed_command(num_questions, random_seed, batch_size):
+        '''Loads generated questions into the DB'''
+        start = time.perf_counter()
+        inserted = 0
+        for batch_inserted in seed_questions(
+                num_questions, random_seed, batch_size):
+            inserted += batch_inserted
+        elapsed = time.perf_counter() - start
+        click.echo(f'inserted {inserted} questions in {elapsed:.1f}s '
+                   f'({inserted / elapsed:.0f}/s)')
+
+    if request_metrics is not None:
+        app.before_request(start_request_timer)
+
+        @app.after_request
+        def record_request_metrics(response):
+            '''
+            Records the timings of the request and reports them in a
+            Server-Timing header, after every other after_request hook
+            '''
+            timer = current_timer()
+            if timer is not None:
+                total = request_metrics.observe(request, response, timer)
+                response.headers['Server-Timing'] = timer.server_timing(total)
+            return response
+
+        @app.route('/metrics')
+        def get_metrics():
+            '''
+            Returns the request histograms, the response cache hit and
+            miss counters and the shed request counter, in the Prometheus
+            format
+            '''
+            body = request_metrics.render()
+            if response_cache is not None:
+                body += response_cache.render()
+            if admission is not None:
+                body += admission.render()
+            return Response(body, mimetype=METRICS_MIMETYPE)
+
+    @app.before_request
+    def choose_read_db():
+        '''Sends the queries of a GET to the next read replica, if any'''
+        g.read_replica = replica_router.choose(request)
+        if g.read_replica is not None:
+            route_reads(db.session, g.read_replica)
+
+    @app.before_request
+    def answer_conditional_get():
+        '''
+        Answers a GET for content the client already holds with a 304,
+        before the view queries the DB
+        '''
+        if request.method not in ('GET', 'HEAD') or \
+                request.endpoint in UNVERSIONED_ENDPOINTS:
+            return None
+        version, modified_at = content_version.current()
+        g.etag = make_etag(content_version, version)
+        g.last_modified = modified_at
+        if is_not_modified(request, g.etag):
+            response = Response(status=NOT_MODIFIED)
+            add_cache_headers(response)
+            return response
+        return None
+
+    def get_route_class(request):
+        '''
+        Returns the route class a request is admitted in: READS for GETs
+        and searches, QUIZ_DRAWS for the quiz game and WRITES for the
+        rest, or None for a request served whatever the load
+        '''
+        if request.method == 'OPTIONS' or \
+                request.endpoint in UNADMITTED_ENDPOINTS:
+            return None
+        if request.endpoint in QUIZ_ENDPOINTS:
+            return QUIZ_DRAWS
+        if request.method in ('GET', 'HEAD'):
+            return READS
+        if request.endpoint == SEARCH_ENDPOINT:
+            body = request.get_json(silent=True)
+            if isinstance(body, dict) and body.get('searchTerm'):
+                return READS
+        return WRITES
+
+    if admission is not None:
+        @app.before_request
+        def admit_request():
+            '''
+            Sheds a request over its route class's concurrency limit, or
+            its client's rate limit, before the view queries the DB. A
+            conditional GET answered with a 304 is never shed.
+            '''
+            route_class = get_route_class(request)
+            if route_class is None:
+                return None
+            reason, g.retry_after = admission.admit(
+                route_class, request.remote_addr)
+            if reason == RATE_LIMITED:
+                abort(TOO_MANY_REQUESTS)
+            if reason is not None:
+                abort(SERVICE_UNAVAILABLE)
+            g.admitted_route_class = route_class
+            return None
+
+        @app.teardown_request
+        def release_admission(exception):
+            route_class = g.pop('admitted_route_class', None)
+            if route_class is not None:
+                admission.release(route_class)
+
+    def add_cache_headers(response):
+        # weak, gzip and brotli encodings of a response share the ETag
+        response.set_etag(g.etag, weak=True)
+        response.headers['Cache-Control'] = cache_control
+
     @app.after_request
     def after_request(response):
         response.headers.add(
@@ -43,8 +328,30 @@ def create_app(test_config=None):
         response.headers.add(
             'Access-Control-Allow-Methods',
             'GET,PUT,POST,DELETE,OPTIONS')
+        if replica_router.bind_keys and has_written(db.session):
+            replica_router.stick_to_primary(response)
+        # a replica may not have the latest write yet, so don't let
+        # the client cache what it read under the latest version
+        if 'etag' in g and response.status_code == OK and \
+                not replica_router.may_lag(g.read_replica, g.last_modified):
+            add_cache_headers(response)
+        if app.config.get('COMPRESS', True):
+            start = time.perf_counter()
+            compress_response(response, request.accept_encodings,
+                              compress_min_size, compress_level)
+            add_time('compress', time.perf_counter() - start)
         return response
 
+    def abort_unprocessable(error):
+        '''
+        Answers a request that failed with error with a 422, unless the DB
+        was too busy to serve it, when a retry later may succeed, with a
+        503
+        '''
+        if is_overload_error(error):
+            abort(SERVICE_UNAVAILABLE)
+        abort(UNPROCESSABLE_ENTITY)
+
     def get_current_index(request):
         '''
         Returns a formatted list of trivia questions
@@ -58,28 +365,165 @@ def create_app(test_config=None):
         selected_page = request.args.get('page', 1, type=int)
         return selected_page - 1
 
-    def format_questions(question_selection):
+    def get_page_size(request):
+        '''
+        Returns the number of questions per page for cursor pagination
+            Parameters:
+                     request: http request data
+
+            Returns:
+                    page_size: the 'limit' value contained in the request
+                     data, capped at QUESTIONS_PAGE_SIZE_MAX
+        '''
+        max_page_size = app.config.get(
+            'QUESTIONS_PAGE_SIZE_MAX', MAX_QUESTIONS_PER_PAGE)
+        page_size = request.args.get('limit', QUESTIONS_PER_PAGE, type=int)
+        return min(max(page_size, 1), max_page_size)
+
+    def get_import_batch_size(request):
+        '''
+        Returns the number of questions per batch of a bulk import
+            Parameters:
+                     request: http request data
+
+            Returns:
+                    batch_size: the 'batch_size' value contained in the
+                     request data, capped at IMPORT_BATCH_SIZE_MAX
+        '''
+        max_batch_size = app.config.get(
+            'IMPORT_BATCH_SIZE_MAX', MAX_IMPORT_BATCH_SIZE)
+        batch_size = request.args.get(
+            'batch_size', IMPORT_BATCH_SIZE, type=int)
+        return min(max(batch_size, 1), max_batch_size)
+
+    def get_pagination(request):
+        '''
+        Returns the requested page of a question listing
+            Parameters:
+                     request: http request data, an 'after' question id
+                      selects cursor pagination, otherwise 'page' is used
+
+            Returns:
+                    after: the cursor, None in page mode
+                    offset: the number of questions before the page
+                    page_size: the number of questions on the page
+        '''
+        after = request.args.get('after', None, type=int)
+        if after is None:
+            current_index = get_current_index(request)
+            return None, current_index * QUESTIONS_PER_PAGE, \
+                QUESTIONS_PER_PAGE
+        return after, 0, get_page_size(request)
+
+    def get_count_mode(request):
+        '''
+        Returns how the total number of questions should be counted, the
+        'count' value contained in the request data: 'exact' (default),
+        'estimate' for a planner estimate on very large tables, or 'none'
+        '''
+        count_mode = request.args.get('count', EXACT)
+        return count_mode if count_mode in COUNT_MODES else EXACT
+
+    def get_fields(request):
+        '''
+        Returns the question fields a response should hold, the 'fields'
+        value contained in the request data: a comma separated subset of
+        id, question, answer, category and difficulty, all by default
+        '''
+        fields = request.args.get('fields')
+        if not fields:
+            return QUESTION_FIELDS
+        fields = fields.split(',')
+        if not set(fields) <= set(QUESTION_FIELDS):
+            abort(UNPROCESSABLE_ENTITY)
+        return tuple(field for field in QUESTION_FIELDS if field in fields)
+
+    def get_listing_params(request, fields):
+        '''
+        Returns everything in the request data that selects a page of a
+        question listing, to key its cached response by
+        '''
+        after, offset, page_size = get_pagination(request)
+        return {'fields': fields, 'after': after, 'offset': offset,
+                'page_size': page_size, 'count': get_count_mode(request)}
+
+    def cached_response(route, params, build_response):
+        '''
+        Returns the response of a listing or search, from the response
+        cache when an identical request was answered since the questions
+        last changed
+            Parameters:
+                     route: the name the response is cached and counted by
+                     params: whatever else selects the response
+                     build_response: makes the response on a cache miss
+        '''
+        if response_cache is None:
+            return build_response()
+        key = response_cache.key(route, **params)
+        body = response_cache.get(route, key)
+        if body is not None:
+            return app.response_class(
+                body, mimetype=app.config['JSONIFY_MIMETYPE'])
+        response = build_response()
+        # like the cache headers, don't keep what a lagging replica read
+        if response.status_code == OK and not replica_router.may_lag(
+                g.read_replica, g.get('last_modified')):
+            response_cache.set(key, response.get_data())
+        return response
+
+    def paginate_questions(category_id, request, fields):
+        '''
+        Returns one page of questions and the number of questions that
+        match, in one round trip to the DB
+            Parameters:
+                     category_id: the category to list, None for every
+                      question
+                     request: http request data
+                     fields: the question fields to select
+
+            Returns:
+                    question_selection: a list of question rows on the page
+                    total_questions: the number of matching questions,
+                     None if the request asked for no count
+                    cursor_fields: {'next_cursor': id} in cursor mode, the id
+                     to pass as 'after' for the next page or None on the
+                     last page, and an empty dict in page mode
+        '''
+        statement = questions_statement(
+            category_id, columns=question_columns(fields))
+        after, offset, page_size = get_pagination(request)
+        question_selection, total_questions, next_cursor = fetch_page(
+            statement, after, offset, page_size, get_count_mode(request))
+        cursor_fields = {}
+        if after is not None:
+            cursor_fields = {'next_cursor': next_cursor}
+        return question_selection, total_questions, cursor_fields
+
+    def format_questions(question_selection, fields=QUESTION_FIELDS):
         '''
         Returns a formatted list of trivia questions
             Parameters:
-                     question_selection: a list of unformatted questions
+                     question_selection: a list of question rows
+                     fields: the question fields to keep
 
             Returns:
                     formatted_questions: a formatted list of trivia questions
         '''
-        formatted_questions = [question.format()
-                               for question in question_selection]
+        formatted_questions = [format_question(row, fields)
+                               for row in question_selection]
         return formatted_questions
 
+    def count_questions():
+        '''
+        Returns the number of questions in the DB
+        '''
+        return db.session.execute(count_questions_statement()).scalar()
+
     def get_formatted_categories():
         '''
         Returns a dictionary of all trivia game categories
         '''
-        all_categories = Category.query.order_by(Category.id).all()
-        formatted_categories = {}
-        for category in all_categories:
-            formatted_categories.update({f'{category.id}': f'{category.type}'})
-        return formatted_categories
+        return category_cache.get_formatted()
 
     @app.route('/categories')
     def get_categories():
@@ -95,7 +539,7 @@ def create_app(test_config=None):
             })
         except Exception as e:
             print("Exception: ", e)
-            abort(UNPROCESSABLE_ENTITY)
+            abort_unprocessable(e)
     '''
     test using:
     curl http://127.0.0.1:5000/categories
@@ -105,24 +549,27 @@ def create_app(test_config=None):
     @app.route('/questions')
     def get_questions():
         '''endpoint to handle GET requests for all available questions'''
-        try:
-            current_index = get_current_index(request)
-            questions = Question.query.order_by(
-                Question.id).limit(QUESTIONS_PER_PAGE).offset(
-                current_index * QUESTIONS_PER_PAGE).all()
-            formatted_questions = format_questions(questions)
-            total_questions = Question.query.count()
+        def build_response():
+            questions, total_questions, cursor_fields = paginate_questions(
+                None, request, fields)
+            formatted_questions = format_questions(questions, fields)
             formatted_categories = get_formatted_categories()
             return jsonify({
                 'success': True,
                 'questions': formatted_questions,
                 'total_questions': total_questions,
                 'categories': formatted_categories,
-                'current_category': current_category
+                'current_category': current_category,
+                **cursor_fields
             })
+        try:
+            fields = get_fields(request)
+            return cached_response(
+                'get_questions', get_listing_params(request, fields),
+                build_response)
         except Exception as e:
             print("Exception: ", e)
-            abort(UNPROCESSABLE_ENTITY)
+            abort_unprocessable(e)
     '''
     test using:
     curl http://127.0.0.1:5000/questions
@@ -146,19 +593,21 @@ def create_app(test_config=None):
             abort(UNPROCESSABLE_ENTITY)
         except Exception as e:
             print("Exception: ", e)
-            abort(UNPROCESSABLE_ENTITY)
+            abort_unprocessable(e)
     '''
     test using:
     curl -X DELETE http://127.0.0.1:5000/questions/5
     reference QuestionView.js : 108
     '''
 
-    def search_by_term(request, searchTerm):
+    def search_by_term(request, searchTerm, category_id=None):
         '''
-        Searches the DB for a trivia question based on the given search term
+        Searches the question and answer text of trivia questions for the
+        given search term, best matches first
             Parameters:
                      request: the http request data
                      searchTerm: a string of the desired term to search for
+                     category_id: only search this category if given
 
             Returns:
                     jsonified data:
@@ -167,22 +616,29 @@ def create_app(test_config=None):
                         total_questions: The count of total questions returned
                         current_category: The game's current category
         '''
-        current_index = get_current_index(request)
-        question_selection = Question.query.filter(
-            Question.question.ilike(f'%{searchTerm}%')).order_by(
-            Question.id).limit(QUESTIONS_PER_PAGE).offset(
-            current_index *
-            QUESTIONS_PER_PAGE).all()
-        count = Question.query.filter(
-            Question.question.ilike(f'%{searchTerm}%')).order_by(Question.id
-                                                                 ).count()
-        formatted_questions = format_questions(question_selection)
-        return jsonify({
-            'success': True,
-            'questions': formatted_questions,
-            'total_questions': count,
-            'current_category': current_category
-        })
+        fields = get_fields(request)
+
+        def build_response():
+            after, offset, page_size = get_pagination(request)
+            question_selection, count, next_cursor = question_search.search(
+                searchTerm, category_id, after, offset, page_size,
+                get_count_mode(request), question_columns(fields))
+            cursor_fields = {}
+            if after is not None:
+                cursor_fields = {'next_cursor': next_cursor}
+            formatted_questions = format_questions(question_selection, fields)
+            return jsonify({
+                'success': True,
+                'questions': formatted_questions,
+                'total_questions': count,
+                'current_category': current_category,
+                **cursor_fields
+            })
+        return cached_response(
+            'search_questions',
+            {'term': normalize_term(searchTerm), 'category': category_id,
+             **get_listing_params(request, fields)},
+            build_response)
 
     def add_new_question(body):
         '''
@@ -198,31 +654,34 @@ def create_app(test_config=None):
                         total_questions: The count of questions in the DB
                         new_question_id: id of the new question inserted
         '''
+        question_text = body.get('question', None)
         new_question = Question(
-            question=body.get('question', None),
+            question=question_text,
             answer=body.get('answer', None),
             difficulty=int(body.get('difficulty', None)),  # int
             category=body.get('category', None)  # string
         )
-        # don't add duplicate questions
-        duplicate_question = Question.query.filter_by(
-            question=body.get('question')).one_or_none()
-        if (duplicate_question):
+        # don't add duplicate questions, the unique question_hash index
+        # rejects them even when two clients add the same question at once
+        try:
+            new_question_id = new_question.insert()
+        except IntegrityError:
+            db.session.rollback()
+            duplicate_question = Question.query.filter_by(
+                question_hash=new_question.question_hash).first()
+            if duplicate_question is None:
+                raise
             return jsonify({
                 'success': False,
-                'question': new_question.question,
-                'total_questions': len(Question.query.all()),
-            })
-        else:
-            new_question.insert()
-            unique_question = Question.query.filter_by(
-                question=body.get('question')).one_or_none()
-            return jsonify({
-                'success': True,
-                'question': new_question.question,
-                'total_questions': len(Question.query.all()),
-                'new_question_id': unique_question.id
+                'question': question_text,
+                'total_questions': count_questions(),
             })
+        return jsonify({
+            'success': True,
+            'question': question_text,
+            'total_questions': count_questions(),
+            'new_question_id': new_question_id
+        })
 
     @app.route('/questions', methods=['POST'])
     def search_questions_by_string_or_add_question():
@@ -233,7 +692,8 @@ def create_app(test_config=None):
             searchTerm = body.get('searchTerm')
             # see if it is a search
             if(searchTerm):
-                return search_by_term(request, searchTerm)
+                return search_by_term(
+                    request, searchTerm, body.get('category'))
             else:
                 return add_new_question(body)
         except AttributeError as attribute_error:
@@ -244,7 +704,7 @@ def create_app(test_config=None):
             abort(UNPROCESSABLE_ENTITY)
         except Exception as e:
             print("Exception: ", e)
-            abort(UNPROCESSABLE_ENTITY)
+            abort_unprocessable(e)
     '''
     test using:
     curl -X POST -H "Content-Type: application/json" -d
@@ -257,81 +717,99 @@ def create_app(test_config=None):
     references  QuestionView.js : 81  &  FormView.js : 37
     '''
 
+    @app.route('/questions/bulk', methods=['POST'])
+    def bulk_import_questions():
+        '''a POST endpoint to add many questions from NDJSON or CSV'''
+        try:
+            import_format = CSV if request.mimetype == 'text/csv' else NDJSON
+            import_format = request.args.get('format', import_format)
+            if import_format not in IMPORT_FORMATS:
+                raise ValueError(f'unknown import format {import_format}')
+            lines = io.TextIOWrapper(
+                request.stream, encoding='utf-8', newline='')
+            try:
+                batches = list(import_questions(
+                    lines, import_format, get_import_batch_size(request),
+                    category_cache.get_formatted().keys()))
+            finally:
+                # every batch commits on its own, so a failed import may
+                # have written some, and no mapper event sees Core inserts
+                quiz_engine.invalidate()
+                question_search.invalidate()
+                content_version.bump()
+            return jsonify({
+                'success': True,
+                'inserted': sum(batch['inserted'] for batch in batches),
+                'duplicates': sum(batch['duplicates'] for batch in batches),
+                'rejected': sum(batch['rejected_count'] for batch in batches),
+                'batches': batches
+            })
+        except Exception as e:
+            print("Exception: ", e)
+            abort_unprocessable(e)
+    '''
+    test using:
+    curl -X POST -H "Content-Type: application/x-ndjson" --data-binary
+     @questions.ndjson http://127.0.0.1:5000/questions/bulk
+    curl -X POST -H "Content-Type: text/csv" --data-binary
+     @questions.csv http://127.0.0.1:5000/questions/bulk
+    '''
+
+    @app.route('/questions/export')
+    def export_question_bank():
+        '''a GET endpoint to stream every question as NDJSON or CSV'''
+        export_format = request.args.get('format', NDJSON)
+        if export_format not in EXPORT_FORMATS:
+            abort(UNPROCESSABLE_ENTITY)
+        chunks = export_questions(
+            export_format,
+            request.args.get('category', None, type=int),
+            request.args.get('difficulty', None, type=int))
+        return Response(stream_with_context(chunks),
+                        mimetype=EXPORT_MIMETYPES[export_format])
+    '''
+    test using:
+    curl http://127.0.0.1:5000/questions/export
+    curl "http://127.0.0.1:5000/questions/export?format=csv&category=3"
+    '''
+
     @app.route('/categories/<int:category_id>/questions', methods=['GET'])
     def get_questions_of_category(category_id):
         '''a GET endpoint to get questions based on category'''
-        try:
-            current_index = get_current_index(request)
-            question_selection = Question.query.filter_by(
-                category=f'{category_id}').order_by(
-                Question.id).limit(QUESTIONS_PER_PAGE).offset(
-                current_index *
-                QUESTIONS_PER_PAGE).all()
-            count = Question.query.filter_by(
-                category=f'{category_id}').order_by(
-                Question.id).count()
-            formatted_questions = format_questions(question_selection)
-            category = Category.query.get(category_id)
-            current_category = category.type
+        current_category = category_cache.get_type(category_id)
+        if current_category is None:
+            abort(UNPROCESSABLE_ENTITY)
 
+        def build_response():
+            question_selection, count, cursor_fields = paginate_questions(
+                category_id, request, fields)
+            formatted_questions = format_questions(question_selection, fields)
             return jsonify({
                 'success': True,
                 'questions': formatted_questions,
                 'total_questions': count,
-                'current_category': current_category
+                'current_category': current_category,
+                **cursor_fields
             })
+        try:
+            fields = get_fields(request)
+            return cached_response(
+                'get_questions_of_category',
+                {'category': category_id,
+                 **get_listing_params(request, fields)},
+                build_response)
         except AttributeError as attribute_error:
             print("ATTRIBUTE ERROR: ", attribute_error)
             abort(UNPROCESSABLE_ENTITY)
         except Exception as e:
             print("Exception: ", e)
-            abort(UNPROCESSABLE_ENTITY)
+            abort_unprocessable(e)
     '''
     test using:
     curl http://127.0.0.1:5000/categories/5/questions
     reference QuestionView.js : 63
     '''
 
-    def get_a_random_question(question_selection):
-        '''
-        Returns a random question from a given selection
-            Parameters:
-                     question_selection: a list of questions to choose from
-
-            Returns:
-                    formatted_questions: One formatted trivia question
-        '''
-        formatted_questions = format_questions(question_selection)
-        num_questions = len(formatted_questions)
-        if num_questions == 0:
-            return None
-        else:
-            rand_num = random.randint(0, (num_questions - 1))
-            return formatted_questions[rand_num]
-
-    def get_question_selection_from_category(
-            quiz_category, previous_questions):
-        '''
-        Returns a selection of trivia questions given a quiz category
-            Parameters:
-                     quiz_category: the desired quiz category
-                     previous_questions: a list of previously asked question
-                     id's not wanted in the returned selection
-
-            Returns:
-                    question_selection: a list of questions from the given
-                    category or all questions if category id is 0
-        '''
-        category_id = quiz_category["id"]
-        if category_id == 0:
-            question_selection = Question.query.filter(
-                Question.id.notin_(previous_questions)).all()
-        else:
-            question_selection = Question.query.filter_by(
-                category=f'{category_id}').filter(
-                Question.id.notin_(previous_questions)).all()
-        return question_selection
-
     @app.route('/quizzes', methods=['POST'])
     def get_new_quiz_question():
         '''a POST endpoint to get questions to play the quiz'''
@@ -340,11 +818,15 @@ def create_app(test_config=None):
             body = request.get_json()
             previous_questions = body.get('previous_questions')
             quiz_category = body.get('quiz_category')
-            question_selection = get_question_selection_from_category(
-                quiz_category, previous_questions)
-            quiz_question = get_a_random_question(question_selection)
+            fields = get_fields(request)
+            question = quiz_engine.draw(
+                quiz_category["id"],
+                {int(question_id) for question_id in previous_questions},
+                question_columns(fields))
+            quiz_question = None
             count = 0
-            if quiz_question:
+            if question:
+                quiz_question = format_question(question, fields)
                 count = 1
             return jsonify({
                 'success': True,
@@ -357,7 +839,7 @@ def create_app(test_config=None):
             abort(UNPROCESSABLE_ENTITY)
         except Exception as e:
             print("Exception: ", e)
-            abort(UNPROCESSABLE_ENTITY)
+            abort_unprocessable(e)
     '''
     test using:
     curl -X POST -H "Content-Type: application/json" -d
@@ -367,6 +849,178 @@ def create_app(test_config=None):
     reference QuizView.js : 51
     '''
 
+    @app.route('/quizzes/deck', methods=['POST'])
+    def get_quiz_deck():
+        '''a POST endpoint to get every question of a quiz game at once'''
+        try:
+            body = request.get_json()
+            previous_questions = body.get('previous_questions') or []
+            quiz_category = body.get('quiz_category')
+            max_deck_size = app.config.get(
+                'QUIZ_DECK_SIZE_MAX', MAX_DECK_SIZE)
+            deck_size = min(int(body.get('count', DEFAULT_DECK_SIZE)),
+                            max_deck_size)
+            fields = get_fields(request)
+            deck = quiz_engine.draw_deck(
+                quiz_category["id"],
+                {int(question_id) for question_id in previous_questions},
+                deck_size, question_columns(fields))
+            return jsonify({
+                'success': True,
+                'quiz_category': quiz_category,
+                'questions': format_questions(deck, fields),
+                'total_questions': len(deck)
+            }), OK
+        except AttributeError as attribute_error:
+            print("ATTRIBUTE ERROR: ", attribute_error)
+            abort(UNPROCESSABLE_ENTITY)
+        except Exception as e:
+            print("Exception: ", e)
+            abort_unprocessable(e)
+    '''
+    test using:
+    curl -X POST -H "Content-Type: application/json" -d
+     '{"count": 5, "previous_questions": [],
+      "quiz_category":{"type": "Science", "id": "1"}}'
+       http://127.0.0.1:5000/quizzes/deck
+    reference QuizView.js : 44
+    '''
+
+    @app.route('/quizzes/sessions', methods=['POST'])
+    def create_quiz_session():
+        '''a POST endpoint to start a quiz game tracked on the server'''
+        try:
+            body = request.get_json()
+            quiz_category = body.get('quiz_category')
+            int(quiz_category["id"])  # reject malformed category ids early
+            session = QuizSession(new_session_id(), quiz_category)
+            quiz_sessions.save(session)
+            return jsonify({
+                'success': True,
+                **session.format()
+            }), OK
+        except AttributeError as attribute_error:
+            print("ATTRIBUTE ERROR: ", attribute_error)
+            abort(UNPROCESSABLE_ENTITY)
+        except Exception as e:
+            print("Exception: ", e)
+            abort_unprocessable(e)
+    '''
+    test using:
+    curl -X POST -H "Content-Type: application/json" -d
+     '{"quiz_category":{"type": "Science", "id": "1"}}'
+       http://127.0.0.1:5000/quizzes/sessions
+    '''
+
+    @app.route('/quizzes/sessions/<session_id>/next', methods=['POST'])
+    def get_next_session_question(session_id):
+        '''a POST endpoint to draw the next question of a quiz session'''
+        session = quiz_sessions.get(session_id)
+        if session is None:
+            abort(RESOURCE_NOT_FOUND)
+        try:
+            question = quiz_engine.draw(
+                session.quiz_category["id"], session.seen)
+            quiz_question = None
+            count = 0
+            if question:
+                session.seen.add(question['id'])
+                quiz_sessions.save(session)
+                quiz_question = format_question(question)
+                count = 1
+            return jsonify({
+                'success': True,
+                'session_id': session_id,
+                'quiz_category': session.quiz_category,
+                'question': quiz_question,
+                'total_questions': count
+            }), OK
+        except Exception as e:
+            print("Exception: ", e)
+            abort_unprocessable(e)
+    '''
+    test using:
+    curl -X POST http://127.0.0.1:5000/quizzes/sessions/<session_id>/next
+    '''
+
+    @app.route('/quizzes/sessions/<session_id>', methods=['DELETE'])
+    def end_quiz_session(session_id):
+        '''endpoint to DELETE a quiz session when the game ends'''
+        session = quiz_sessions.delete(session_id)
+        if session is None:
+            abort(RESOURCE_NOT_FOUND)
+        return jsonify({
+            'success': True,
+            **session.format()
+        }), OK
+    '''
+    test using:
+    curl -X DELETE http://127.0.0.1:5000/quizzes/sessions/<session_id>
+    '''
+
+    @app.route('/quizzes/results', methods=['POST'])
+    def submit_quiz_result():
+        '''
+        a POST endpoint to record the score of a finished quiz game, the
+        result is written to the DB later in a batch with others
+        '''
+        try:
+            body = request.get_json()
+            player = body.get('player', '').strip()
+            score = int(body.get('score'))
+            total_questions = int(body.get('total_questions'))
+            # 0 for a game played over all categories
+            category_id = int(body.get('quiz_category')["id"])
+        except Exception as e:
+            print("Exception: ", e)
+            abort_unprocessable(e)
+        if not player or len(player) > MAX_PLAYER_LENGTH or \
+                not 0 <= score <= total_questions <= MAX_TOTAL_QUESTIONS or \
+                (category_id != 0 and
+                 category_cache.get_type(category_id) is None):
+            abort(UNPROCESSABLE_ENTITY)
+        result = new_result(player, category_id, score, total_questions)
+        if not result_writer.add(result):
+            # the DB is behind on writing results, don't buffer more
+            abort(SERVICE_UNAVAILABLE)
+        rank = leaderboard.add(result)
+        return jsonify({
+            'success': True,
+            'rank': rank
+        }), ACCEPTED
+    '''
+    test using:
+    curl -X POST -H "Content-Type: application/json" -d
+     '{"player": "Ada", "score": 4, "total_questions": 5,
+      "quiz_category":{"type": "Science", "id": "1"}}'
+       http://127.0.0.1:5000/quizzes/results
+    reference QuizView.js : 104
+    '''
+
+    @app.route('/leaderboard')
+    def get_leaderboard():
+        '''
+        a GET endpoint for the best results of a category, 0 for games
+        played over all categories, or of every game without a category
+        '''
+        category_id = request.args.get('category', None, type=int)
+        if category_id is None:
+            if 'category' in request.args:
+                abort(UNPROCESSABLE_ENTITY)
+            category_id = ALL_GAMES
+        elif category_id != 0 and \
+                category_cache.get_type(category_id) is None:
+            abort(UNPROCESSABLE_ENTITY)
+        return jsonify({
+            'success': True,
+            'category': category_id,
+            'leaderboard': leaderboard.top(category_id)
+        }), OK
+    '''
+    test using:
+    curl http://127.0.0.1:5000/leaderboard?category=1
+    '''
+
     '''
     Error Handlers
     '''
@@ -401,4 +1055,27 @@ def create_app(test_config=None):
             "error": UNPROCESSABLE_ENTITY,
             "message": UNPROCESSABLE_ENTITY_MSG,
         }), UNPROCESSABLE_ENTITY
+
+    @app.errorhandler(TOO_MANY_REQUESTS)
+    def too_many_requests(error):
+        response = jsonify({
+            "success": False,
+            "error": TOO_MANY_REQUESTS,
+            "message": TOO_MANY_REQUESTS_MSG,
+        })
+        response.headers['Retry-After'] = g.retry_after
+        return response, TOO_MANY_REQUESTS
+
+    @app.errorhandler(SERVICE_UNAVAILABLE)
+    @app.errorhandler(PoolTimeoutError)
+    def service_unavailable(error):
+        response = jsonify({
+            "success": False,
+            "error": SERVICE_UNAVAILABLE,
+            "message": SERVICE_UNAVAILABLE_MSG,
+        })
+        # shed by admission control, or else the DB was too busy
+        response.headers['Retry-After'] = g.get('retry_after') or \
+            app.config.get('ADMISSION_RETRY_AFTER', DEFAULT_RETRY_AFTER)
+        return response, SERVICE_UNAVAILABLE
     return app
@@ -0,0 +1,205 @@
+'''
+Admission control and load shedding
+
+Under a traffic spike every request used to wait on the DB pool, and the
+requests that timed out were answered with a 422 the client retried at
+once, adding to the spike. Requests are now admitted before their view
+runs, by route class: reads, writes and quiz draws each have a limit on
+the requests served at once. A request over the limit waits at most
+ADMISSION_QUEUE_TIMEOUT seconds for a slot, behind at most as many other
+waiting requests as the limit, and is otherwise shed with a 503 and a
+Retry-After header. The requests admitted then keep a bounded latency,
+however many arrive.
+
+Each client can also be held to a rate per route class by a token bucket,
+refilled at the RATE_LIMITS rate up to a burst. A client over its rate is
+answered with a 429 and the seconds until its next token in Retry-After.
+
+Limits are per process, like the DB pool they protect.
+'''
+
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import exc
+
+from .metrics import Counter
+
+READS = 'reads'
+WRITES = 'writes'
+QUIZ_DRAWS = 'quiz'
+ROUTE_CLASSES = (READS, WRITES, QUIZ_DRAWS)
+DEFAULT_CONCURRENCY_LIMITS = {READS: 16, WRITES: 4, QUIZ_DRAWS: 8}
+DEFAULT_QUEUE_TIMEOUT = 0.25  # seconds
+DEFAULT_RETRY_AFTER = 1  # seconds
+MAX_RATE_LIMITED_CLIENTS = 10000
+QUERY_CANCELED = '57014'  # the Postgres error code of statement_timeout
+OVERLOADED = 'overloaded'
+RATE_LIMITED = 'rate_limited'
+
+
+def is_overload_error(error):
+    '''
+    Returns True if error means the DB was too busy to serve the request:
+    no pooled connection was free within the pool timeout, or a query ran
+    past DB_STATEMENT_TIMEOUT
+    '''
+    if isinstance(error, exc.TimeoutError):
+        return True
+    return isinstance(error, exc.OperationalError) and \
+        getattr(error.orig, 'pgcode', None) == QUERY_CANCELED
+
+
+class ConcurrencyLimiter:
+    '''
+    Limits the requests served at once, with a deadline on the time a
+    request waits for a slot
+        Parameters:
+                 limit: the most requests served at once
+                 queue_timeout: the most seconds a request waits for a slot
+                 max_waiting: the most requests waiting for a slot, the
+                  limit by default
+    '''
+
+    def __init__(self, limit, queue_timeout=DEFAULT_QUEUE_TIMEOUT,
+                 max_waiting=None):
+        self.limit = limit
+        self.queue_timeout = queue_timeout
+        self.max_waiting = limit if max_waiting is None else max_waiting
+        self._condition = threading.Condition()
+        self.active = 0
+        self.waiting = 0
+
+    def acquire(self):
+        '''
+        Takes a slot, waiting for one at most queue_timeout seconds
+
+            Returns:
+                    admitted: True if a slot was taken, it must then be
+                     released
+        '''
+        with self._condition:
+            if self.active < self.limit:
+                self.active += 1
+                return True
+            if self.waiting >= self.max_waiting:
+                return False
+            deadline = time.monotonic() + self.queue_timeout
+            self.waiting += 1
+            try:
+                while self.active >= self.limit:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                    self._condition.wait(remaining)
+                self.active += 1
+                return True
+            finally:
+                self.waiting -= 1
+
+    def release(self):
+        with self._condition:
+            self.active -= 1
+            self._condition.notify()
+
+
+class TokenBucketLimiter:
+    '''
+    Holds every client to a rate of requests, with bursts
+        Parameters:
+                 rate: the requests per second a client may make
+                 burst: the most requests a client may make at once
+                 max_clients: the most clients tracked, the least recently
+                  seen are forgotten first
+    '''
+
+    def __init__(self, rate, burst, max_clients=MAX_RATE_LIMITED_CLIENTS):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()  # client -> (tokens, updated)
+
+    def take(self, client):
+        '''
+        Takes a token from the client's bucket
+
+            Returns:
+                    wait: 0 if the client may make the request, else the
+                     seconds until its bucket holds a token
+        '''
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(client, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            wait = 0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / self.rate
+            self._buckets[client] = (tokens, now)
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+            return wait
+
+
+class AdmissionControl:
+    '''
+    The concurrency limiters and rate limiters of every route class
+        Parameters:
+                 limits: the most requests of a route class served at once,
+                  by route class, None for no limit
+                 queue_timeout: the most seconds a request waits for a slot
+                 rate_limits: (requests per second, burst) of a client, by
+                  route class, None for no limit
+                 retry_after: the seconds a shed client is asked to wait
+    '''
+
+    def __init__(self, limits=None, queue_timeout=DEFAULT_QUEUE_TIMEOUT,
+                 rate_limits=None, retry_after=DEFAULT_RETRY_AFTER):
+        limits = {**DEFAULT_CONCURRENCY_LIMITS, **(limits or {})}
+        self.limiters = {
+            route_class: ConcurrencyLimiter(limit, queue_timeout)
+            for route_class, limit in limits.items() if limit is not None}
+        self.rate_limiters = {
+            route_class: TokenBucketLimiter(*rate_limit)
+            for route_class, rate_limit in (rate_limits or {}).items()
+            if rate_limit is not None}
+        self.retry_after = retry_after
+        self.shed = Counter(
+            'trivia_requests_shed_total',
+            'Requests turned away before their view ran.',
+            ('route_class', 'reason'))
+
+    def admit(self, route_class, client):
+        '''
+        Admits a request of route_class from client, or sheds it
+
+            Returns:
+                    reason: None if the request was admitted, and must be
+                     released, else OVERLOADED or RATE_LIMITED
+                    retry_after: the whole seconds the client should wait
+                     before it retries
+        '''
+        rate_limiter = self.rate_limiters.get(route_class)
+        if rate_limiter is not None:
+            wait = rate_limiter.take(client)
+            if wait:
+                self.shed.inc((route_class, RATE_LIMITED))
+                return RATE_LIMITED, math.ceil(wait)
+        limiter = self.limiters.get(route_class)
+        if limiter is not None and not limiter.acquire():
+            self.shed.inc((route_class, OVERLOADED))
+            return OVERLOADED, self.retry_after
+        return None, None
+
+    def release(self, route_class):
+        limiter = self.limiters.get(route_class)
+        if limiter is not None:
+            limiter.release()
+
+    def render(self):
+        '''Returns the shed request counter in the Prometheus text format'''
+        return self.shed.render()
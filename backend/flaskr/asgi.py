@@ -0,0 +1,413 @@
+'''
+Async (ASGI) serving mode
+
+Serves the trivia game's routes with the same JSON contracts as the Flask
+app, on an async DB driver (asyncpg on Postgres, aiosqlite on SQLite), so
+a player waiting on the DB holds no worker thread. Both modes run the SQL
+of flaskr.queries.
+
+run from the backend folder:
+uvicorn --factory flaskr.asgi:create_asgi_app
+
+Quiz sessions, cursor pagination, bulk import, export, conditional GETs and
+read replicas are only served by the Flask app.
+'''
+
+import sqlite3
+import time
+from contextlib import asynccontextmanager
+
+import databases
+from starlette.applications import Starlette
+from starlette.exceptions import HTTPException
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+from models import database_uri, Question
+from . import (
+    QUESTIONS_PER_PAGE, current_category, BAD_REQUEST, BAD_REQUEST_MSG,
+    RESOURCE_NOT_FOUND, RESOURCE_NOT_FOUND_MSG, METHOD_NOT_ALLOWED,
+    METHOD_NOT_ALLOWED_MSG, UNPROCESSABLE_ENTITY, UNPROCESSABLE_ENTITY_MSG)
+from .categories import CategoryCache
+from .queries import (
+    categories_statement, count_statement, count_questions_statement,
+    delete_question_statement, format_question,
+    insert_question_statement, page_statement, page_total,
+    question_by_hash_statement, question_ids_statement, question_statement,
+    questions_by_ids_statement, questions_statement,
+    search_documents_statement, search_rank)
+from .quiz import (
+    QuizDrawEngine, DEFAULT_INDEX_MAX_AGE, DEFAULT_DECK_SIZE, MAX_DECK_SIZE)
+from .search import (
+    InMemorySearchIndex, search_backend_name, POSTGRES,
+    DEFAULT_SEARCH_INDEX_MAX_AGE)
+
+ERROR_MESSAGES = {
+    BAD_REQUEST: BAD_REQUEST_MSG,
+    RESOURCE_NOT_FOUND: RESOURCE_NOT_FOUND_MSG,
+    METHOD_NOT_ALLOWED: METHOD_NOT_ALLOWED_MSG,
+    UNPROCESSABLE_ENTITY: UNPROCESSABLE_ENTITY_MSG,
+}
+UNIQUE_VIOLATION = '23505'  # the Postgres error code of a duplicate key
+
+
+def is_unique_violation(error):
+    '''
+    Returns True if error is a unique index rejecting a row. The async
+    drivers raise their own errors rather than SQLAlchemy's IntegrityError:
+    asyncpg's carry the Postgres error code, and aiosqlite re-raises
+    sqlite3's
+    '''
+    if isinstance(error, sqlite3.IntegrityError):
+        return f'{error}'.startswith('UNIQUE constraint failed')
+    return getattr(error, 'sqlstate', None) == UNIQUE_VIOLATION
+
+
+class AsyncIndexLoader:
+    '''
+    Loads an in-memory index, a QuizDrawEngine or InMemorySearchIndex
+    built with max_age=None, through the async driver
+        Parameters:
+                 database: the databases.Database to query
+                 index: the index to load
+                 statement: a function returning the statement whose rows
+                  the index's load method takes
+                 max_age: seconds before the index is reloaded so writes
+                  made by other processes are picked up, None to only
+                  reload after local writes
+    '''
+
+    def __init__(self, database, index, statement, max_age=None):
+        self.database = database
+        self.index = index
+        self.statement = statement
+        self.max_age = max_age
+        self._loaded_at = None
+
+    async def refresh(self):
+        '''Reloads the index if it is stale'''
+        if self._loaded_at is not None and not self.index.is_stale() and (
+                self.max_age is None or
+                time.monotonic() - self._loaded_at <= self.max_age):
+            return
+        self.index.load(await self.database.fetch_all(self.statement()))
+        self._loaded_at = time.monotonic()
+
+
+def create_asgi_app(test_config=None):
+    config = dict(test_config or {})
+    if 'SQLALCHEMY_DATABASE_URI' not in config:
+        config['SQLALCHEMY_DATABASE_URI'] = database_uri()
+    database = databases.Database(config['SQLALCHEMY_DATABASE_URI'])
+    is_postgres = database.url.dialect == 'postgresql'
+    category_cache = CategoryCache(ttl=config.get('CATEGORY_CACHE_TTL'))
+    quiz_engine = QuizDrawEngine(max_age=None)
+    quiz_loader = AsyncIndexLoader(
+        database, quiz_engine, question_ids_statement,
+        config.get('QUIZ_INDEX_MAX_AGE', DEFAULT_INDEX_MAX_AGE))
+    search_loader = None
+    if search_backend_name(config) != POSTGRES:
+        search_loader = AsyncIndexLoader(
+            database, InMemorySearchIndex(max_age=None),
+            search_documents_statement,
+            config.get('SEARCH_INDEX_MAX_AGE', DEFAULT_SEARCH_INDEX_MAX_AGE))
+
+    @asynccontextmanager
+    async def lifespan(app):
+        await database.connect()
+        await get_formatted_categories()
+        yield
+        await database.disconnect()
+
+    async def load_categories():
+        category_cache.load(await database.fetch_all(categories_statement()))
+
+    async def get_formatted_categories():
+        '''
+        Returns every category keyed by id, like CategoryCache.get_formatted
+        '''
+        if category_cache.is_stale():
+            await load_categories()
+        return category_cache.formatted_categories
+
+    async def get_category_type(category_id):
+        '''
+        Returns the type of the category with the given id, None if there
+        is no such category, like CategoryCache.get_type
+        '''
+        categories = await get_formatted_categories()
+        category_type = categories.get(f'{category_id}')
+        if category_type is None and category_cache.is_miss_stale():
+            await load_categories()
+            category_type = category_cache.formatted_categories.get(
+                f'{category_id}')
+        return category_type
+
+    def invalidate_indexes():
+        quiz_engine.invalidate()
+        if search_loader is not None:
+            search_loader.index.invalidate()
+
+    async def get_request_json(request):
+        try:
+            return await request.json()
+        except ValueError:
+            return None
+
+    async def count_questions():
+        return await database.fetch_val(count_questions_statement())
+
+    def get_offset(request):
+        try:
+            selected_page = int(request.query_params.get('page', 1))
+        except ValueError:
+            selected_page = 1
+        return (selected_page - 1) * QUESTIONS_PER_PAGE
+
+    async def fetch_question_page(offset, category_id=None, term=None,
+                                  order_by=None):
+        '''
+        Returns a page of formatted questions and the number of questions
+        matched, the statements of pagination.fetch_page in exact count
+        mode run through the async driver
+        '''
+        statement = questions_statement(category_id, term)
+        rows = await database.fetch_all(page_statement(
+            statement, offset=offset, page_size=QUESTIONS_PER_PAGE,
+            order_by=order_by))
+        total_questions = page_total(rows, offset=offset)
+        if total_questions is None:
+            total_questions = await database.fetch_val(
+                count_statement(statement))
+        return [format_question(row) for row in rows], total_questions
+
+    async def get_categories(request):
+        '''
+        Endpoint to handle GET requests for all available categories
+        '''
+        categories = await get_formatted_categories()
+        return JSONResponse({
+            'success': True,
+            'categories': categories,
+            'total_categories': len(categories)
+        })
+
+    async def get_questions(request):
+        '''endpoint to handle GET requests for all available questions'''
+        formatted_questions, total_questions = await fetch_question_page(
+            get_offset(request))
+        return JSONResponse({
+            'success': True,
+            'questions': formatted_questions,
+            'total_questions': total_questions,
+            'categories': await get_formatted_categories(),
+            'current_category': current_category
+        })
+
+    async def delete_question_by_id(request):
+        '''endpoint to DELETE a question using a question ID'''
+        question_id = request.path_params['question_id']
+        row = await database.fetch_one(question_statement(question_id))
+        if row is None:
+            raise HTTPException(UNPROCESSABLE_ENTITY)
+        await database.execute(delete_question_statement(question_id))
+        invalidate_indexes()
+        return JSONResponse({
+            'success': True,
+            'deleted_question_text': row['question'],
+            'deleted_question_id': question_id
+        })
+
+    async def search_by_term(request, search_term, category_id=None):
+        '''
+        Searches the question and answer text of trivia questions for the
+        given search term, best matches first
+        '''
+        offset = get_offset(request)
+        if search_loader is None:
+            formatted_questions, count = await fetch_question_page(
+                offset, category_id, search_term,
+                order_by=(search_rank(search_term).desc(), Question.id))
+        else:
+            await search_loader.refresh()
+            matched_ids = search_loader.index.match(search_term, category_id)
+            page_ids = matched_ids[offset:offset + QUESTIONS_PER_PAGE]
+            rows_by_id = {}
+            if page_ids:
+                rows_by_id = {row['id']: row for row in await
+                              database.fetch_all(
+                                  questions_by_ids_statement(page_ids))}
+            formatted_questions = [format_question(rows_by_id[question_id])
+                                   for question_id in page_ids
+                                   if question_id in rows_by_id]
+            count = len(matched_ids)
+        return JSONResponse({
+            'success': True,
+            'questions': formatted_questions,
+            'total_questions': count,
+            'current_category': current_category
+        })
+
+    async def add_new_question(body):
+        '''
+        Adds a question to the DB and returns json data representing
+        the new question added
+        '''
+        question_text = body.get('question', None)
+        new_question = Question(
+            question=question_text,
+            answer=body.get('answer', None),
+            difficulty=int(body.get('difficulty', None)),  # int
+            category=body.get('category', None)  # string
+        )
+        statement = insert_question_statement(new_question)
+        if is_postgres:
+            statement = statement.returning(Question.id)
+        # don't add duplicate questions, the unique question_hash index
+        # rejects them even when two clients add the same question at once
+        try:
+            new_question_id = await database.execute(statement)
+        except Exception as e:
+            if not is_unique_violation(e):
+                raise
+            duplicate_question = await database.fetch_one(
+                question_by_hash_statement(new_question.question_hash))
+            if duplicate_question is None:
+                raise
+            return JSONResponse({
+                'success': False,
+                'question': question_text,
+                'total_questions': await count_questions(),
+            })
+        invalidate_indexes()
+        return JSONResponse({
+            'success': True,
+            'question': question_text,
+            'total_questions': await count_questions(),
+            'new_question_id': new_question_id
+        })
+
+    async def search_questions_by_string_or_add_question(request):
+        '''a POST endpoint to either get questions based on a search term
+        or create a new question'''
+        try:
+            body = await get_request_json(request)
+            search_term = body.get('searchTerm')
+            if search_term:
+                return await search_by_term(
+                    request, search_term, body.get('category'))
+            return await add_new_question(body)
+        except Exception as e:
+            print("Exception: ", e)
+            raise HTTPException(UNPROCESSABLE_ENTITY)
+
+    async def get_questions_of_category(request):
+        '''a GET endpoint to get questions based on category'''
+        category_id = request.path_params['category_id']
+        category_type = await get_category_type(category_id)
+        if category_type is None:
+            raise HTTPException(UNPROCESSABLE_ENTITY)
+        formatted_questions, count = await fetch_question_page(
+            get_offset(request), category_id)
+        return JSONResponse({
+            'success': True,
+            'questions': formatted_questions,
+            'total_questions': count,
+            'current_category': category_type
+        })
+
+    async def draw_deck(category_id, excluded, count):
+        '''
+        Returns up to count distinct random formatted questions whose ids
+        are not in excluded, like QuizDrawEngine.draw_deck
+        '''
+        deck = []
+        excluded = set(excluded)
+        while len(deck) < count:
+            await quiz_loader.refresh()
+            question_ids = quiz_engine.draw_ids(
+                category_id, excluded, count - len(deck))
+            if not question_ids:
+                break
+            rows_by_id = {row['id']: row for row in await database.fetch_all(
+                questions_by_ids_statement(question_ids))}
+            deck.extend(format_question(rows_by_id[question_id])
+                        for question_id in question_ids
+                        if question_id in rows_by_id)
+            excluded.update(question_ids)
+            if len(rows_by_id) < len(question_ids):
+                # deleted by another process since the index was loaded
+                quiz_engine.invalidate()
+        return deck
+
+    async def get_new_quiz_question(request):
+        '''a POST endpoint to get questions to play the quiz'''
+        try:
+            body = await get_request_json(request)
+            previous_questions = body.get('previous_questions')
+            quiz_category = body.get('quiz_category')
+            deck = await draw_deck(
+                quiz_category["id"],
+                {int(question_id) for question_id in previous_questions}, 1)
+            quiz_question = deck[0] if deck else None
+            return JSONResponse({
+                'success': True,
+                'quiz_category': quiz_category,
+                'question': quiz_question,
+                'total_questions': 1 if quiz_question else 0
+            })
+        except Exception as e:
+            print("Exception: ", e)
+            raise HTTPException(UNPROCESSABLE_ENTITY)
+
+    async def get_quiz_deck(request):
+        '''a POST endpoint to get every question of a quiz game at once'''
+        try:
+            body = await get_request_json(request)
+            previous_questions = body.get('previous_questions') or []
+            quiz_category = body.get('quiz_category')
+            deck_size = min(int(body.get('count', DEFAULT_DECK_SIZE)),
+                            config.get('QUIZ_DECK_SIZE_MAX', MAX_DECK_SIZE))
+            deck = await draw_deck(
+                quiz_category["id"],
+                {int(question_id) for question_id in previous_questions},
+                deck_size)
+            return JSONResponse({
+                'success': True,
+                'quiz_category': quiz_category,
+                'questions': deck,
+                'total_questions': len(deck)
+            })
+        except Exception as e:
+            print("Exception: ", e)
+            raise HTTPException(UNPROCESSABLE_ENTITY)
+
+    async def http_error(request, error):
+        return JSONResponse({
+            "success": False,
+            "error": error.status_code,
+            "message": ERROR_MESSAGES.get(error.status_code, error.detail),
+        }, status_code=error.status_code)
+
+    routes = [
+        Route('/categories', get_categories),
+        Route('/questions', get_questions),
+        Route('/questions', search_questions_by_string_or_add_question,
+              methods=['POST']),
+        Route('/questions/{question_id:int}', delete_question_by_id,
+              methods=['DELETE']),
+        Route('/categories/{category_id:int}/questions',
+              get_questions_of_category),
+        Route('/quizzes', get_new_quiz_question, methods=['POST']),
+        Route('/quizzes/deck', get_quiz_deck, methods=['POST']),
+    ]
+    return Starlette(
+        routes=routes,
+        middleware=[Middleware(
+            CORSMiddleware, allow_origins=['*'],
+            allow_methods=['GET', 'PUT', 'POST', 'DELETE', 'OPTIONS'],
+            allow_headers=['Content-Type', 'Authorization'])],
+        exception_handlers={HTTPException: http_error},
+        lifespan=lifespan)
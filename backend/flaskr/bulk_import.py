@@ -0,0 +1,180 @@
+'''
+Bulk question import
+
+Reads questions as NDJSON (one JSON object per line) or CSV (with a
+question,answer,difficulty,category header) from a text stream, and
+writes them in batches with one multi-row INSERT per batch. Only one
+batch is held in memory at a time, and only the first few rejects of a
+batch are kept to report, the rest are counted.
+'''
+
+import csv
+import json
+
+from sqlalchemy.dialects import postgresql
+
+from models import db, Question, hash_question
+
+NDJSON = 'ndjson'
+CSV = 'csv'
+IMPORT_FORMATS = (NDJSON, CSV)
+IMPORT_BATCH_SIZE = 500
+MAX_IMPORT_BATCH_SIZE = 5000
+MAX_REJECT_DETAILS = 10  # rejects reported per batch
+
+
+class RejectedQuestion(ValueError):
+    pass
+
+
+def read_ndjson(lines):
+    '''
+    Yields (line_number, record) pairs from lines of JSON objects,
+    record is a RejectedQuestion for lines that are not valid JSON
+    '''
+    for line_number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            yield line_number, json.loads(line)
+        except ValueError as value_error:
+            yield line_number, RejectedQuestion(
+                f'invalid JSON: {value_error}')
+
+
+def read_csv(lines):
+    '''
+    Yields (line_number, record) pairs from CSV lines with a header row
+    '''
+    reader = csv.DictReader(lines)
+    for record in reader:
+        yield reader.line_num, record
+
+
+def validate_question(record, category_ids):
+    '''
+    Returns the insert values of a question record
+        Parameters:
+                 record: a dict read from the import
+                 category_ids: the set of existing category ids
+
+        Returns:
+                values: a dict of question column values
+
+        Raises:
+                RejectedQuestion: if the record is not a valid question
+    '''
+    if isinstance(record, RejectedQuestion):
+        raise record
+    if not isinstance(record, dict):
+        raise RejectedQuestion('not an object')
+    question = record.get('question')
+    answer = record.get('answer')
+    if not isinstance(question, str) or not question.strip():
+        raise RejectedQuestion('missing question')
+    if not isinstance(answer, str) or not answer.strip():
+        raise RejectedQuestion('missing answer')
+    try:
+        difficulty = int(record.get('difficulty'))
+    except (TypeError, ValueError):
+        raise RejectedQuestion('difficulty is not a number')
+    category = f"{record.get('category')}".strip()
+    if category not in category_ids:
+        raise RejectedQuestion(f'unknown category {category}')
+    return {
+        'question': question.strip(),
+        'answer': answer.strip(),
+        'difficulty': difficulty,
+        'category': int(category),
+        'question_hash': hash_question(question)
+    }
+
+
+def insert_ignoring_duplicates(rows):
+    '''
+    Inserts rows with one multi-row INSERT that skips rows whose
+    question_hash is already taken, also by a concurrent writer
+
+        Returns:
+                inserted: the number of rows inserted
+    '''
+    if db.session.get_bind().dialect.name == 'postgresql':
+        statement = postgresql.insert(Question.__table__).values(
+            rows).on_conflict_do_nothing(index_elements=['question_hash'])
+    else:
+        statement = Question.__table__.insert().values(
+            rows).prefix_with('OR IGNORE')
+    return db.session.execute(statement).rowcount
+
+
+def insert_batch(batch_number, batch, rejected, rejected_count):
+    '''
+    De-duplicates and inserts a batch of validated questions
+        Parameters:
+                 batch_number: the position of the batch in the import
+                 batch: a list of (line_number, values) pairs
+                 rejected: a list of the first rejects found while
+                  validating
+                 rejected_count: the number of rejects found
+
+        Returns:
+                batch_result: a dict of the batch's counts and rejects
+    '''
+    # copies within the batch are dropped here, copies of questions
+    # already in the DB by the unique question_hash index
+    rows = []
+    batch_hashes = set()
+    for _, values in batch:
+        if values['question_hash'] not in batch_hashes:
+            batch_hashes.add(values['question_hash'])
+            rows.append(values)
+    inserted = 0
+    if rows:
+        inserted = insert_ignoring_duplicates(rows)
+    db.session.commit()
+    return {
+        'batch': batch_number,
+        'inserted': inserted,
+        'duplicates': len(batch) - inserted,
+        'rejected': rejected,
+        'rejected_count': rejected_count
+    }
+
+
+def import_questions(lines, import_format=NDJSON,
+                     batch_size=IMPORT_BATCH_SIZE, category_ids=()):
+    '''
+    Streams questions from lines of text into the DB
+        Parameters:
+                 lines: an iterable of text lines
+                 import_format: 'ndjson' or 'csv'
+                 batch_size: the number of questions written per INSERT
+                 category_ids: the ids of the existing categories
+
+        Yields:
+                batch_result: a dict of the counts and first rejects of
+                 each batch, as it is committed
+    '''
+    category_ids = {f'{category_id}' for category_id in category_ids}
+    records = read_csv(lines) if import_format == CSV else read_ndjson(lines)
+    batch_number = 1
+    batch = []
+    rejected = []
+    rejected_count = 0
+    for line_number, record in records:
+        try:
+            batch.append(
+                (line_number, validate_question(record, category_ids)))
+        except RejectedQuestion as rejected_question:
+            rejected_count += 1
+            if len(rejected) < MAX_REJECT_DETAILS:
+                rejected.append(
+                    {'line': line_number, 'error': f'{rejected_question}'})
+        if len(batch) + rejected_count >= batch_size:
+            yield insert_batch(batch_number, batch, rejected, rejected_count)
+            batch_number += 1
+            batch = []
+            rejected = []
+            rejected_count = 0
+    if batch or rejected_count:
+        yield insert_batch(batch_number, batch, rejected, rejected_count)
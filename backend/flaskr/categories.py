@@ -0,0 +1,139 @@
+'''
+Category lookup cache
+
+Categories almost never change, so they are read once and served from
+memory. Every committed insert, update or delete of a Category in this
+process bumps a version number that makes the cache reload on its next
+use; an optional ttl bounds how long changes made by other processes go
+unseen. The version is bumped after the commit, never at flush, so a load
+that reads the categories before the write commits isn't taken for a load
+of the new version.
+
+A lookup of an unknown id reloads the cache too, as the category may have
+been added by another process, but at most once every miss_max_age
+seconds, so requests for ids that don't exist can't each cost a query.
+'''
+
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+from models import db, Category
+from .queries import categories_statement, format_categories
+
+DEFAULT_MISS_MAX_AGE = 5  # seconds
+_category_version = 0
+
+
+class CategoryCache:
+    '''
+    In-memory map of category id to category type
+        Parameters:
+                 ttl: seconds before the cache is reloaded from the DB,
+                  None to only reload after local writes
+                 miss_max_age: seconds before a lookup of an unknown id
+                  reloads the cache
+    '''
+
+    def __init__(self, ttl=None, miss_max_age=DEFAULT_MISS_MAX_AGE):
+        self.ttl = ttl
+        self.miss_max_age = miss_max_age
+        self._lock = threading.Lock()
+        self._formatted_categories = {}
+        self._version = None
+        self._loaded_at = None
+
+    def invalidate(self):
+        self._version = None
+
+    def is_stale(self):
+        if self._version != _category_version:
+            return True
+        if not self._formatted_categories:
+            # nothing loaded yet, e.g. the DB was restored after startup
+            return True
+        if self.ttl is None:
+            return False
+        return time.monotonic() - self._loaded_at > self.ttl
+
+    def is_miss_stale(self):
+        '''
+        Returns True if a lookup of an unknown id should reload the cache,
+        as the category may have been added by another process
+        '''
+        return self._loaded_at is None or \
+            time.monotonic() - self._loaded_at > self.miss_max_age
+
+    def _reload(self):
+        '''
+        Reads every category from the DB into the cache
+        '''
+        with self._lock:
+            version = _category_version
+            self._load(db.session.execute(categories_statement()), version)
+
+    def load(self, rows):
+        '''
+        Fills the cache from the rows of categories_statement, for callers
+        that query the DB themselves
+        '''
+        with self._lock:
+            self._load(rows, _category_version)
+
+    def _load(self, rows, version):
+        self._formatted_categories = format_categories(rows)
+        self._version = version
+        self._loaded_at = time.monotonic()
+
+    @property
+    def formatted_categories(self):
+        '''The categories as last loaded, keyed by id, never reloaded'''
+        return self._formatted_categories
+
+    def get_formatted(self):
+        '''
+        Returns a dictionary of all trivia game categories keyed by id
+        '''
+        if self.is_stale():
+            self._reload()
+        return self._formatted_categories
+
+    def get_type(self, category_id):
+        '''
+        Returns the type of the category with the given id, None if there
+        is no such category
+        '''
+        category_type = self.get_formatted().get(f'{category_id}')
+        if category_type is None and self.is_miss_stale():
+            self._reload()
+            category_type = self._formatted_categories.get(f'{category_id}')
+        return category_type
+
+
+def _mark_changed(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        session.info['categories_changed'] = True
+
+
+def _bump_after_commit(session):
+    global _category_version
+    if session.info.pop('categories_changed', False):
+        _category_version += 1
+
+
+def _forget_rolled_back_changes(session, previous_transaction):
+    # a savepoint rolled back may drop only some of the writes noted, so
+    # reload rather than guess which of them still stand
+    global _category_version
+    if session.info.pop('categories_changed', False):
+        _category_version += 1
+
+
+event.listen(Category, 'after_insert', _mark_changed)
+event.listen(Category, 'after_update', _mark_changed)
+event.listen(Category, 'after_delete', _mark_changed)
+event.listen(Session, 'after_commit', _bump_after_commit)
+event.listen(Session, 'after_soft_rollback', _forget_rolled_back_changes)
@@ -0,0 +1,71 @@
+'''
+Response compression
+
+Compresses response bodies above a size threshold with brotli, when it is
+installed and accepted by the client, or gzip. Streamed responses, such as
+the question export, are passed through unchanged.
+'''
+
+import gzip
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - depends on the environment
+    brotli = None
+
+BROTLI = 'br'
+GZIP = 'gzip'
+DEFAULT_COMPRESS_MIN_SIZE = 1024  # bytes
+DEFAULT_COMPRESS_LEVEL = 6
+DEFAULT_BROTLI_QUALITY = 4
+
+
+def choose_encoding(accept_encodings):
+    '''
+    Returns the best encoding the client accepts, None for no compression
+        Parameters:
+                 accept_encodings: the request's Accept-Encoding header,
+                  parsed by werkzeug
+    '''
+    if brotli is not None and accept_encodings[BROTLI]:
+        return BROTLI
+    if accept_encodings[GZIP]:
+        return GZIP
+    return None
+
+
+def compress_response(response, accept_encodings,
+                      min_size=DEFAULT_COMPRESS_MIN_SIZE,
+                      level=DEFAULT_COMPRESS_LEVEL,
+                      brotli_quality=DEFAULT_BROTLI_QUALITY):
+    '''
+    Compresses a response in place if that is worthwhile
+        Parameters:
+                 response: the response to compress
+                 accept_encodings: the request's Accept-Encoding header
+                 min_size: bodies smaller than this are left alone
+                 level: the gzip compression level
+                 brotli_quality: the brotli compression quality
+
+        Returns:
+                response: the same response
+    '''
+    if (response.direct_passthrough or response.is_streamed or
+            'Content-Encoding' in response.headers or
+            response.status_code < 200 or response.status_code >= 300 or
+            response.status_code == 204):
+        return response
+    response.vary.add('Accept-Encoding')
+    body = response.get_data()
+    if len(body) < min_size:
+        return response
+    encoding = choose_encoding(accept_encodings)
+    if encoding is None:
+        return response
+    if encoding == BROTLI:
+        body = brotli.compress(body, quality=brotli_quality)
+    else:
+        body = gzip.compress(body, compresslevel=level)
+    response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+    return response
@@ -0,0 +1,184 @@
+'''
+Content versioning for conditional GETs
+
+Every committed insert, update or delete of a Question or Category bumps
+a content version. GET responses carry the version as their ETag, so a
+request whose If-None-Match holds the current version is answered with a
+304 before the view runs, without a DB query or JSON serialization.
+
+The version is bumped after the commit, never before, so a response built
+from data read before a write can't carry the version of that write.
+
+Responses carry no Last-Modified header. HTTP dates have whole seconds, so
+a write made in the same second as a GET would leave the date unchanged
+and a client revalidating with If-Modified-Since would be told its stale
+copy is current. The version changes on every write.
+
+Worker processes that each keep their own version never see each other's
+writes, and answer 304 for content another worker has since changed until
+they take a write themselves. Workers serving one DB should share their
+version through a SqliteContentVersion, set with the CONTENT_VERSION_PATH
+config value.
+'''
+
+import os
+import secrets
+import sqlite3
+import threading
+import time
+import weakref
+from datetime import datetime
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+from models import Question, Category
+
+SQLITE_TIMEOUT = 5  # seconds to wait on a write lock before failing
+
+_live_versions = weakref.WeakSet()
+_in_process_versions = weakref.WeakSet()
+
+
+class InProcessContentVersion:
+    '''
+    A content version kept in this process's memory.
+
+    Its ETags start with a token unique to the process, drawn again in
+    every process forked from it, e.g. by gunicorn's preload_app, so they
+    never match responses of another worker process. Writes made through
+    another process are not seen though, so several worker processes
+    should share one version through the CONTENT_VERSION_STORE config
+    value: a SqliteContentVersion, or any object with the same current and
+    bump methods and etag_prefix attribute.
+    '''
+
+    def __init__(self):
+        self.etag_prefix = secrets.token_hex(4)
+        self._lock = threading.Lock()
+        self._version = 0
+        self._modified_at = datetime.utcnow()
+        _in_process_versions.add(self)
+
+    def current(self):
+        '''
+        Returns the version of the content and when it last changed, as
+        a naive UTC datetime
+        '''
+        return self._version, self._modified_at
+
+    def bump(self):
+        with self._lock:
+            self._version += 1
+            self._modified_at = datetime.utcnow()
+
+    def _forget_parent(self):
+        # the child counts its own writes from here on, under a new token
+        self.etag_prefix = secrets.token_hex(4)
+        self._lock = threading.Lock()
+
+
+class SqliteContentVersion:
+    '''
+    A content version kept in a SQLite file, which every worker process on
+    a host can open, so a write through any of them changes the version
+    all of them serve. Its ETag token is drawn when the file is created.
+        Parameters:
+                 path: the SQLite file, created on first use
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._etag_prefix = None
+
+    def _connection(self):
+        # one connection per thread, and none inherited from a parent
+        # process
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(
+                self.path, timeout=SQLITE_TIMEOUT, isolation_level=None)
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS content_version ('
+                'id INTEGER PRIMARY KEY, etag_prefix TEXT NOT NULL, '
+                'version INTEGER NOT NULL, modified_at REAL NOT NULL)')
+            connection.execute(
+                'INSERT OR IGNORE INTO content_version VALUES (1, ?, 0, ?)',
+                (secrets.token_hex(4), time.time()))
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    @property
+    def etag_prefix(self):
+        if self._etag_prefix is None:
+            self._etag_prefix = self._connection().execute(
+                'SELECT etag_prefix FROM content_version').fetchone()[0]
+        return self._etag_prefix
+
+    def current(self):
+        '''
+        Returns the version of the content and when it last changed, as
+        a naive UTC datetime
+        '''
+        version, modified_at = self._connection().execute(
+            'SELECT version, modified_at FROM content_version').fetchone()
+        return version, datetime.utcfromtimestamp(modified_at)
+
+    def bump(self):
+        self._connection().execute(
+            'UPDATE content_version SET version = version + 1, '
+            'modified_at = ?', (time.time(),))
+
+
+def track_content_version(content_version):
+    '''
+    Makes committed Question and Category writes bump content_version
+    '''
+    _live_versions.add(content_version)
+
+
+def make_etag(content_version, version):
+    return f'{content_version.etag_prefix}-{version}'
+
+
+def is_not_modified(request, etag):
+    '''
+    Returns True if the client's cached copy, identified by the request's
+    If-None-Match header, is still current
+    '''
+    return request.if_none_match.contains_weak(etag)
+
+
+def _mark_changed(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        session.info['content_changed'] = True
+
+
+def _bump_after_commit(session):
+    if session.info.pop('content_changed', False):
+        for content_version in list(_live_versions):
+            content_version.bump()
+
+
+def _forget_rolled_back_changes(session, previous_transaction):
+    session.info.pop('content_changed', None)
+
+
+for model in (Question, Category):
+    event.listen(model, 'after_insert', _mark_changed)
+    event.listen(model, 'after_update', _mark_changed)
+    event.listen(model, 'after_delete', _mark_changed)
+event.listen(Session, 'after_commit', _bump_after_commit)
+event.listen(Session, 'after_soft_rollback', _forget_rolled_back_changes)
+
+
+def _forget_parent_versions():
+    for content_version in list(_in_process_versions):
+        content_version._forget_parent()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_forget_parent_versions)
@@ -0,0 +1,75 @@
+'''
+Question bank export
+
+Streams questions as NDJSON or CSV straight from a server-side DB cursor,
+so an export of any size holds only one batch of rows in memory. The CSV
+output can be read back by the bulk import.
+'''
+
+import csv
+import json
+
+from models import db, Question
+
+NDJSON = 'ndjson'
+CSV = 'csv'
+EXPORT_FORMATS = (NDJSON, CSV)
+EXPORT_MIMETYPES = {NDJSON: 'application/x-ndjson', CSV: 'text/csv'}
+EXPORT_BATCH_SIZE = 1000
+EXPORT_FIELDS = ('id', 'question', 'answer', 'difficulty', 'category')
+
+
+class _LineWriter:
+    '''a file-like object whose write returns what was written'''
+
+    def write(self, line):
+        return line
+
+
+def export_rows(category_id=None, difficulty=None,
+                batch_size=EXPORT_BATCH_SIZE):
+    '''
+    Returns the rows of the questions to export, fetched batch_size at a
+    time through a server-side cursor
+        Parameters:
+                 category_id: only export this category if given
+                 difficulty: only export this difficulty if given
+                 batch_size: the number of rows fetched at a time
+    '''
+    question_query = db.session.query(
+        *[getattr(Question, field) for field in EXPORT_FIELDS])
+    if category_id is not None:
+        question_query = question_query.filter(
+            Question.category == category_id)
+    if difficulty is not None:
+        question_query = question_query.filter(
+            Question.difficulty == difficulty)
+    return question_query.order_by(Question.id).yield_per(batch_size)
+
+
+def export_questions(export_format=NDJSON, category_id=None,
+                     difficulty=None, batch_size=EXPORT_BATCH_SIZE):
+    '''
+    Yields the exported questions as chunks of text
+        Parameters:
+                 export_format: 'ndjson' or 'csv'
+                 category_id: only export this category if given
+                 difficulty: only export this difficulty if given
+                 batch_size: the number of lines per chunk
+    '''
+    rows = export_rows(category_id, difficulty, batch_size)
+    if export_format == CSV:
+        writer = csv.writer(_LineWriter())
+        yield writer.writerow(EXPORT_FIELDS)
+        format_row = writer.writerow
+    else:
+        def format_row(row):
+            return json.dumps(dict(zip(EXPORT_FIELDS, row))) + '\n'
+    chunk = []
+    for row in rows:
+        chunk.append(format_row(row))
+        if len(chunk) >= batch_size:
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
@@ -0,0 +1,105 @@
+'''
+JSON serialization
+
+The app's JSON provider turns response data into JSON with orjson when it
+is installed, and with Flask's stdlib based encoder otherwise. The
+JSON_PROVIDER config value ('orjson' or 'stdlib') forces a choice.
+
+jsonify below is a drop-in replacement for flask.jsonify that uses the
+provider of the current app.
+'''
+
+import time
+
+from flask import current_app, json
+
+from .metrics import add_time
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depends on the environment
+    orjson = None
+
+ORJSON = 'orjson'
+STDLIB = 'stdlib'
+
+
+class StdlibJSONProvider:
+    '''
+    Serializes like flask.jsonify, honouring JSON_SORT_KEYS and the pretty
+    printing settings
+    '''
+    name = STDLIB
+
+    def __init__(self, app):
+        self.app = app
+
+    def dumps(self, data):
+        '''Returns data serialized to JSON bytes'''
+        indent = None
+        separators = (',', ':')
+        if self.app.config['JSONIFY_PRETTYPRINT_REGULAR'] or self.app.debug:
+            indent = 2
+            separators = (', ', ': ')
+        return (json.dumps(data, indent=indent, separators=separators) +
+                '\n').encode('utf-8')
+
+
+class OrjsonProvider(StdlibJSONProvider):
+    '''
+    Serializes with orjson to the same bytes as the stdlib provider,
+    falling back to it for output orjson can't match: data orjson can't
+    handle, non-ASCII text while JSON_AS_ASCII asks for it escaped, which
+    orjson never does, and pretty printing, whose stdlib separators leave
+    a trailing space at the end of every line
+    '''
+    name = ORJSON
+
+    def dumps(self, data):
+        if self.app.config['JSONIFY_PRETTYPRINT_REGULAR'] or self.app.debug:
+            return super().dumps(data)
+        options = orjson.OPT_NON_STR_KEYS | orjson.OPT_APPEND_NEWLINE
+        if self.app.config['JSON_SORT_KEYS']:
+            options |= orjson.OPT_SORT_KEYS
+        try:
+            body = orjson.dumps(data, option=options)
+        except TypeError:
+            return super().dumps(data)
+        if self.app.config['JSON_AS_ASCII'] and not body.isascii():
+            return super().dumps(data)
+        return body
+
+
+def create_json_provider(app):
+    '''
+    Returns the fastest available JSON provider, or the one named by the
+    JSON_PROVIDER config value
+    '''
+    name = app.config.get('JSON_PROVIDER')
+    if name is None:
+        name = ORJSON if orjson is not None else STDLIB
+    if name == ORJSON:
+        if orjson is None:
+            raise RuntimeError(
+                'JSON_PROVIDER is orjson but orjson is not installed')
+        return OrjsonProvider(app)
+    return StdlibJSONProvider(app)
+
+
+def jsonify(*args, **kwargs):
+    '''
+    Returns a JSON response of the given data, takes the same arguments as
+    flask.jsonify
+    '''
+    if args and kwargs:
+        raise TypeError('jsonify() behavior undefined when passed both args '
+                        'and kwargs')
+    if len(args) == 1:
+        data = args[0]
+    else:
+        data = args or kwargs
+    start = time.perf_counter()
+    body = current_app.json_provider.dumps(data)
+    add_time('serialize', time.perf_counter() - start)
+    return current_app.response_class(
+        body, mimetype=current_app.config['JSONIFY_MIMETYPE'])
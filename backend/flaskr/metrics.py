@@ -0,0 +1,237 @@
+'''
+Request instrumentation
+
+Times every request, the SQL it runs, and the time spent serializing and
+compressing its response. The timings of a request go back to the client
+in a Server-Timing header, and histograms of them, by endpoint, are served
+in the Prometheus text format at /metrics.
+
+Queries are timed by SQLAlchemy engine events, so every engine and bind
+is covered, and recorded against the request being served, if any.
+Histograms are kept per process, the way every gunicorn worker keeps its
+own, and updating one costs a bisect and a lock.
+'''
+
+import bisect
+import threading
+import time
+
+from flask import g, has_app_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+METRICS_MIMETYPE = 'text/plain; version=0.0.4; charset=utf-8'
+UNMATCHED_ENDPOINT = 'unmatched'
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0)  # seconds
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+class RequestTimer:
+    '''
+    The timings of one request, kept in flask.g while it is served
+    '''
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.db = 0.0
+        self.serialize = 0.0
+        self.compress = 0.0
+
+    def server_timing(self, total):
+        '''
+        Returns the Server-Timing header value of the request
+            Parameters:
+                     total: the seconds spent serving the request
+        '''
+        return (f'db;dur={self.db * 1000:.2f};desc="{self.queries} queries",'
+                f' serialize;dur={self.serialize * 1000:.2f},'
+                f' compress;dur={self.compress * 1000:.2f},'
+                f' total;dur={total * 1000:.2f}')
+
+
+def start_request_timer():
+    '''Starts timing the request being served'''
+    g.request_timer = RequestTimer()
+
+
+def current_timer():
+    '''Returns the RequestTimer of the request being served, if any'''
+    if has_app_context():
+        return g.get('request_timer')
+    return None
+
+
+def add_time(name, seconds):
+    '''
+    Adds seconds spent serializing or compressing to the request being
+    served, if any
+        Parameters:
+                 name: 'serialize' or 'compress'
+                 seconds: the time spent
+    '''
+    timer = current_timer()
+    if timer is not None:
+        setattr(timer, name, getattr(timer, name) + seconds)
+
+
+class Histogram:
+    '''
+    A Prometheus histogram with one series per set of label values
+        Parameters:
+                 name: the metric name
+                 description: the HELP text of the metric
+                 buckets: the upper bounds of the buckets, in order
+                 label_names: the names of the labels of a series
+    '''
+
+    def __init__(self, name, description, buckets, label_names):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        self.label_names = label_names
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, label_values, value):
+        '''Records one value in the series of label_values'''
+        bucket = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = [
+                    [0] * (len(self.buckets) + 1), 0.0]
+            series[0][bucket] += 1
+            series[1] += value
+
+    def render(self):
+        '''Returns the histogram in the Prometheus text format'''
+        with self.lock:
+            series = [(label_values, list(counts), total)
+                      for label_values, (counts, total)
+                      in sorted(self.series.items())]
+        lines = [f'# HELP {self.name} {self.description}',
+                 f'# TYPE {self.name} histogram']
+        for label_values, counts, total in series:
+            labels = ','.join(
+                f'{name}="{escape_label(value)}"'
+                for name, value in zip(self.label_names, label_values))
+            cumulative = 0
+            for upper_bound, count in zip(
+                    self.buckets + (float('inf'),), counts):
+                cumulative += count
+                bound = '+Inf' if upper_bound == float('inf') \
+                    else f'{upper_bound}'
+                lines.append(
+                    f'{self.name}_bucket{{{labels},le="{bound}"}} '
+                    f'{cumulative}')
+            lines.append(f'{self.name}_sum{{{labels}}} {total}')
+            lines.append(f'{self.name}_count{{{labels}}} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+
+class Counter:
+    '''
+    A Prometheus counter with one series per set of label values
+        Parameters:
+                 name: the metric name
+                 description: the HELP text of the metric
+                 label_names: the names of the labels of a series
+    '''
+
+    def __init__(self, name, description, label_names):
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def inc(self, label_values, amount=1):
+        '''Adds amount to the series of label_values'''
+        with self.lock:
+            self.series[label_values] = \
+                self.series.get(label_values, 0) + amount
+
+    def render(self):
+        '''Returns the counter in the Prometheus text format'''
+        with self.lock:
+            series = sorted(self.series.items())
+        lines = [f'# HELP {self.name} {self.description}',
+                 f'# TYPE {self.name} counter']
+        for label_values, count in series:
+            labels = ','.join(
+                f'{name}="{escape_label(value)}"'
+                for name, value in zip(self.label_names, label_values))
+            lines.append(f'{self.name}{{{labels}}} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+def escape_label(value):
+    '''Returns a label value escaped for the Prometheus text format'''
+    return f'{value}'.replace('\\', '\\\\').replace('"', '\\"').replace(
+        '\n', '\\n')
+
+
+class RequestMetrics:
+    '''
+    The histograms of request timings, by method, endpoint and status
+    '''
+
+    def __init__(self):
+        labels = ('method', 'endpoint', 'status')
+        self.latency = Histogram(
+            'trivia_request_duration_seconds',
+            'Time spent serving a request.', LATENCY_BUCKETS, labels)
+        self.db_time = Histogram(
+            'trivia_request_db_seconds',
+            'Time spent running SQL for a request.', LATENCY_BUCKETS, labels)
+        self.serialize_time = Histogram(
+            'trivia_request_serialize_seconds',
+            'Time spent serializing the JSON of a response.',
+            LATENCY_BUCKETS, labels)
+        self.query_count = Histogram(
+            'trivia_request_queries',
+            'Number of SQL statements run for a request.',
+            QUERY_COUNT_BUCKETS, labels)
+
+    def observe(self, request, response, timer):
+        '''
+        Records the timings of a served request
+            Returns:
+                    total: the seconds spent serving the request
+        '''
+        total = time.perf_counter() - timer.start
+        # the URL rule rather than the path keeps the number of series
+        # bounded, e.g. one for every /questions/<int:question_id>
+        rule = request.url_rule
+        label_values = (request.method,
+                        rule.rule if rule is not None else UNMATCHED_ENDPOINT,
+                        f'{response.status_code}')
+        self.latency.observe(label_values, total)
+        self.db_time.observe(label_values, timer.db)
+        self.serialize_time.observe(label_values, timer.serialize)
+        self.query_count.observe(label_values, timer.queries)
+        return total
+
+    def render(self):
+        '''Returns every histogram in the Prometheus text format'''
+        return ''.join(histogram.render() for histogram in (
+            self.latency, self.db_time, self.serialize_time,
+            self.query_count))
+
+
+def _start_query(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._query_start = time.perf_counter()
+
+
+def _end_query(conn, cursor, statement, parameters, context, executemany):
+    timer = current_timer()
+    if timer is not None and context is not None:
+        timer.queries += 1
+        timer.db += time.perf_counter() - context._query_start
+
+
+event.listen(Engine, 'before_cursor_execute', _start_query)
+event.listen(Engine, 'after_cursor_execute', _end_query)
@@ -0,0 +1,174 @@
+'''
+Schema migrations
+
+The app never changes the schema itself, create_schema() does, from
+`flask migrate`. db.create_all() only creates missing tables, so columns
+and indexes added to the models after a database was created (for example
+one restored from trivia.psql) are added here. Migrations run in order,
+are recorded in the schema_migrations table and are written to be safe to
+re-run on a database that create_all() already built with the current
+models.
+
+run from the backend folder:
+flask migrate
+'''
+
+from sqlalchemy import Integer, inspect, text
+
+from models import db, Question, hash_question
+
+BACKFILL_BATCH_SIZE = 1000
+CATEGORY_INDEXES = [
+    ('ix_questions_category_id', 'category, id'),
+    ('ix_questions_category_difficulty', 'category, difficulty'),
+]
+QUESTION_COLUMNS = 'id, question, answer, difficulty, category, question_hash'
+
+
+def column_names(table_name):
+    inspector = inspect(db.session.connection())
+    return {column['name'] for column in inspector.get_columns(table_name)}
+
+
+def index_names(table_name):
+    inspector = inspect(db.session.connection())
+    return {index['name'] for index in inspector.get_indexes(table_name)}
+
+
+def column_type(table_name, column_name):
+    inspector = inspect(db.session.connection())
+    for column in inspector.get_columns(table_name):
+        if column['name'] == column_name:
+            return column['type']
+    return None
+
+
+def has_foreign_key(table_name, column_name):
+    inspector = inspect(db.session.connection())
+    return any(foreign_key['constrained_columns'] == [column_name]
+               for foreign_key in inspector.get_foreign_keys(table_name))
+
+
+def add_question_hash():
+    '''
+    Adds the unique question_hash column used for duplicate checks and
+    fills it in for existing questions. Of questions that are already
+    duplicates only the first keeps its hash.
+    '''
+    if 'question_hash' not in column_names('questions'):
+        db.session.execute(
+            'ALTER TABLE questions ADD COLUMN question_hash VARCHAR(64)')
+    seen_hashes = {question_hash for question_hash, in db.session.query(
+        Question.question_hash).filter(Question.question_hash.isnot(None))}
+    last_id = 0
+    while True:
+        rows = db.session.query(Question.id, Question.question).filter(
+            Question.id > last_id, Question.question_hash.is_(None)).order_by(
+            Question.id).limit(BACKFILL_BATCH_SIZE).all()
+        if not rows:
+            break
+        updates = []
+        for question_id, question in rows:
+            question_hash = hash_question(question)
+            if question_hash is not None and question_hash not in seen_hashes:
+                seen_hashes.add(question_hash)
+                updates.append(
+                    {'question_id': question_id,
+                     'question_hash': question_hash})
+        if updates:
+            db.session.execute(text(
+                'UPDATE questions SET question_hash = :question_hash '
+                'WHERE id = :question_id'), updates)
+        last_id = rows[-1][0]
+    if 'ix_questions_question_hash' not in index_names('questions'):
+        db.session.execute(
+            'CREATE UNIQUE INDEX ix_questions_question_hash '
+            'ON questions (question_hash)')
+
+
+def rebuild_questions_table():
+    '''
+    Recreates the questions table from the Question model and copies the
+    questions over, for SQLite, which can't alter a column's type or add a
+    foreign key to an existing table
+    '''
+    for name in index_names('questions'):
+        db.session.execute(f'DROP INDEX {name}')
+    db.session.execute('ALTER TABLE questions RENAME TO questions_old')
+    Question.__table__.create(db.session.connection())
+    db.session.execute(
+        f'INSERT INTO questions ({QUESTION_COLUMNS}) '
+        f'SELECT id, question, answer, difficulty, '
+        f"CAST(NULLIF(TRIM(category), '') AS INTEGER), question_hash "
+        f'FROM questions_old')
+    db.session.execute('DROP TABLE questions_old')
+
+
+def make_category_foreign_key():
+    '''
+    Turns questions.category, text in databases created before this
+    migration, into an integer foreign key to categories and adds the
+    composite (category, id) and (category, difficulty) indexes. The
+    trivia.psql dump already has an integer column, so there only the
+    foreign key and the indexes are added.
+    '''
+    is_sqlite = db.session.connection().dialect.name == 'sqlite'
+    if not isinstance(column_type('questions', 'category'), Integer):
+        if is_sqlite:
+            rebuild_questions_table()
+        else:
+            db.session.execute(
+                'ALTER TABLE questions ALTER COLUMN category TYPE INTEGER '
+                "USING NULLIF(TRIM(category), '')::integer")
+    if not has_foreign_key('questions', 'category') and not is_sqlite:
+        db.session.execute(
+            'ALTER TABLE questions ADD CONSTRAINT questions_category_fkey '
+            'FOREIGN KEY (category) REFERENCES categories (id)')
+    existing_indexes = index_names('questions')
+    for name, columns in CATEGORY_INDEXES:
+        if name not in existing_indexes:
+            db.session.execute(f'CREATE INDEX {name} ON questions ({columns})')
+
+
+MIGRATIONS = [
+    ('0001_question_hash', add_question_hash),
+    ('0002_category_foreign_key', make_category_foreign_key),
+]
+
+
+def apply_migrations():
+    '''
+    Runs every migration not yet recorded in schema_migrations
+
+        Returns:
+                applied: the names of the migrations that were run
+    '''
+    db.session.execute(
+        'CREATE TABLE IF NOT EXISTS schema_migrations '
+        '(name VARCHAR(255) PRIMARY KEY)')
+    db.session.commit()
+    done = {name for name, in db.session.execute(
+        'SELECT name FROM schema_migrations')}
+    applied = []
+    for name, migration in MIGRATIONS:
+        if name in done:
+            continue
+        migration()
+        db.session.execute(
+            text('INSERT INTO schema_migrations (name) VALUES (:name)'),
+            {'name': name})
+        db.session.commit()
+        applied.append(name)
+    return applied
+
+
+def create_schema():
+    '''
+    Creates the tables missing from the DB, then runs every migration not
+    yet applied
+
+        Returns:
+                applied: the names of the migrations that were run
+    '''
+    db.create_all()
+    return apply_migrations()
@@ -0,0 +1,80 @@
+'''
+Question list pagination helpers
+
+fetch_page returns a page of questions together with the total number of
+matching questions in a single round trip to the DB: a window count in
+page mode, and an uncorrelated count subquery in cursor mode, where the
+page itself is narrowed by the cursor. Pages are Core selects of just the
+question columns a response needs, read as plain rows rather than loaded
+into Question instances.
+
+The statements are built by flaskr.queries, which the ASGI app pages
+with as well; only running them through the session is done here.
+'''
+
+import json
+
+from models import db
+from .queries import count_statement, page_statement, page_total, cursor_page
+
+EXACT = 'exact'
+ESTIMATE = 'estimate'
+NO_COUNT = 'none'
+COUNT_MODES = (EXACT, ESTIMATE, NO_COUNT)
+
+
+def estimate_count(statement):
+    '''
+    Returns the planner's estimate of the number of rows of a select on
+    Postgres, or an exact count on databases without estimates
+    '''
+    if db.session.get_bind().dialect.name != 'postgresql':
+        return db.session.execute(count_statement(statement)).scalar()
+    compiled = statement.order_by(None).compile(
+        dialect=db.session.get_bind().dialect)
+    explained = db.session.connection().execute(
+        'EXPLAIN (FORMAT JSON) ' + str(compiled), compiled.params).scalar()
+    if isinstance(explained, str):
+        explained = json.loads(explained)
+    return int(explained[0]['Plan']['Plan Rows'])
+
+
+def fetch_page(statement, after=None, offset=0, page_size=10,
+               count_mode=EXACT, order_by=None):
+    '''
+    Returns one page of a select of question columns and the number of
+    questions it matches
+        Parameters:
+                 statement: an unordered select of question columns, see
+                  queries.questions_statement
+                 after: the id of the last question already returned,
+                  selects cursor pagination in id order
+                 offset: the number of questions before the page when
+                  after is None
+                 page_size: the number of questions on the page
+                 count_mode: 'exact', 'estimate' or 'none'
+                 order_by: the ordering of the page when after is None,
+                  defaults to question id
+
+        Returns:
+                question_selection: a list of question rows on the page
+                total_questions: the number of questions the select
+                 matches, None when count_mode is 'none'
+                next_cursor: in cursor mode, the id to pass as 'after'
+                 for the next page, None on the last page
+    '''
+    page = page_statement(statement, after, offset, page_size, order_by,
+                          with_total=count_mode == EXACT)
+    question_selection = db.session.execute(page).fetchall()
+    total_questions = None
+    if count_mode == EXACT:
+        total_questions = page_total(question_selection, after, offset)
+        if total_questions is None:
+            total_questions = db.session.execute(
+                count_statement(statement)).scalar()
+    elif count_mode == ESTIMATE:
+        total_questions = estimate_count(statement)
+
+    question_selection, next_cursor = cursor_page(
+        question_selection, after, page_size)
+    return question_selection, total_questions, next_cursor
@@ -0,0 +1,215 @@
+'''
+Shared query layer
+
+SQLAlchemy Core statements and row formatting used by both serving modes:
+the Flask app runs them through the Flask-SQLAlchemy session, the ASGI app
+(flaskr.asgi) through an async driver. Keeping the SQL here keeps the JSON
+contracts of the two modes in step.
+'''
+
+from sqlalchemy import func, or_, select
+
+from models import Question, Category, QuizResult
+
+QUESTION_FIELDS = ('id', 'question', 'answer', 'category', 'difficulty')
+QUESTION_COLUMNS = (Question.id, Question.question, Question.answer,
+                    Question.category, Question.difficulty)
+
+
+def question_columns(fields=QUESTION_FIELDS):
+    '''
+    Returns the columns to select for the given question fields, always
+    with the id first, which pagination and quiz draws key on
+    '''
+    return (Question.id,) + tuple(getattr(Question, field)
+                                  for field in fields if field != 'id')
+
+
+def format_question(row, fields=QUESTION_FIELDS):
+    '''
+    Returns a question row, selected with question_columns(fields),
+    formatted like Question.format with only the given fields
+    '''
+    # the row's columns are in the order of fields, after the id when
+    # fields leave it out, and any columns after them are dropped
+    if not fields or fields[0] != 'id':
+        row = row[1:]
+    return dict(zip(fields, row))
+
+
+def format_categories(rows):
+    '''
+    Returns category rows as a dictionary of category type keyed by id
+    '''
+    return {f'{row["id"]}': f'{row["type"]}' for row in rows}
+
+
+def categories_statement():
+    '''Selects every category, by id'''
+    return select([Category.id, Category.type]).order_by(Category.id)
+
+
+def question_ids_statement():
+    '''
+    Selects the (id, category) pair of every question, read from the
+    (category, id) index alone
+    '''
+    return select([Question.id, Question.category]).order_by(
+        Question.category, Question.id)
+
+
+def search_documents_statement():
+    '''Selects the searchable text of every question'''
+    return select([Question.id, Question.question, Question.answer,
+                   Question.category])
+
+
+def count_questions_statement():
+    '''Counts every question'''
+    return select([func.count(Question.id)])
+
+
+def question_statement(question_id):
+    '''Selects one question'''
+    return select(QUESTION_COLUMNS).where(Question.id == question_id)
+
+
+def questions_by_ids_statement(question_ids, columns=QUESTION_COLUMNS):
+    '''Selects the given columns of the questions with the given ids'''
+    return select(columns).where(Question.id.in_(question_ids))
+
+
+def matches_term(term):
+    '''
+    Returns the condition of a question's text or answer containing the
+    term, ignoring case
+    '''
+    pattern = f'%{term}%'
+    return or_(Question.question.ilike(pattern),
+               Question.answer.ilike(pattern))
+
+
+def search_rank(term):
+    '''
+    Returns the Postgres pg_trgm relevance of a question to the term
+    '''
+    return func.greatest(
+        func.word_similarity(term, Question.question),
+        func.word_similarity(term, func.coalesce(Question.answer, '')))
+
+
+def questions_statement(category_id=None, term=None,
+                        columns=QUESTION_COLUMNS):
+    '''
+    Selects the given columns of the questions to list, unordered
+        Parameters:
+                 category_id: only select this category if given
+                 term: only select questions matching this search term
+                 columns: the question columns to select, see
+                  question_columns, the id among them
+    '''
+    statement = select(columns)
+    if category_id:
+        statement = statement.where(Question.category == int(category_id))
+    if term is not None:
+        statement = statement.where(matches_term(term))
+    return statement
+
+
+def count_statement(statement):
+    '''Counts the questions a select of question columns matches'''
+    return statement.with_only_columns(
+        [func.count(Question.id)]).order_by(None)
+
+
+def page_statement(statement, after=None, offset=0, page_size=10,
+                   order_by=None, with_total=True):
+    '''
+    Selects one page of a select of question columns
+        Parameters:
+                 statement: an unordered select of question columns, see
+                  questions_statement
+                 after: the id of the last question already returned,
+                  selects cursor pagination in id order, with one row more
+                  than the page to spot the last page
+                 offset: the number of questions before the page when
+                  after is None
+                 page_size: the number of questions on the page
+                 order_by: the ordering of the page when after is None,
+                  defaults to question id
+                 with_total: add the number of questions the select matches
+                  as a 'total_questions' column
+    '''
+    if after is None:
+        page = statement.order_by(
+            *(order_by or (Question.id,))).limit(page_size).offset(offset)
+        total_column = func.count(Question.id).over()
+    else:
+        page = statement.where(Question.id > after).order_by(
+            Question.id).limit(page_size + 1)
+        total_column = count_statement(statement).correlate(
+            None).as_scalar()
+    if with_total:
+        page = page.column(total_column.label('total_questions'))
+    return page
+
+
+def page_total(rows, after=None, offset=0):
+    '''
+    Returns the number of matching questions carried by the rows of a
+    page_statement with_total, or None past the last page, where no row
+    carries it and count_statement must be run instead
+    '''
+    if rows:
+        return rows[0]['total_questions']
+    if after is None and offset == 0:
+        return 0
+    return None
+
+
+def cursor_page(rows, after, page_size):
+    '''
+    Returns the rows of a page_statement trimmed to page_size, and the id
+    to pass as 'after' for the next page in cursor mode, None on the last
+    page or in page mode
+    '''
+    if after is None or len(rows) <= page_size:
+        return rows, None
+    rows = rows[:page_size]
+    return rows, rows[-1]['id']
+
+
+def insert_question_statement(question):
+    '''Inserts a Question built but not added to a session'''
+    return Question.__table__.insert().values(
+        question=question.question,
+        answer=question.answer,
+        category=question.category,
+        difficulty=question.difficulty,
+        question_hash=question.question_hash)
+
+
+def question_by_hash_statement(question_hash):
+    '''Selects the question with the given question_hash'''
+    return select(QUESTION_COLUMNS).where(
+        Question.question_hash == question_hash)
+
+
+def delete_question_statement(question_id):
+    '''Deletes one question'''
+    return Question.__table__.delete().where(Question.id == question_id)
+
+
+def leaderboard_statement(size):
+    '''
+    Selects the best size results of every category, by score and then
+    the earliest, with the rank of each in its category
+    '''
+    rank = func.row_number().over(
+        partition_by=QuizResult.category,
+        order_by=(QuizResult.score.desc(), QuizResult.created_at)
+    ).label('rank')
+    ranked = select([QuizResult.player, QuizResult.category,
+                     QuizResult.score, QuizResult.total_questions,
+                     QuizResult.created_at, rank]).alias('ranked')
+    return select([ranked]).where(ranked.c.rank <= size)
@@ -0,0 +1,228 @@
+'''
+Quiz draw engine
+
+Keeps a compact, per-category array of question ids in memory so that
+drawing a quiz question only has to sample an id and fetch that single row,
+instead of loading every remaining question in the category. A deck of
+questions for a whole game is sampled the same way and fetched in one
+query.
+'''
+
+import random
+import threading
+import time
+import weakref
+from array import array
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+from models import db, Question
+from .queries import (
+    question_ids_statement, questions_by_ids_statement, QUESTION_COLUMNS)
+
+ALL_CATEGORIES = 0
+DEFAULT_DECK_SIZE = 5
+MAX_DECK_SIZE = 50
+MAX_RANDOM_PROBES = 32
+DEFAULT_INDEX_MAX_AGE = 60  # seconds
+
+_live_engines = weakref.WeakSet()
+
+
+class QuizDrawEngine:
+    '''
+    Draws random quiz questions from an in-memory question id index
+        Parameters:
+                 max_age: seconds before the index is rebuilt from the DB so
+                  writes made by other worker processes are picked up,
+                  None to only rebuild after local writes
+                 max_probes: random probes made before falling back to a
+                  scan of the remaining ids
+    '''
+
+    def __init__(self, max_age=DEFAULT_INDEX_MAX_AGE,
+                 max_probes=MAX_RANDOM_PROBES):
+        self.max_age = max_age
+        self.max_probes = max_probes
+        self._lock = threading.Lock()
+        self._all_ids = array('l')
+        self._ids_by_category = {}
+        self._built_at = None
+        _live_engines.add(self)
+
+    def invalidate(self):
+        '''Marks the index stale so the next draw rebuilds it'''
+        self._built_at = None
+
+    def is_stale(self):
+        if self._built_at is None:
+            return True
+        if self.max_age is None:
+            return False
+        return time.monotonic() - self._built_at > self.max_age
+
+    def _rebuild(self):
+        '''
+        Loads (id, category) pairs only, never full question rows
+        '''
+        self.load(db.session.execute(question_ids_statement()))
+
+    def load(self, rows):
+        '''
+        Builds the index from the rows of question_ids_statement, for
+        callers that query the DB themselves
+        '''
+        all_ids = array('l')
+        ids_by_category = {}
+        for question_id, category in rows:
+            all_ids.append(question_id)
+            ids_by_category.setdefault(
+                f'{category}', array('l')).append(question_id)
+        self._all_ids = all_ids
+        self._ids_by_category = ids_by_category
+        self._built_at = time.monotonic()
+
+    def get_ids(self, category_id):
+        '''
+        Returns the array of question ids for a category
+            Parameters:
+                     category_id: the quiz category id, 0 for all categories
+
+            Returns:
+                    ids: an array of question ids
+        '''
+        with self._lock:
+            if self.is_stale():
+                self._rebuild()
+            if int(category_id) == ALL_CATEGORIES:
+                return self._all_ids
+            return self._ids_by_category.get(f'{category_id}', array('l'))
+
+    def draw_ids(self, category_id, excluded, count):
+        '''
+        Returns up to count distinct random question ids not in excluded
+            Parameters:
+                     category_id: the quiz category id, 0 for all categories
+                     excluded: a container of previously asked question
+                     id's to skip, anything supporting `in`
+                     count: the number of ids wanted
+
+            Returns:
+                    question_ids: a list of question ids in random order,
+                    shorter than count when fewer questions are left
+        '''
+        ids = self.get_ids(category_id)
+        num_ids = len(ids)
+        drawn = []
+        if num_ids == 0 or count <= 0:
+            return drawn
+        drawn_set = set()
+        for _ in range(self.max_probes * count):
+            question_id = ids[random.randrange(num_ids)]
+            if question_id not in excluded and question_id not in drawn_set:
+                drawn.append(question_id)
+                drawn_set.add(question_id)
+                if len(drawn) == count:
+                    return drawn
+        # nearly every question has been asked, pick from what is left
+        remaining = [question_id for question_id in ids
+                     if question_id not in excluded and
+                     question_id not in drawn_set]
+        drawn.extend(random.sample(
+            remaining, min(count - len(drawn), len(remaining))))
+        return drawn
+
+    def draw(self, category_id, excluded, columns=QUESTION_COLUMNS):
+        '''
+        Returns a random question whose id is not in excluded
+            Parameters:
+                     category_id: the quiz category id, 0 for all categories
+                     excluded: a container of previously asked question
+                     id's to skip, anything supporting `in`
+                     columns: the question columns to select, the id first
+
+            Returns:
+                    question: a question row, or None if every question in
+                    the category has been asked
+        '''
+        deck = self.draw_deck(category_id, excluded, 1, columns)
+        return deck[0] if deck else None
+
+    def draw_deck(self, category_id, excluded, count,
+                  columns=QUESTION_COLUMNS):
+        '''
+        Returns up to count distinct random questions whose ids are not in
+        excluded, fetched with one query
+            Parameters:
+                     category_id: the quiz category id, 0 for all categories
+                     excluded: a container of previously asked question
+                     id's to skip, anything supporting `in`
+                     count: the number of questions wanted
+                     columns: the question columns to select, the id first
+
+            Returns:
+                    questions: a list of question rows in random order,
+                    shorter than count when fewer questions are left
+        '''
+        deck = []
+        skipped = set()
+        while len(deck) < count:
+            question_ids = self.draw_ids(
+                category_id, _Excluding(excluded, skipped),
+                count - len(deck))
+            if not question_ids:
+                break
+            questions_by_id = {
+                row['id']: row for row in db.session.execute(
+                    questions_by_ids_statement(question_ids, columns))}
+            deck.extend(questions_by_id[question_id]
+                        for question_id in question_ids
+                        if question_id in questions_by_id)
+            skipped.update(question_ids)
+            if len(questions_by_id) < len(question_ids):
+                # deleted by another process since the index was built,
+                # the rebuilt index will no longer hold the ids
+                self.invalidate()
+        return deck
+
+
+class _Excluding:
+    '''the union of two containers of question ids'''
+
+    def __init__(self, excluded, skipped):
+        self.excluded = excluded
+        self.skipped = skipped
+
+    def __contains__(self, question_id):
+        return question_id in self.skipped or question_id in self.excluded
+
+
+def _note_changed_questions(mapper, connection, target):
+    # invalidated once the write commits: an index rebuilt by another
+    # thread between the flush and the commit would miss the write and
+    # still be marked fresh
+    session = object_session(target)
+    if session is not None:
+        session.info['quiz_index_changed'] = True
+
+
+def _invalidate_after_commit(session):
+    if session.info.pop('quiz_index_changed', False):
+        for engine in list(_live_engines):
+            engine.invalidate()
+
+
+def _forget_rolled_back_changes(session, previous_transaction):
+    # a savepoint rolled back may drop only some of the writes noted, so
+    # rebuild rather than guess which of them still stand
+    if session.info.pop('quiz_index_changed', False):
+        for engine in list(_live_engines):
+            engine.invalidate()
+
+
+event.listen(Question, 'after_insert', _note_changed_questions)
+event.listen(Question, 'after_update', _note_changed_questions)
+event.listen(Question, 'after_delete', _note_changed_questions)
+event.listen(Session, 'after_commit', _invalidate_after_commit)
+event.listen(Session, 'after_soft_rollback', _forget_rolled_back_changes)
@@ -0,0 +1,192 @@
+'''
+Server-side quiz sessions
+
+A quiz session remembers which questions a player has already seen so the
+client no longer has to resend its whole previous_questions list on every
+draw. Seen questions are kept as a bitset indexed by question id, less the
+smallest id seen.
+'''
+
+import secrets
+import struct
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_SESSION_TTL = 3600  # seconds
+MIN_BITSET_BYTES = 64
+BITSET_BYTES_PER_ID = 32  # about what a set spends on an id
+DENSE = b'd'
+SPARSE = b's'
+
+
+class QuestionBitset:
+    '''
+    A compact set of question ids, one bit per id from the smallest id
+    added to the largest, so its size follows the ids seen rather than
+    how large they are. Ids too far apart for bits to pay off, such as a
+    handful spread over a million, are kept in a set instead
+    '''
+    __slots__ = ('_bits', '_offset', '_count', '_ids')
+
+    def __init__(self, question_ids=()):
+        self._bits = bytearray()
+        self._offset = 0  # the id of the first bit, a multiple of 8
+        self._count = 0
+        self._ids = None  # the ids once too sparse for bits
+        for question_id in question_ids:
+            self.add(question_id)
+
+    def add(self, question_id):
+        question_id = int(question_id)
+        if question_id in self:
+            return
+        if self._ids is not None:
+            self._ids.add(question_id)
+            return
+        first = question_id - question_id % 8
+        start, end = first, first + 8
+        if self._bits:
+            start = min(start, self._offset)
+            end = max(end, self._offset + 8 * len(self._bits))
+        if (end - start) // 8 > max(MIN_BITSET_BYTES,
+                                    BITSET_BYTES_PER_ID * (self._count + 1)):
+            self._ids = set(self)
+            self._ids.add(question_id)
+            self._bits = bytearray()
+            return
+        if not self._bits:
+            self._offset = start
+        elif start < self._offset:
+            self._bits[0:0] = bytes((self._offset - start) // 8)
+            self._offset = start
+        self._bits.extend(bytes((end - start) // 8 - len(self._bits)))
+        byte_index, bit = divmod(question_id - self._offset, 8)
+        self._bits[byte_index] |= 1 << bit
+        self._count += 1
+
+    def __contains__(self, question_id):
+        if self._ids is not None:
+            return question_id in self._ids
+        index = question_id - self._offset
+        if index < 0 or index >= 8 * len(self._bits):
+            return False
+        byte_index, bit = divmod(index, 8)
+        return bool(self._bits[byte_index] & (1 << bit))
+
+    def __iter__(self):
+        if self._ids is not None:
+            return iter(sorted(self._ids))
+        return (self._offset + 8 * byte_index + bit
+                for byte_index, byte in enumerate(self._bits) if byte
+                for bit in range(8) if byte & (1 << bit))
+
+    def __len__(self):
+        return len(self._ids) if self._ids is not None else self._count
+
+    def to_bytes(self):
+        '''
+        Returns the ids as bytes, for session stores shared by processes:
+        the bits after their offset, or the sorted ids once sparse
+        '''
+        if self._ids is not None:
+            return SPARSE + struct.pack(f'>{len(self._ids)}Q', *self)
+        return DENSE + struct.pack('>Q', self._offset) + bytes(self._bits)
+
+    @classmethod
+    def from_bytes(cls, data):
+        bitset = cls()
+        if data[:1] == SPARSE:
+            bitset._ids = set(struct.unpack(f'>{(len(data) - 1) // 8}Q',
+                                            data[1:]))
+        else:
+            bitset._offset, = struct.unpack('>Q', data[1:9])
+            bitset._bits = bytearray(data[9:])
+            bitset._count = sum(bin(byte).count('1') for byte in data[9:])
+        return bitset
+
+
+class QuizSession:
+    '''
+    The state of one quiz game
+        Parameters:
+                 session_id: the key the session is stored under
+                 quiz_category: the quiz category the game is played in,
+                  an id of 0 means all categories
+                 seen: a QuestionBitset of question ids already drawn
+    '''
+
+    def __init__(self, session_id, quiz_category, seen=None):
+        self.session_id = session_id
+        self.quiz_category = quiz_category
+        self.seen = seen if seen is not None else QuestionBitset()
+
+    def format(self):
+        return {
+            'session_id': self.session_id,
+            'quiz_category': self.quiz_category,
+            'questions_played': len(self.seen)
+        }
+
+
+class InProcessSessionStore:
+    '''
+    Keeps quiz sessions in this process's memory and evicts sessions that
+    have not been used for ttl seconds.
+
+    Any object with the same get, save and delete methods can be plugged in
+    through the QUIZ_SESSION_STORE config value, e.g. one backed by a shared
+    key-value store when running several worker processes.
+    '''
+
+    def __init__(self, ttl=DEFAULT_SESSION_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._sessions = OrderedDict()  # session_id -> (expires, session)
+
+    def _evict_expired(self, now):
+        # sessions are kept in last-used order, expired ones are up front
+        while self._sessions:
+            session_id, (expires, _) = next(iter(self._sessions.items()))
+            if expires > now:
+                break
+            del self._sessions[session_id]
+
+    def get(self, session_id):
+        '''
+        Returns the session stored under session_id, or None if there is
+        no such session or it has expired
+        '''
+        now = time.monotonic()
+        with self._lock:
+            self._evict_expired(now)
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return None
+            self._sessions[session_id] = (now + self.ttl, entry[1])
+            self._sessions.move_to_end(session_id)
+            return entry[1]
+
+    def save(self, session):
+        now = time.monotonic()
+        with self._lock:
+            self._evict_expired(now)
+            self._sessions[session.session_id] = (now + self.ttl, session)
+            self._sessions.move_to_end(session.session_id)
+
+    def delete(self, session_id):
+        '''
+        Removes a session, returns the removed session or None
+        '''
+        with self._lock:
+            entry = self._sessions.pop(session_id, None)
+            return entry[1] if entry else None
+
+    def __len__(self):
+        with self._lock:
+            self._evict_expired(time.monotonic())
+            return len(self._sessions)
+
+
+def new_session_id():
+    return secrets.token_urlsafe(16)
@@ -0,0 +1,76 @@
+'''
+Read replica routing
+
+GET requests run their queries on the read replicas, taken in turn, while
+every other request runs on the primary. A client that commits a write is
+given a cookie that keeps its reads on the primary for the next
+REPLICA_STICKY_SECONDS, long enough for the replicas to catch up, so it
+always reads its own writes.
+'''
+
+import itertools
+from datetime import datetime, timedelta
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+READ_METHODS = ('GET', 'HEAD')
+STICKY_COOKIE = 'read_primary'
+DEFAULT_STICKY_SECONDS = 10
+
+
+class ReplicaRouter:
+    '''
+    Chooses the DB each request reads from
+        Parameters:
+                 bind_keys: the bind keys of the read replicas, none to
+                  run every request on the primary
+                 sticky_seconds: how long a client that wrote keeps
+                  reading from the primary, the replicas' worst lag
+    '''
+
+    def __init__(self, bind_keys, sticky_seconds=DEFAULT_STICKY_SECONDS):
+        self.bind_keys = list(bind_keys)
+        self.sticky_seconds = sticky_seconds
+        self._turn = itertools.count()
+
+    def choose(self, request):
+        '''
+        Returns the bind key of the replica a request reads from, None
+        for the primary
+        '''
+        if not self.bind_keys or request.method not in READ_METHODS:
+            return None
+        if STICKY_COOKIE in request.cookies:
+            return None
+        return self.bind_keys[next(self._turn) % len(self.bind_keys)]
+
+    def may_lag(self, replica, modified_at):
+        '''
+        Returns True if a response read from a replica may predate a
+        write made at modified_at, a naive UTC datetime
+        '''
+        return replica is not None and datetime.utcnow() - modified_at < \
+            timedelta(seconds=self.sticky_seconds)
+
+    def stick_to_primary(self, response):
+        '''Keeps the client's reads on the primary for a while'''
+        response.set_cookie(STICKY_COOKIE, '1', max_age=self.sticky_seconds,
+                            httponly=True)
+
+
+def route_reads(session, replica):
+    '''Runs a session's queries on the given replica, None for primary'''
+    session.info['replica'] = replica
+
+
+def has_written(session):
+    '''Returns True if the session committed a transaction'''
+    return session.info.get('committed', False)
+
+
+def _mark_committed(session):
+    session.info['committed'] = True
+
+
+event.listen(Session, 'after_commit', _mark_committed)
@@ -0,0 +1,251 @@
+'''
+Response cache for question listings and searches
+
+Many players browse the same first pages and search for the same popular
+terms, so the JSON bodies of /questions, /categories/<id>/questions and
+searches are kept and served again to identical requests without a DB
+query or JSON serialization.
+
+A cache key holds the route, the page, the category, the fields and the
+search term, lower cased as searches ignore case, along with the ETag of
+the content version (see conditional.py). Every committed Question or
+Category write bumps the version, so an entry is never served after the
+data it was built from changed; the first lookup under a new version also
+empties an in-process store, rather than leave the old entries to age out.
+
+Entries live in this process's memory by default, bounded by count, bytes
+and age. Any object with the same get, set and clear methods can be
+plugged in through the RESPONSE_CACHE_STORE config value, such as a
+SqliteResponseStore shared by the worker processes of one host. A store
+marked shared is never emptied, as other processes may still be on the
+version it holds entries of; their keys age out instead. Entries are only
+shared when the workers share the content version as well, through
+CONTENT_VERSION_PATH: the ETag token of a version kept in one process is
+drawn again in every process forked from it, so the keys of two such
+processes never match.
+'''
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from .conditional import make_etag
+from .metrics import Counter
+
+DEFAULT_RESPONSE_CACHE_TTL = 60  # seconds
+DEFAULT_RESPONSE_CACHE_MAX_ENTRIES = 1000
+DEFAULT_RESPONSE_CACHE_MAX_BYTES = 32 * 1024 * 1024
+SQLITE_TIMEOUT = 0.1  # seconds to wait on a write lock before skipping
+
+
+def normalize_term(term):
+    '''
+    Returns the search term as searches match it, case-insensitively.
+    Whitespace is kept, a substring match on ' cup' differs from one on
+    'cup'
+    '''
+    return term.lower()
+
+
+class InProcessResponseStore:
+    '''
+    A least recently used map of cache key to response body, in this
+    process's memory
+        Parameters:
+                 ttl: seconds an entry is served for
+                 max_entries: the most entries kept
+                 max_bytes: the most bytes of response bodies kept
+    '''
+
+    def __init__(self, ttl=DEFAULT_RESPONSE_CACHE_TTL,
+                 max_entries=DEFAULT_RESPONSE_CACHE_MAX_ENTRIES,
+                 max_bytes=DEFAULT_RESPONSE_CACHE_MAX_BYTES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (expires, body)
+        self._bytes = 0
+
+    def get(self, key):
+        '''
+        Returns the body stored under key, or None if there is no such
+        entry or it has expired
+        '''
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= now:
+                self._pop(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, body):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            self._pop(key)
+            self._entries[key] = (time.monotonic() + self.ttl, body)
+            self._bytes += len(body)
+            # least recently used entries are up front
+            while len(self._entries) > self.max_entries or \
+                    self._bytes > self.max_bytes:
+                self._pop(next(iter(self._entries)))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _pop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= len(entry[1])
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+class SqliteResponseStore:
+    '''
+    A map of cache key to response body in a SQLite file, which every
+    worker process on a host can open, a stand-in for a shared key-value
+    store. Once max_entries are kept the entries closest to expiring are
+    evicted. A lookup or write that finds the file locked is skipped, the
+    cache never holds a request up.
+
+    The store is shared, so it is never emptied when this process's
+    content version changes.
+        Parameters:
+                 path: the SQLite file, created on first use
+                 ttl: seconds an entry is served for
+                 max_entries: the most entries kept
+    '''
+
+    shared = True
+
+    def __init__(self, path, ttl=DEFAULT_RESPONSE_CACHE_TTL,
+                 max_entries=DEFAULT_RESPONSE_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._local = threading.local()
+
+    def _connection(self):
+        # one connection per thread, and none inherited from a parent
+        # process
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(
+                self.path, timeout=SQLITE_TIMEOUT, isolation_level=None)
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS responses ('
+                'key TEXT PRIMARY KEY, expires REAL NOT NULL, '
+                'body BLOB NOT NULL)')
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def get(self, key):
+        try:
+            row = self._connection().execute(
+                'SELECT body FROM responses WHERE key = ? AND expires > ?',
+                (key, time.time())).fetchone()
+        except sqlite3.OperationalError:
+            return None
+        return None if row is None else row[0]
+
+    def set(self, key, body):
+        now = time.time()
+        try:
+            connection = self._connection()
+            connection.execute(
+                'INSERT OR REPLACE INTO responses VALUES (?, ?, ?)',
+                (key, now + self.ttl, body))
+            connection.execute(
+                'DELETE FROM responses WHERE expires <= ?', (now,))
+            connection.execute(
+                'DELETE FROM responses WHERE key IN (SELECT key FROM '
+                'responses ORDER BY expires DESC LIMIT -1 OFFSET ?)',
+                (self.max_entries,))
+        except sqlite3.OperationalError:
+            pass
+
+    def clear(self):
+        try:
+            self._connection().execute('DELETE FROM responses')
+        except sqlite3.OperationalError:
+            pass
+
+    def __len__(self):
+        return self._connection().execute(
+            'SELECT count(*) FROM responses WHERE expires > ?',
+            (time.time(),)).fetchone()[0]
+
+
+class ResponseCache:
+    '''
+    Looks response bodies up in a store under keys that follow the content
+    version, and counts hits and misses by route
+        Parameters:
+                 store: an InProcessResponseStore or any object with the
+                  same get, set and clear methods, and a true shared
+                  attribute if other processes use it as well
+                 content_version: the content version of the question bank
+    '''
+
+    def __init__(self, store, content_version):
+        self.store = store
+        self.content_version = content_version
+        self._lock = threading.Lock()
+        self._etag = None
+        labels = ('route',)
+        self.hits = Counter(
+            'trivia_response_cache_hits_total',
+            'Responses served from the response cache.', labels)
+        self.misses = Counter(
+            'trivia_response_cache_misses_total',
+            'Responses built because the response cache had none.', labels)
+
+    def key(self, route, **params):
+        '''
+        Returns the cache key of a response under the current content
+        version, emptying an unshared store when the version has changed
+            Parameters:
+                 route: the name of the route
+                 params: whatever else selects the response, e.g. the page,
+                  the category and the normalized search term
+        '''
+        version, _ = self.content_version.current()
+        etag = make_etag(self.content_version, version)
+        if etag != self._etag:
+            with self._lock:
+                if etag != self._etag:
+                    if not getattr(self.store, 'shared', False):
+                        self.store.clear()
+                    self._etag = etag
+        return json.dumps([etag, route, params], sort_keys=True,
+                          separators=(',', ':'))
+
+    def get(self, route, key):
+        '''Returns the body cached under key, or None, and counts it'''
+        body = self.store.get(key)
+        if body is None:
+            self.misses.inc((route,))
+        else:
+            self.hits.inc((route,))
+        return body
+
+    def set(self, key, body):
+        self.store.set(key, body)
+
+    def render(self):
+        '''Returns the counters in the Prometheus text format'''
+        return self.hits.render() + self.misses.render()
@@ -0,0 +1,333 @@
+'''
+Quiz results and leaderboards
+
+Finished games aren't written one at a time. A ResultWriter buffers them
+and inserts them in multi-row batches, from a background thread, once
+RESULTS_FLUSH_SIZE results are waiting or RESULTS_FLUSH_INTERVAL seconds
+have passed. A burst of games ending together then costs a few inserts
+and commits rather than one of each per game.
+
+Leaderboards are kept in memory. The best LEADERBOARD_SIZE results of
+every category are loaded from the DB once, and every result submitted
+after that is merged in as it arrives, written yet or not. The results of
+other processes show up when the leaderboards are reloaded, every
+LEADERBOARD_MAX_AGE seconds.
+
+A batch the DB rejects is written again one result at a time, and the
+results the DB rejects on their own are logged and dropped, so one bad
+result can't hold back the others. At most RESULTS_MAX_PENDING results
+wait to be written; past that new results are turned away.
+'''
+
+import atexit
+import os
+import threading
+import time
+import weakref
+from datetime import datetime
+
+from sqlalchemy import exc
+
+from models import db, QuizResult
+from .queries import leaderboard_statement
+
+DEFAULT_FLUSH_SIZE = 100
+DEFAULT_FLUSH_INTERVAL = 1.0  # seconds
+DEFAULT_LEADERBOARD_SIZE = 10
+DEFAULT_LEADERBOARD_MAX_AGE = 30  # seconds
+DEFAULT_MAX_PENDING = 10000
+INSERT_BATCH_SIZE = 100  # rows per insert statement
+MAX_PLAYER_LENGTH = 50
+# far more than any game plays, and within the DB's INTEGER columns
+MAX_TOTAL_QUESTIONS = 1000
+# the key of the leaderboard over every game, games played over all
+# categories have the key None
+ALL_GAMES = 'all'
+RESULT_COLUMNS = ('player', 'category', 'score', 'total_questions',
+                  'created_at')
+
+_live_writers = weakref.WeakSet()
+
+
+def new_result(player, category_id, score, total_questions):
+    '''
+    Returns the row of a game finished now
+        Parameters:
+                 player: the name the player entered
+                 category_id: the category played, 0 for all categories
+                 score: the number of questions answered right
+                 total_questions: the number of questions played
+    '''
+    return {
+        'player': player,
+        'category': category_id or None,
+        'score': score,
+        'total_questions': total_questions,
+        'created_at': datetime.utcnow()
+    }
+
+
+def format_result(row):
+    '''Returns a result row formatted like QuizResult.format'''
+    return {
+        'player': row['player'],
+        'category': row['category'] or 0,
+        'score': row['score'],
+        'total_questions': row['total_questions'],
+        'created_at': row['created_at'].isoformat()
+    }
+
+
+def is_rejected_row_error(error):
+    '''
+    Returns True if error is the DB rejecting the values of a row, which
+    writing the row again can't fix: a number out of range for its column
+    or a broken constraint
+    '''
+    return isinstance(error, (exc.DataError, exc.IntegrityError,
+                              OverflowError))
+
+
+def rank_key(row):
+    '''Orders results best first, the earliest of equal scores first'''
+    return -row['score'], row['created_at']
+
+
+class ResultWriter:
+    '''
+    Write-behind buffer of quiz results
+        Parameters:
+                 app: the app whose DB the results are written to
+                 flush_size: the number of waiting results that triggers
+                  a flush
+                 flush_interval: the most seconds a result waits to be
+                  written, None to have no background thread and flush in
+                  the request that fills a batch instead
+                 max_pending: the most results waiting to be written
+    '''
+
+    def __init__(self, app, flush_size=DEFAULT_FLUSH_SIZE,
+                 flush_interval=DEFAULT_FLUSH_INTERVAL,
+                 max_pending=DEFAULT_MAX_PENDING):
+        self.app = app
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._pending = []
+        self._wake = threading.Event()
+        self._thread = None
+        self._flushes_at_exit = False
+        _live_writers.add(self)
+
+    def add(self, row):
+        '''
+        Queues a result row to be written
+
+            Returns:
+                    queued: False if max_pending results are already
+                     waiting and the row was turned away
+        '''
+        with self._lock:
+            if len(self._pending) >= self.max_pending:
+                return False
+            self._pending.append(row)
+            is_full = len(self._pending) >= self.flush_size
+        if self.flush_interval is None:
+            if is_full:
+                self.flush()
+            return True
+        self._start()
+        if is_full:
+            self._wake.set()
+        return True
+
+    def pending(self):
+        '''Returns the result rows waiting to be written'''
+        with self._lock:
+            return list(self._pending)
+
+    def flush(self):
+        '''
+        Writes every waiting result, in multi-row inserts and one commit.
+        If the DB rejects the batch, the results are written one at a time
+        and those it rejects are dropped. On any other error the results
+        not written are queued again
+
+            Returns:
+                    written: the number of results written
+        '''
+        with self._lock:
+            rows, self._pending = self._pending, []
+        if not rows:
+            return 0
+        try:
+            self._insert(rows)
+            return len(rows)
+        except Exception as e:
+            if not is_rejected_row_error(e):
+                self._requeue(rows)
+                raise
+        written = 0
+        for index, row in enumerate(rows):
+            try:
+                self._insert([row])
+                written += 1
+            except Exception as e:
+                if not is_rejected_row_error(e):
+                    self._requeue(rows[index:])
+                    raise
+                self.app.logger.error(
+                    'dropped a quiz result the DB rejected: %r (%s)', row, e)
+        return written
+
+    def _insert(self, rows):
+        try:
+            for start in range(0, len(rows), INSERT_BATCH_SIZE):
+                db.session.execute(QuizResult.__table__.insert().values(
+                    rows[start:start + INSERT_BATCH_SIZE]))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+    def _requeue(self, rows):
+        with self._lock:
+            # results added since the flush began are newer, they go last
+            room = max(self.max_pending - len(self._pending), 0)
+            self._pending[:0] = rows[:room]
+        if len(rows) > room:
+            self.app.logger.error(
+                'dropped %d quiz results, too many waiting to be written',
+                len(rows) - room)
+
+    def _start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            if not self._flushes_at_exit:
+                atexit.register(self._flush_in_app_context)
+                self._flushes_at_exit = True
+            self._thread = threading.Thread(
+                target=self._run, name='quiz-result-writer', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self._flush_in_app_context()
+            except Exception:
+                self.app.logger.exception(
+                    'could not write quiz results, will retry')
+
+    def _flush_in_app_context(self):
+        with self.app.app_context():
+            self.flush()
+
+    def _forget_parent(self):
+        # a forked worker starts with a copy of the parent's buffer, which
+        # the parent writes, and without its thread, possibly mid-flush
+        # holding the lock
+        self._lock = threading.Lock()
+        self._pending = []
+        self._wake = threading.Event()
+        self._thread = None
+
+
+class Leaderboard:
+    '''
+    The best results of every category, and of every game, in memory
+        Parameters:
+                 writer: the ResultWriter holding results not written yet
+                 size: the number of results on a leaderboard
+                 max_age: seconds before the leaderboards are reloaded
+                  from the DB, None to only load them once
+    '''
+
+    def __init__(self, writer, size=DEFAULT_LEADERBOARD_SIZE,
+                 max_age=DEFAULT_LEADERBOARD_MAX_AGE):
+        self.writer = writer
+        self.size = size
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._boards = None
+        self._loaded_at = None
+
+    def is_stale(self):
+        if self._boards is None:
+            return True
+        if self.max_age is None:
+            return False
+        return time.monotonic() - self._loaded_at > self.max_age
+
+    def load(self):
+        '''
+        Reads the best results of every category from the DB, along with
+        the results waiting to be written
+        '''
+        with self._lock:
+            # taken before the DB is read, so a result written meanwhile
+            # is found in one or the other
+            pending = self.writer.pending()
+            boards = {}
+            for row in db.session.execute(leaderboard_statement(self.size)):
+                self._merge(boards, {column: row[column]
+                                     for column in RESULT_COLUMNS})
+            for row in pending:
+                self._merge(boards, row)
+            self._boards = boards
+            self._loaded_at = time.monotonic()
+
+    def add(self, row):
+        '''
+        Merges a new result into the leaderboards
+
+            Returns:
+                    rank: the rank of the result on the leaderboard of its
+                     category, None if it didn't make it
+        '''
+        if self.is_stale():
+            self.load()
+        with self._lock:
+            return self._merge(self._boards, row)
+
+    def top(self, category_id=ALL_GAMES):
+        '''
+        Returns the formatted leaderboard of a category, 0 for games over
+        all categories, ALL_GAMES for every game
+        '''
+        if self.is_stale():
+            self.load()
+        key = category_id if category_id == ALL_GAMES else category_id or None
+        with self._lock:
+            return [format_result(row) for row in self._boards.get(key, ())]
+
+    def _merge(self, boards, row):
+        rank = None
+        for key in (row['category'], ALL_GAMES):
+            board = boards.setdefault(key, [])
+            if row in board:
+                # read from the DB and still pending, or merged by a load
+                # since it was submitted
+                position = board.index(row)
+            else:
+                position = sum(rank_key(entry) <= rank_key(row)
+                               for entry in board)
+                if position >= self.size:
+                    continue
+                board.insert(position, row)
+                del board[self.size:]
+            if key != ALL_GAMES:
+                rank = position + 1
+        return rank
+
+
+def _forget_parent_results():
+    for writer in list(_live_writers):
+        writer._forget_parent()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_forget_parent_results)
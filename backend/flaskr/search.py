@@ -0,0 +1,313 @@
+'''
+Question search
+
+Searches match the search term as a case-insensitive substring of a
+question's text or answer and rank the matches by relevance.
+
+On Postgres the matching runs on pg_trgm GIN indexes, created with
+`flask create-search-index`, and is ranked by word similarity. Other
+databases (SQLite in development and tests) use an in-process trigram
+index that is built from the DB on first use and kept up to date with
+this process's Question writes. A write is applied to the index once it
+commits, never at flush, so a rolled back write leaves no trace in it.
+Every SEARCH_INDEX_MAX_AGE seconds the index is rebuilt from the DB, to
+pick up the writes of other worker processes.
+'''
+
+import re
+import threading
+import time
+import weakref
+from collections import defaultdict
+
+from sqlalchemy import event
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.orm import Session, object_session
+
+from models import db, Question
+from .pagination import fetch_page, EXACT, NO_COUNT
+from .queries import (
+    questions_statement, search_rank, search_documents_statement,
+    questions_by_ids_statement, QUESTION_COLUMNS)
+
+POSTGRES = 'postgres'
+MEMORY = 'memory'
+DEFAULT_SEARCH_INDEX_MAX_AGE = 60  # seconds
+
+SEARCH_INDEX_DDL = [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    'CREATE INDEX IF NOT EXISTS ix_questions_question_trgm '
+    'ON questions USING gin (question gin_trgm_ops)',
+    'CREATE INDEX IF NOT EXISTS ix_questions_answer_trgm '
+    'ON questions USING gin (answer gin_trgm_ops)',
+]
+
+_live_indexes = weakref.WeakSet()
+
+
+class PostgresTrigramSearch:
+    '''
+    Searches with ILIKE on pg_trgm indexed question and answer columns
+    '''
+
+    def invalidate(self):
+        '''Nothing is cached, the DB indexes are always current'''
+
+    def warm_up(self):
+        '''Nothing to load, the DB indexes are always current'''
+
+    def create_index(self):
+        for statement in SEARCH_INDEX_DDL:
+            db.session.execute(statement)
+        db.session.commit()
+
+    def search(self, term, category_id=None, after=None, offset=0,
+               page_size=10, count_mode=EXACT, columns=QUESTION_COLUMNS):
+        '''
+        Returns a page of questions matching the search term
+            Parameters:
+                     term: the text to search for
+                     category_id: only search this category if given
+                     after: the cursor of the page, None for a ranked page
+                     offset: the number of ranked matches to skip
+                     page_size: the number of questions on the page
+                     count_mode: 'exact', 'estimate' or 'none'
+                     columns: the question columns to select, the id
+                      first
+
+            Returns:
+                    question_selection: a list of matching question rows,
+                     by relevance, or in id order when after is given
+                    total_questions: the number of matching questions,
+                     None when count_mode is 'none'
+                    next_cursor: the 'after' cursor of the next page
+        '''
+        statement = questions_statement(category_id, term, columns)
+        rank = search_rank(term)
+        return fetch_page(statement, after, offset, page_size,
+                          count_mode, order_by=(rank.desc(), Question.id))
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class InMemorySearchIndex:
+    '''
+    An in-process trigram inverted index over question and answer text
+        Parameters:
+                 max_age: seconds before the index is rebuilt from the DB so
+                  writes made by other worker processes are picked up,
+                  None to rely on this process's writes only
+    '''
+
+    def __init__(self, max_age=DEFAULT_SEARCH_INDEX_MAX_AGE):
+        self.max_age = max_age
+        self._lock = threading.RLock()
+        self._documents = {}  # id -> (question, answer, category)
+        self._postings = defaultdict(set)  # trigram -> ids
+        self._built_at = None
+        _live_indexes.add(self)
+
+    def create_index(self):
+        with self._lock:
+            self._rebuild()
+
+    def invalidate(self):
+        self._built_at = None
+
+    def warm_up(self):
+        '''Builds the index, unless it is current, before a search needs it'''
+        with self._lock:
+            if self.is_stale():
+                self._rebuild()
+
+    def is_stale(self):
+        if self._built_at is None:
+            return True
+        if self.max_age is None:
+            return False
+        return time.monotonic() - self._built_at > self.max_age
+
+    def _rebuild(self):
+        self.load(db.session.execute(search_documents_statement()))
+
+    def load(self, rows):
+        '''
+        Builds the index from the rows of search_documents_statement, for
+        callers that query the DB themselves
+        '''
+        with self._lock:
+            self._documents = {}
+            self._postings = defaultdict(set)
+            for question_id, question, answer, category in rows:
+                self._add(question_id, question, answer, category)
+            self._built_at = time.monotonic()
+
+    def _add(self, question_id, question, answer, category):
+        question = (question or '').lower()
+        answer = (answer or '').lower()
+        self._documents[question_id] = (question, answer, f'{category}')
+        for trigram in trigrams(question) | trigrams(answer):
+            self._postings[trigram].add(question_id)
+
+    def _remove(self, question_id):
+        document = self._documents.pop(question_id, None)
+        if document is None:
+            return
+        for trigram in trigrams(document[0]) | trigrams(document[1]):
+            posting = self._postings.get(trigram)
+            if posting is not None:
+                posting.discard(question_id)
+                if not posting:
+                    del self._postings[trigram]
+
+    def update(self, question_id, question, answer, category):
+        '''Adds or replaces a question in a built index'''
+        with self._lock:
+            if self._built_at is None:
+                return
+            self._remove(question_id)
+            self._add(question_id, question, answer, category)
+
+    def remove(self, question_id):
+        '''Drops a question from a built index'''
+        with self._lock:
+            if self._built_at is not None:
+                self._remove(question_id)
+
+    def _candidates(self, term):
+        term_trigrams = trigrams(term)
+        if not term_trigrams:
+            # too short to use the index
+            return self._documents.keys()
+        postings = sorted(
+            (self._postings.get(trigram, ()) for trigram in term_trigrams),
+            key=len)
+        candidates = set(postings[0])
+        for posting in postings[1:]:
+            if not candidates:
+                break
+            candidates &= posting
+        return candidates
+
+    def match(self, term, category_id=None):
+        '''
+        Returns the ids of questions matching the term, by relevance
+        '''
+        term = term.lower()
+        whole_word = re.compile(r'\b' + re.escape(term) + r'\b')
+        category = f'{category_id}' if category_id else None
+        with self._lock:
+            if self.is_stale():
+                self._rebuild()
+            ranked = []
+            for question_id in self._candidates(term):
+                question, answer, question_category = \
+                    self._documents[question_id]
+                if category and question_category != category:
+                    continue
+                score = 0
+                if term in question:
+                    score += 2 + bool(whole_word.search(question))
+                if term in answer:
+                    score += 1 + bool(whole_word.search(answer))
+                if score:
+                    ranked.append((-score, question_id))
+        ranked.sort()
+        return [question_id for _, question_id in ranked]
+
+    def search(self, term, category_id=None, after=None, offset=0,
+               page_size=10, count_mode=EXACT, columns=QUESTION_COLUMNS):
+        '''
+        Returns a page of questions matching the search term, see
+        PostgresTrigramSearch.search. Counting is free here, every mode
+        but 'none' returns the exact count.
+        '''
+        matched_ids = self.match(term, category_id)
+        next_cursor = None
+        if after is not None:
+            matched_ids.sort()
+            following_ids = [question_id for question_id in matched_ids
+                             if question_id > after]
+            page_ids = following_ids[:page_size]
+            if len(following_ids) > page_size:
+                next_cursor = page_ids[-1]
+        else:
+            page_ids = matched_ids[offset:offset + page_size]
+        questions_by_id = {}
+        if page_ids:
+            questions_by_id = {
+                row['id']: row for row in db.session.execute(
+                    questions_by_ids_statement(page_ids, columns))}
+        question_selection = [questions_by_id[question_id]
+                              for question_id in page_ids
+                              if question_id in questions_by_id]
+        total_questions = None
+        if count_mode != NO_COUNT:
+            total_questions = len(matched_ids)
+        return question_selection, total_questions, next_cursor
+
+
+def search_backend_name(config):
+    '''
+    Returns 'postgres' or 'memory', the search backend for the database
+    of an app config, the SEARCH_BACKEND config value overrides the choice
+    '''
+    backend = config.get('SEARCH_BACKEND')
+    if backend is None:
+        database_uri = make_url(config['SQLALCHEMY_DATABASE_URI'])
+        backend = POSTGRES if database_uri.get_backend_name() == \
+            'postgresql' else MEMORY
+    return backend
+
+
+def create_search_backend(app):
+    '''
+    Returns the search backend for the app's database, see
+    search_backend_name
+    '''
+    if search_backend_name(app.config) == POSTGRES:
+        return PostgresTrigramSearch()
+    return InMemorySearchIndex(max_age=app.config.get(
+        'SEARCH_INDEX_MAX_AGE', DEFAULT_SEARCH_INDEX_MAX_AGE))
+
+
+def _note_written_question(mapper, connection, target):
+    # the text as flushed, applied to the indexes once the write commits
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault('search_index_writes', []).append(
+            (target.id, (target.question, target.answer, target.category)))
+
+
+def _note_deleted_question(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault('search_index_writes', []).append(
+            (target.id, None))
+
+
+def _apply_committed_writes(session):
+    writes = session.info.pop('search_index_writes', ())
+    for index in list(_live_indexes):
+        for question_id, document in writes:
+            if document is None:
+                index.remove(question_id)
+            else:
+                index.update(question_id, *document)
+
+
+def _forget_rolled_back_writes(session, previous_transaction):
+    # a savepoint rolled back may drop only some of the writes noted, so
+    # rebuild rather than guess which of them still stand
+    if session.info.pop('search_index_writes', None):
+        for index in list(_live_indexes):
+            index.invalidate()
+
+
+event.listen(Question, 'after_insert', _note_written_question)
+event.listen(Question, 'after_update', _note_written_question)
+event.listen(Question, 'after_delete', _note_deleted_question)
+event.listen(Session, 'after_commit', _apply_committed_writes)
+event.listen(Session, 'after_soft_rollback', _forget_rolled_back_writes)
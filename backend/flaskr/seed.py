@@ -0,0 +1,288 @@
+'''
+Synthetic question bank seeding
+
+Generates trivia questions for the six game categories from question
+templates and loads them in batches: with COPY on Postgres and multi-row
+inserts elsewhere, so a million questions load in seconds. The same seed
+always generates the same questions.
+
+Every question is a distinct combination of a template and its slot
+values, picked through a seeded permutation of all the combinations, so
+no two generated questions are duplicates and nothing has to be
+remembered to avoid them.
+
+run from the backend folder:
+flask seed --questions 1000000 --seed 42
+'''
+
+import io
+import math
+import random
+
+from sqlalchemy import select
+
+from models import db, hash_question, Question, Category
+
+SEED_BATCH_SIZE = 50000
+DEFAULT_SEED = 42
+# difficulties 1 to 5 weighted towards the middle
+DIFFICULTIES = [1] * 3 + [2] * 5 + [3] * 6 + [4] * 4 + [5] * 2
+YEARS = range(1000, 2025)
+
+ELEMENTS = ['hydrogen', 'helium', 'lithium', 'carbon', 'nitrogen', 'oxygen',
+            'sodium', 'magnesium', 'aluminium', 'silicon', 'sulfur',
+            'chlorine', 'potassium', 'calcium', 'iron', 'copper', 'zinc',
+            'silver', 'tin', 'iodine', 'tungsten', 'platinum', 'gold',
+            'mercury', 'lead', 'uranium', 'neon', 'argon', 'cobalt',
+            'nickel']
+SCIENTISTS = ['Curie', 'Newton', 'Darwin', 'Faraday', 'Mendel', 'Pasteur',
+              'Bohr', 'Planck', 'Franklin', 'Hubble', 'Kepler', 'Galileo',
+              'Lavoisier', 'Maxwell', 'Rutherford', 'Tesla', 'Volta',
+              'Hooke', 'Fleming', 'Mendeleev']
+PAINTERS = ['Monet', 'Picasso', 'Rembrandt', 'Vermeer', 'Turner',
+            'Kahlo', 'Klimt', 'Cezanne', 'Goya', 'Caravaggio', 'Titian',
+            'Matisse', 'Dali', 'Hokusai', 'Munch', 'Renoir', 'Degas',
+            'Constable', 'Botticelli', 'Raphael']
+COLOURS = ['red', 'blue', 'yellow', 'green', 'violet', 'orange', 'white',
+           'black', 'golden', 'silver', 'crimson', 'azure']
+SUBJECTS = ['lady', 'garden', 'harbour', 'bridge', 'horse', 'cathedral',
+            'dancer', 'bowl of fruit', 'haystack', 'lighthouse', 'river',
+            'mountain', 'self-portrait', 'storm', 'window', 'sunflower']
+COUNTRIES = ['Peru', 'Kenya', 'Norway', 'Japan', 'Chile', 'Egypt',
+             'Canada', 'India', 'Brazil', 'Spain', 'Vietnam', 'Ghana',
+             'Iceland', 'Mexico', 'Nepal', 'Poland', 'Morocco', 'Finland',
+             'Argentina', 'Australia', 'Turkey', 'Greece', 'Portugal',
+             'Mongolia', 'Ireland']
+FEATURES = ['river', 'mountain', 'lake', 'desert', 'island', 'volcano',
+            'waterfall', 'glacier', 'canyon', 'city']
+RULERS = ['king', 'queen', 'emperor', 'empress', 'pharaoh', 'sultan',
+          'tsar', 'shogun', 'chancellor', 'president']
+EVENTS = ['treaty', 'revolution', 'siege', 'expedition', 'coronation',
+          'plague', 'uprising', 'armistice', 'council', 'voyage']
+GENRES = ['comedy', 'western', 'musical', 'thriller', 'horror film',
+          'romance', 'space opera', 'cartoon', 'documentary',
+          'detective story', 'war film', 'fantasy epic']
+AWARDS = ['Oscar', 'Golden Globe', 'Grammy', 'Emmy', 'BAFTA', 'Tony',
+          'Palme d\'Or']
+ROLES = ['actor', 'actress', 'director', 'composer', 'screenwriter',
+         'producer', 'singer', 'band']
+SPORTS = ['football', 'tennis', 'cricket', 'rugby', 'basketball',
+          'baseball', 'golf', 'cycling', 'rowing', 'fencing', 'hockey',
+          'volleyball', 'handball', 'skiing', 'boxing']
+TOURNAMENTS = ['world cup', 'championship', 'grand slam', 'league title',
+               'olympic final', 'cup final', 'open', 'derby']
+
+# template, its slots and an answer pool per category type, answers are
+# plausible rather than correct
+TEMPLATES = {
+    'Science': [
+        ('Which element did {scientist} study on a visit to {country} in '
+         '{year}?', {'scientist': SCIENTISTS, 'country': COUNTRIES,
+                     'year': YEARS}, ELEMENTS),
+        ('What colour does {element} burn with in the {year} experiments '
+         'of {scientist}?', {'element': ELEMENTS, 'year': YEARS,
+                             'scientist': SCIENTISTS}, COLOURS),
+    ],
+    'Art': [
+        ('Which painter finished a {colour} {subject} in {year}?',
+         {'colour': COLOURS, 'subject': SUBJECTS, 'year': YEARS}, PAINTERS),
+        ('In which city did {painter} exhibit works on a tour of '
+         '{country} in {year}?',
+         {'painter': PAINTERS, 'country': COUNTRIES, 'year': YEARS},
+         ['Paris', 'Florence', 'Madrid', 'Amsterdam', 'London', 'Vienna',
+          'Venice', 'New York', 'Rome', 'Barcelona']),
+    ],
+    'Geography': [
+        ('What is the longest {feature} of {country} as measured in '
+         '{year}?', {'feature': FEATURES, 'country': COUNTRIES,
+                     'year': YEARS},
+         ['The Amazon', 'Mount Kenya', 'Lake Titicaca', 'The Sahara',
+          'Hokkaido', 'Etna', 'Victoria Falls', 'The Andes']),
+        ('How many {feature} names did {country} record in its census '
+         'of {year}?', {'feature': FEATURES, 'country': COUNTRIES,
+                        'year': YEARS},
+         [f'{number}' for number in range(2, 500)]),
+    ],
+    'History': [
+        ('Which {ruler} signed the {event} of {year}?',
+         {'ruler': RULERS, 'event': EVENTS, 'year': YEARS},
+         ['Charlemagne', 'Elizabeth', 'Napoleon', 'Cleopatra', 'Suleiman',
+          'Catherine', 'Tokugawa', 'Victoria', 'Peter', 'Ramesses']),
+        ('Where did the {event} led by a {ruler} of {country} take place '
+         'in {year}?', {'event': EVENTS, 'ruler': RULERS,
+                        'country': COUNTRIES, 'year': YEARS}, COUNTRIES),
+    ],
+    'Entertainment': [
+        ('Which {role} won a {award} for a {genre} in {year}?',
+         {'role': ROLES, 'award': AWARDS, 'genre': GENRES, 'year': YEARS},
+         ['Meryl Streep', 'Tom Hanks', 'Hans Zimmer', 'Greta Gerwig',
+          'Bong Joon-ho', 'The Beatles', 'Denzel Washington',
+          'Cate Blanchett', 'John Williams', 'Akira Kurosawa']),
+    ],
+    'Sports': [
+        ('Which country won the {sport} {tournament} of {year}?',
+         {'sport': SPORTS, 'tournament': TOURNAMENTS, 'year': YEARS},
+         COUNTRIES),
+        ('How many points decided the {sport} {tournament} held in '
+         '{country} in {year}?', {'sport': SPORTS, 'tournament': TOURNAMENTS,
+                                  'country': COUNTRIES, 'year': YEARS},
+         [f'{number}' for number in range(1, 120)]),
+    ],
+}
+
+
+class CategoryQuestions:
+    '''
+    Generates the distinct questions of one category in a seeded order
+        Parameters:
+                 category_id: the id of the category in the DB
+                 templates: the (template, slots, answers) of the category
+                 rng: the random.Random generating the order
+    '''
+
+    def __init__(self, category_id, templates, rng):
+        self.category_id = category_id
+        self.templates = []
+        for template, slots, answers in templates:
+            size = 1
+            for values in slots.values():
+                size *= len(values)
+            self.templates.append(
+                (template, list(slots.items()), answers, size))
+        self.size = sum(size for *_, size in self.templates)
+        # a step coprime with the size visits every combination once
+        self.step = rng.randrange(1, self.size)
+        while math.gcd(self.step, self.size) != 1:
+            self.step += 1
+        self.offset = rng.randrange(self.size)
+        self.generated = 0
+
+    def is_exhausted(self):
+        '''Returns whether every question of the category was generated'''
+        return self.generated == self.size
+
+    def next(self, rng):
+        '''Returns the row of the next question of the category'''
+        combination = (self.offset + self.generated * self.step) % self.size
+        self.generated += 1
+        for template, slots, answers, size in self.templates:
+            if combination < size:
+                break
+            combination -= size
+        values = {}
+        for name, slot_values in reversed(slots):
+            combination, position = divmod(combination, len(slot_values))
+            values[name] = slot_values[position]
+        question = template.format(**values)
+        return {
+            'question': question,
+            'answer': rng.choice(answers),
+            'difficulty': rng.choice(DIFFICULTIES),
+            'category': self.category_id,
+            'question_hash': hash_question(question)
+        }
+
+
+def ensure_categories():
+    '''
+    Adds the seeded category types missing from the DB
+
+        Returns:
+                category_ids: a dict of category id keyed by type
+    '''
+    category_ids = {category_type: category_id for category_id, category_type
+                    in db.session.execute(select([Category.id,
+                                                  Category.type]))}
+    missing = [{'type': category_type} for category_type in TEMPLATES
+               if category_type not in category_ids]
+    if missing:
+        db.session.execute(Category.__table__.insert(), missing)
+        db.session.commit()
+        return ensure_categories()
+    return category_ids
+
+
+def generate_questions(num_questions, seed=DEFAULT_SEED):
+    '''
+    Yields num_questions distinct question rows spread evenly over the
+    categories, the same rows for the same seed
+    '''
+    rng = random.Random(seed)
+    category_ids = ensure_categories()
+    categories = [CategoryQuestions(category_ids[category_type], templates,
+                                    rng)
+                  for category_type, templates in TEMPLATES.items()]
+    for _ in range(num_questions):
+        category = rng.choice(categories)
+        while category.is_exhausted():
+            categories.remove(category)
+            if not categories:
+                raise ValueError('every distinct question was generated')
+            category = rng.choice(categories)
+        yield category.next(rng)
+
+
+def copy_value(value):
+    '''Returns a value in the text format of COPY'''
+    if value is None:
+        return '\\N'
+    return f'{value}'.replace('\\', '\\\\').replace('\t', '\\t').replace(
+        '\n', '\\n')
+
+
+def copy_rows(rows):
+    '''
+    Loads rows with Postgres COPY into a staging table, then moves the
+    ones whose question_hash is new into questions
+
+        Returns:
+                inserted: the number of rows inserted
+    '''
+    columns = 'question, answer, difficulty, category, question_hash'
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write('\t'.join(
+            copy_value(row[column]) for column in columns.split(', ')))
+        buffer.write('\n')
+    buffer.seek(0)
+    db.session.execute(
+        'CREATE TEMPORARY TABLE seed_questions (question TEXT, answer TEXT, '
+        'difficulty INTEGER, category INTEGER, question_hash VARCHAR(64)) '
+        'ON COMMIT DROP')
+    cursor = db.session.connection().connection.cursor()
+    cursor.copy_expert(f'COPY seed_questions ({columns}) FROM STDIN', buffer)
+    return db.session.execute(
+        f'INSERT INTO questions ({columns}) SELECT {columns} '
+        f'FROM seed_questions ON CONFLICT (question_hash) DO NOTHING'
+    ).rowcount
+
+
+def seed_questions(num_questions, seed=DEFAULT_SEED,
+                   batch_size=SEED_BATCH_SIZE):
+    '''
+    Loads num_questions generated questions into the DB
+        Parameters:
+                 num_questions: the number of questions to generate
+                 seed: the random seed, the same seed loads the same
+                  questions
+                 batch_size: the number of questions loaded and committed
+                  at a time
+
+        Yields:
+                inserted: the number of questions inserted by each batch,
+                 questions already in the DB are skipped
+    '''
+    use_copy = db.session.get_bind().dialect.name == 'postgresql'
+    rows = generate_questions(num_questions, seed)
+    while True:
+        batch = [row for _, row in zip(range(batch_size), rows)]
+        if not batch:
+            break
+        if use_copy:
+            inserted = copy_rows(batch)
+        else:
+            inserted = db.session.execute(
+                Question.__table__.insert().prefix_with('OR IGNORE'),
+                batch).rowcount
+        db.session.commit()
+        yield inserted
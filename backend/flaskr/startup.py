@@ -0,0 +1,92 @@
+'''
+App startup and worker processes
+
+create_app does no I/O: the DB engine connects on the first query, the
+tables are created by `flask migrate` rather than on every start, and the
+caches fill on the first request that needs them. Importing and creating
+the app is then safe in any process, e.g. in the master of a preloading
+server, which forks its workers from it.
+
+Warming the caches is opt-in. warm_up runs the hooks create_app
+registered, loading the categories, the quiz and search indexes and the
+leaderboards before the first request, and closes the connections it made
+so forked workers start without any. A preloading server calls it in its
+master (see gunicorn.conf.py), so the workers share the caches
+copy-on-write instead of each filling its own.
+
+A pooled connection must never be used by two processes. Every
+connection remembers the process that opened it, and one checked out in
+a forked child is dropped from the pool, without closing the parent's
+socket, and replaced with a new one.
+'''
+
+import os
+import time
+
+from sqlalchemy import event, exc
+from sqlalchemy.pool import Pool
+
+from models import db
+
+WARM_UP_HOOKS = 'trivia_warm_up_hooks'  # the app.extensions key
+
+
+def add_warm_up_hook(app, name, hook):
+    '''
+    Registers a function that fills a cache of the app, run by warm_up in
+    an app context
+        Parameters:
+                 app: the app the cache belongs to
+                 name: the name warm_up selects the cache by
+                 hook: the function filling the cache
+    '''
+    app.extensions.setdefault(WARM_UP_HOOKS, {})[name] = hook
+
+
+def warm_up(app, caches=None):
+    '''
+    Fills the app's caches before its first request, then closes the DB
+    connections made to fill them
+        Parameters:
+                 app: the app to warm up
+                 caches: the names of the caches to fill, None for the
+                  WARM_UP_CACHES config value, or else every cache
+    '''
+    if caches is None:
+        caches = app.config.get('WARM_UP_CACHES')
+    hooks = app.extensions.get(WARM_UP_HOOKS, {})
+    with app.app_context():
+        for name, hook in hooks.items():
+            if caches is not None and name not in caches:
+                continue
+            start = time.perf_counter()
+            hook()
+            app.logger.info(f'warmed up {name} in '
+                            f'{(time.perf_counter() - start) * 1000:.0f}ms')
+        db.session.remove()
+    dispose_engines(app)
+
+
+def dispose_engines(app):
+    '''Closes the pooled connections of the app's DB and its binds'''
+    with app.app_context():
+        for bind in [None, *(app.config.get('SQLALCHEMY_BINDS') or ())]:
+            db.get_engine(app, bind=bind).dispose()
+
+
+def _remember_process(dbapi_connection, connection_record):
+    connection_record.info['pid'] = os.getpid()
+
+
+def _check_process(dbapi_connection, connection_record, connection_proxy):
+    pid = os.getpid()
+    if connection_record.info['pid'] != pid:
+        # forget rather than close the connection, it is the parent's
+        connection_record.connection = connection_proxy.connection = None
+        raise exc.DisconnectionError(
+            f'connection opened by process {connection_record.info["pid"]} '
+            f'checked out in process {pid}')
+
+
+event.listen(Pool, 'connect', _remember_process)
+event.listen(Pool, 'checkout', _check_process)
@@ -0,0 +1,25 @@
+'''
+gunicorn settings for serving the API from several worker processes
+
+run from the backend folder, gunicorn reads this file from there:
+gunicorn -w 4 --threads 8 \
+    "flaskr:create_app({'CONTENT_VERSION_PATH': '/tmp/trivia-version.db'})"
+
+The app is created once, in the master, and its caches are filled there
+before the workers are forked, so every worker starts with them, shared
+copy-on-write, instead of filling its own on its first requests. Set
+WARM_UP_CACHES in the app config to fill only some of them.
+
+CONTENT_VERSION_PATH has the workers share one content version, so a
+write through any worker changes the ETags all of them serve. Without it
+every worker keeps its own, and answers 304s for data another worker has
+changed since.
+'''
+
+from flaskr.startup import warm_up
+
+preload_app = True
+
+
+def when_ready(server):
+    warm_up(server.app.wsgi())
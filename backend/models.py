@@ -1,54 +1,163 @@
 import os
-from sqlalchemy import Column, String, Integer, create_engine
-from flask_sqlalchemy import SQLAlchemy
+import re
+import hashlib
+from sqlalchemy import (
+  Column, String, Integer, DateTime, ForeignKey, Index, create_engine, orm)
+from sqlalchemy.engine.url import make_url
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
 import json
 
 database_port = "localhost:5432"
 database_name = "trivia"
-# https://www.doppler.com/blog/environment-variables-in-python reference
-database_path = "postgresql://{}:{}@{}/{}".format(
-  os.environ['DB_USER'],
-  os.environ['DB_PASSWORD'],
-  database_port,
-  database_name)
+REPLICA_BIND_PREFIX = 'replica_'
 
-db = SQLAlchemy()
+'''
+database_uri()
+    returns the URI of the trivia DB, with the credentials in the DB_USER
+    and DB_PASSWORD environment variables. Read when an app is created
+    rather than when models is imported, so importing needs neither
+'''
+def database_uri():
+  # https://www.doppler.com/blog/environment-variables-in-python reference
+  return "postgresql://{}:{}@{}/{}".format(
+    os.environ['DB_USER'],
+    os.environ['DB_PASSWORD'],
+    database_port,
+    database_name)
+
+'''
+RoutingSession
+    a session that runs its queries on the read replica named by
+    info['replica'] when one is set, flushes always go to the primary
+'''
+class RoutingSession(SignallingSession):
+
+  def get_bind(self, mapper=None, clause=None):
+    replica = self.info.get('replica')
+    if replica is not None and not self._flushing:
+      return db.get_engine(self.app, bind=replica)
+    return super().get_bind(mapper, clause)
+
+class RoutingSQLAlchemy(SQLAlchemy):
+
+  def create_session(self, options):
+    return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+db = RoutingSQLAlchemy()
+
+'''
+engine_options(database_path, config)
+    returns the SQLAlchemy engine options for the DB_POOL_SIZE,
+    DB_MAX_OVERFLOW, DB_POOL_TIMEOUT (seconds to wait for a free
+    connection), DB_POOL_PRE_PING, DB_POOL_RECYCLE (seconds) and
+    DB_STATEMENT_TIMEOUT (milliseconds, Postgres only) config values
+'''
+def engine_options(database_path, config):
+  backend = make_url(database_path).get_backend_name()
+  options = {}
+  # SQLite file DBs don't pool connections, so have no pool to size
+  if backend != 'sqlite':
+    if config.get('DB_POOL_SIZE') is not None:
+      options['pool_size'] = config['DB_POOL_SIZE']
+    if config.get('DB_MAX_OVERFLOW') is not None:
+      options['max_overflow'] = config['DB_MAX_OVERFLOW']
+    if config.get('DB_POOL_TIMEOUT') is not None:
+      options['pool_timeout'] = config['DB_POOL_TIMEOUT']
+  if config.get('DB_POOL_PRE_PING'):
+    options['pool_pre_ping'] = True
+  if config.get('DB_POOL_RECYCLE') is not None:
+    options['pool_recycle'] = config['DB_POOL_RECYCLE']
+  if config.get('DB_STATEMENT_TIMEOUT') is not None and \
+      backend == 'postgresql':
+    options['connect_args'] = {
+      'options': '-c statement_timeout={}'.format(
+        int(config['DB_STATEMENT_TIMEOUT']))}
+  return options
+
+'''
+replica_bind_keys(app)
+    returns the bind keys of the app's read replicas, in the order of
+    its DATABASE_REPLICA_URIS config value
+'''
+def replica_bind_keys(app):
+  return sorted(
+    (key for key in app.config.get('SQLALCHEMY_BINDS') or {}
+     if key.startswith(REPLICA_BIND_PREFIX)),
+    key=lambda key: int(key[len(REPLICA_BIND_PREFIX):]))
 
 '''
 setup_db(app)
-    binds a flask application and a SQLAlchemy service
+    binds a flask application and a SQLAlchemy service, with the pool
+    settings in the app's config and a bind for each read replica URI
+    in its DATABASE_REPLICA_URIS config value. Nothing connects to the DB
+    until the first query; `flask migrate` creates the tables
 '''
-def setup_db(app, database_path=database_path):
+def setup_db(app, database_path=None):
+    if database_path is None:
+        database_path = database_uri()
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+        **engine_options(database_path, app.config),
+        **app.config.get("SQLALCHEMY_ENGINE_OPTIONS", {})}
+    binds = {key: uri
+             for key, uri in (app.config.get("SQLALCHEMY_BINDS") or {}).items()
+             if not key.startswith(REPLICA_BIND_PREFIX)}
+    for number, replica_path in enumerate(
+            app.config.get("DATABASE_REPLICA_URIS") or ()):
+        binds[REPLICA_BIND_PREFIX + str(number)] = replica_path
+    app.config["SQLALCHEMY_BINDS"] = binds or None
     db.app = app
     db.init_app(app)
-    db.create_all()
 
 '''
-Question
+hash_question(question)
+    returns the hex digest of a question's text with case, punctuation
+    and extra whitespace removed, so copies that only differ in those
+    hash the same
+'''
+def hash_question(question):
+  if question is None:
+    return None
+  normalized = ' '.join(re.sub(r'[^\w\s]', '', question).casefold().split())
+  return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
 
 '''
+Question
+    category is the id of the question's Category, the composite indexes
+    serve the category listings and quiz draws
+'''
 class Question(db.Model):  
   __tablename__ = 'questions'
+  __table_args__ = (
+    Index('ix_questions_category_id', 'category', 'id'),
+    Index('ix_questions_category_difficulty', 'category', 'difficulty'),
+  )
 
   id = Column(Integer, primary_key=True)
   question = Column(String)
   answer = Column(String)
-  category = Column(String)
+  category = Column(Integer, ForeignKey('categories.id'))
   difficulty = Column(Integer)
+  question_hash = Column(String(64), unique=True, index=True)
 
   def __init__(self, question, answer, category, difficulty):
     self.question = question
     self.answer = answer
-    self.category = category
+    # clients send category ids as strings, e.g. "5"
+    self.category = None if category is None else int(category)
     self.difficulty = difficulty
+    self.question_hash = hash_question(question)
 
   def insert(self):
     db.session.add(self)
+    db.session.flush()
+    question_id = self.id
     db.session.commit()
+    return question_id
   
   def update(self):
+    self.question_hash = hash_question(self.question)
     db.session.commit()
 
   def delete(self):
@@ -81,4 +190,32 @@ class Category(db.Model):
     return {
       'id': self.id,
       'type': self.type
-    }
\ No newline at end of file
+    }
+
+'''
+QuizResult
+    the score of a finished quiz game, category is None for a game played
+    over all categories. Results are written in batches by
+    flaskr.results.ResultWriter rather than one at a time
+'''
+class QuizResult(db.Model):
+  __tablename__ = 'quiz_results'
+  __table_args__ = (
+    Index('ix_quiz_results_category_score', 'category', 'score'),
+  )
+
+  id = Column(Integer, primary_key=True)
+  player = Column(String(50), nullable=False)
+  category = Column(Integer, ForeignKey('categories.id'))
+  score = Column(Integer, nullable=False)
+  total_questions = Column(Integer, nullable=False)
+  created_at = Column(DateTime, nullable=False)
+
+  def format(self):
+    return {
+      'player': self.player,
+      'category': self.category or 0,
+      'score': self.score,
+      'total_questions': self.total_questions,
+      'created_at': self.created_at.isoformat()
+    }
@@ -1,13 +1,44 @@
 import os
+import gzip
+import re
+import sqlite3
+import tempfile
+import threading
+import time
 import unittest
 import json
-from flask_sqlalchemy import SQLAlchemy
+from collections import Counter, namedtuple
+from flask import _app_ctx_stack
+from flask.testing import FlaskClient, make_test_environ_builder
+from werkzeug.exceptions import HTTPException
 
 from flaskr import create_app
-from models import setup_db, Question, Category
-from sqlalchemy.orm.session import make_transient
+from flaskr.admission import ConcurrencyLimiter
+from flaskr.categories import CategoryCache
+from flaskr.conditional import InProcessContentVersion, SqliteContentVersion
+from flaskr.json_provider import StdlibJSONProvider
+from flaskr.migrations import create_schema
+from flaskr.queries import categories_statement
+from flaskr.quiz import QuizDrawEngine
+from flaskr.quiz_sessions import QuestionBitset
+from flaskr.response_cache import (
+    ResponseCache, InProcessResponseStore, SqliteResponseStore)
+from flaskr.results import ResultWriter, new_result
+from flaskr.startup import warm_up
+from models import db, hash_question, Question, Category, QuizResult
+from sqlalchemy import Integer, create_engine, event, func, inspect, orm
+from sqlalchemy.engine import Engine
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import QueuePool, StaticPool
+try:
+    from starlette.testclient import TestClient
+    from flaskr.asgi import create_asgi_app, is_unique_violation
+except ImportError:  # the async serving mode's packages are optional
+    create_asgi_app = None
 
 OK = 200
+ACCEPTED = 202
+NOT_MODIFIED = 304
 BAD_REQUEST = 400
 BAD_REQUEST_MSG = "Bad Request"
 RESOURCE_NOT_FOUND = 404
@@ -16,29 +47,349 @@ METHOD_NOT_ALLOWED = 405
 METHOD_NOT_ALLOWED_MSG = "Method Not Allowed"
 UNPROCESSABLE_ENTITY = 422
 UNPROCESSABLE_ENTITY_MSG = "Unprocessable Entity"
+TOO_MANY_REQUESTS = 429
+SERVICE_UNAVAILABLE = 503
+SERVICE_UNAVAILABLE_MSG = "Service Unavailable"
 TEST_QUESTION_TEXT = "How many different actors have portrayed the character" \
                      " James Bond in the 26 films released between 1962-2015"
 DUPLICATE_TEXT = "What is the largest lake in Africa?"
 DELETE_QUESTION_TEST = "What movie earned Tom Hanks his third straight Oscar" \
                        " nomination, in 1996?"
+# e.g. sqlite:// for an in-memory DB per test process
+TEST_DATABASE_URI = os.environ.get('TEST_DATABASE_URI') or \
+    "postgresql://{}:{}@localhost:5432/trivia_test".format(
+        os.environ.get('DB_USER'), os.environ.get('DB_PASSWORD'))
+IN_MEMORY_TEST_DATABASE = make_url(TEST_DATABASE_URI).database in (
+    None, '', ':memory:')
+TRIVIA_DUMP = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           'trivia.psql')
+COPY_PATTERN = re.compile(
+    r'COPY public\.(?P<table>\w+) \((?P<columns>[^)]*)\) FROM stdin;')
+COPY_ESCAPES = {'t': '\t', 'n': '\n', 'r': '\r'}
+WRITE_STATEMENTS = ('INSERT', 'UPDATE', 'DELETE')
+# the most SQL statements one request to an endpoint may run, and rows it
+# may fetch, with the DB of trivia.psql and warm caches and indexes
+QueryBudget = namedtuple('QueryBudget', 'queries rows')
+QUERY_BUDGETS = {
+    'get_metrics': QueryBudget(queries=0, rows=0),
+    'get_categories': QueryBudget(queries=1, rows=6),
+    'get_questions': QueryBudget(queries=2, rows=16),
+    'delete_question_by_id': QueryBudget(queries=2, rows=1),
+    'search_questions_by_string_or_add_question':
+        QueryBudget(queries=3, rows=10),
+    'bulk_import_questions': QueryBudget(queries=1, rows=0),
+    # the export streams every question by design
+    'export_question_bank': QueryBudget(queries=1, rows=36),
+    'get_questions_of_category': QueryBudget(queries=2, rows=10),
+    'get_new_quiz_question': QueryBudget(queries=1, rows=1),
+    'get_quiz_deck': QueryBudget(queries=2, rows=10),
+    'create_quiz_session': QueryBudget(queries=0, rows=0),
+    'get_next_session_question': QueryBudget(queries=1, rows=1),
+    'end_quiz_session': QueryBudget(queries=0, rows=0),
+    # the test app writes every result as it arrives, in one insert, and
+    # an unknown category reloads the categories instead
+    'submit_quiz_result': QueryBudget(queries=1, rows=6),
+    'get_leaderboard': QueryBudget(queries=1, rows=6),
+}
+UNMATCHED_BUDGET = QueryBudget(queries=0, rows=0)
+# a statement run more often than this in one request is an N+1 query
+REPEATED_STATEMENT_LIMIT = 2
+# the savepoints TestDatabase runs a test's requests in, not the app's SQL
+TEST_TRANSACTION_STATEMENTS = (
+    'SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK TO SAVEPOINT')
+
+
+class RowCountingCursor:
+    """Wraps a DBAPI cursor to count the rows fetched through it"""
+
+    def __init__(self, cursor, counter):
+        self.cursor = cursor
+        self.counter = counter
+
+    def fetchone(self):
+        row = self.cursor.fetchone()
+        if row is not None:
+            self.counter.rows += 1
+        return row
+
+    def fetchmany(self, *args, **kwargs):
+        rows = self.cursor.fetchmany(*args, **kwargs)
+        self.counter.rows += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self.cursor.fetchall()
+        self.counter.rows += len(rows)
+        return rows
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+
+class QueryCounter:
+    """Counts the SQL statements run, and the rows they fetch, inside a
+    with block"""
+
+    def __init__(self):
+        self.statements = []
+        self.rows = 0
+
+    def __enter__(self):
+        event.listen(Engine, 'after_cursor_execute', self.count)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(Engine, 'after_cursor_execute', self.count)
+
+    def count(self, conn, cursor, statement, parameters, context,
+              executemany):
+        if statement.startswith(TEST_TRANSACTION_STATEMENTS):
+            return
+        self.statements.append(statement)
+        if context is not None:
+            # the result of the statement fetches from context.cursor
+            context.cursor = RowCountingCursor(context.cursor, self)
+
+    def repeated_statements(self):
+        """Returns the statements run more than REPEATED_STATEMENT_LIMIT
+        times"""
+        return [statement for statement, count
+                in Counter(self.statements).items()
+                if count > REPEATED_STATEMENT_LIMIT]
+
+    def assert_within(self, budget, name):
+        """Fails when more statements ran, or more rows were fetched,
+        than the budget allows, or a statement ran over and over"""
+        if len(self.statements) > budget.queries:
+            raise AssertionError(
+                f'{name} ran {len(self.statements)} SQL statements, its '
+                f'budget is {budget.queries}:\n' +
+                '\n'.join(self.statements))
+        if self.rows > budget.rows:
+            raise AssertionError(
+                f'{name} fetched {self.rows} rows, its budget is '
+                f'{budget.rows}')
+        repeated = self.repeated_statements()
+        if repeated:
+            raise AssertionError(
+                f'{name} ran the same statement more than '
+                f'{REPEATED_STATEMENT_LIMIT} times, an N+1 query:\n' +
+                '\n'.join(repeated))
+
+
+class QueryBudgetClient(FlaskClient):
+    """A test client that fails the test when a request goes over the
+    QUERY_BUDGETS of its endpoint"""
+
+    def open(self, *args, **kwargs):
+        builder_kwargs = {
+            key: value for key, value in kwargs.items()
+            if key not in ('as_tuple', 'buffered', 'follow_redirects')}
+        environ = make_test_environ_builder(
+            self.application, *args, **builder_kwargs).get_environ()
+        try:
+            endpoint, _ = self.application.url_map.bind_to_environ(
+                environ).match()
+        except HTTPException:
+            endpoint = None
+        if endpoint is None:
+            budget = UNMATCHED_BUDGET
+        elif endpoint in QUERY_BUDGETS:
+            budget = QUERY_BUDGETS[endpoint]
+        else:
+            raise AssertionError(f'{endpoint} has no QUERY_BUDGETS entry')
+        with QueryCounter() as counter:
+            response = super().open(*args, **kwargs)
+        counter.assert_within(budget, endpoint or environ['PATH_INFO'])
+        return response
+
+
+def read_trivia_dump():
+    """Returns the rows of every table in trivia.psql, keyed by table"""
+    tables = {}
+    rows = None
+    with open(TRIVIA_DUMP, encoding='utf-8') as dump:
+        for line in dump:
+            if rows is None:
+                match = COPY_PATTERN.match(line)
+                if match:
+                    columns = match['columns'].split(', ')
+                    rows = tables[match['table']] = []
+            elif line == '\\.\n':
+                rows = None
+            else:
+                rows.append(dict(zip(columns, [
+                    None if value == '\\N' else re.sub(
+                        r'\\(.)', lambda escape: COPY_ESCAPES.get(
+                            escape[1], escape[1]), value)
+                    for value in line.rstrip('\n').split('\t')])))
+    return tables
+
+
+class TestDatabase:
+    """The DB of a test process, set up once, that runs every test in a
+    transaction rolled back at the end of the test. A Postgres trivia_test
+    restored from trivia.psql is migrated, an SQLite DB is created and
+    filled from trivia.psql."""
+
+    def __init__(self, uri):
+        self.uri = uri
+        self.engine = None
+        self.connection = None
+        self.transaction = None
+        self.written = False
+        self.default_session = None
+
+    def set_up(self):
+        """Creates or migrates the DB, once, and routes the sessions of
+        every app on it through the transaction of the current test"""
+        if self.engine is None:
+            if make_url(self.uri).get_backend_name() == 'sqlite':
+                self.engine = self.create_sqlite_engine()
+            else:
+                self.engine = create_engine(self.uri)
+                app = create_app({'SQLALCHEMY_DATABASE_URI': self.uri})
+                with app.app_context():
+                    # add what is newer than trivia.psql
+                    create_schema()
+                db.get_engine(app).dispose()
+        if self.default_session is None:
+            self.default_session = db.session
+            db.session = orm.scoped_session(
+                self.create_session,
+                scopefunc=_app_ctx_stack.__ident_func__)
+
+    def tear_down(self):
+        """Gives the apps back their own sessions"""
+        db.session = self.default_session
+        self.default_session = None
+
+    def create_sqlite_engine(self):
+        # one connection, so an in-memory DB lasts as long as the engine
+        engine = create_engine(self.uri, poolclass=StaticPool,
+                               connect_args={'check_same_thread': False})
+
+        # let SQLAlchemy emit BEGIN, pysqlite's own handling breaks
+        # savepoints
+        @event.listens_for(engine, 'connect')
+        def disable_pysqlite_transactions(dbapi_connection, record):
+            dbapi_connection.isolation_level = None
+
+        @event.listens_for(engine, 'begin')
+        def begin(connection):
+            connection.execute('BEGIN')
+
+        db.Model.metadata.create_all(engine)
+        with engine.begin() as connection:
+            if connection.execute(func.count(Category.id)).scalar():
+                return engine  # filled by an earlier run
+            tables = read_trivia_dump()
+            for question in tables['questions']:
+                question['question_hash'] = hash_question(
+                    question['question'])
+            connection.execute(Category.__table__.insert(),
+                               tables['categories'])
+            connection.execute(Question.__table__.insert(),
+                               tables['questions'])
+        return engine
+
+    def begin(self):
+        """Starts the transaction of a test"""
+        self.connection = self.engine.connect()
+        self.transaction = self.connection.begin()
+        self.written = False
+        # writes to other DBs, by apps a test creates, also reach the
+        # indexes of every app through mapper events
+        event.listen(Engine, 'before_cursor_execute', self.note_write)
+
+    def note_write(self, conn, cursor, statement, parameters, context,
+                   executemany):
+        if statement.lstrip().upper().startswith(WRITE_STATEMENTS):
+            self.written = True
+
+    def rollback(self):
+        """Rolls back everything the test wrote
+
+            Returns:
+                    written: whether the test wrote to the DB
+        """
+        db.session.remove()
+        event.remove(Engine, 'before_cursor_execute', self.note_write)
+        self.transaction.rollback()
+        self.connection.close()
+        self.connection = None
+        return self.written
+
+    def create_session(self):
+        """Returns a session on the transaction of the current test, in a
+        savepoint so the app can commit and roll back as usual, or the
+        app's own session for an app on another DB"""
+        if self.connection is None or \
+                db.get_app().config['SQLALCHEMY_DATABASE_URI'] != self.uri:
+            return self.default_session.session_factory()
+        session = db.create_session({
+            'bind': self.connection, 'binds': {},
+            'query_cls': db.Query})()
+        session.begin_nested()
+
+        @event.listens_for(session, 'after_transaction_end')
+        def restart_savepoint(session, transaction):
+            if transaction.nested and not transaction._parent.nested:
+                session.expire_all()
+                session.begin_nested()
+
+        return session
+
+
+TEST_DB = TestDatabase(TEST_DATABASE_URI)
 
 
 class TriviaTestCase(unittest.TestCase):
     """This class represents the trivia test case"""
+    # shared by the tests until one writes to the DB, its caches and
+    # indexes may then hold rolled back rows
+    shared_app = None
+
+    @classmethod
+    def setUpClass(cls):
+        TEST_DB.set_up()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.discard_shared_app()
+        TEST_DB.tear_down()
+
+    @classmethod
+    def get_shared_app(cls):
+        if cls.shared_app is None:
+            # results are written in the request that submits them rather
+            # than by a background thread, and a test that submits one
+            # gets a fresh app, without the result, for the next test.
+            # Responses aren't cached, so every test's request runs its
+            # queries whatever the tests before it requested
+            app = create_app({'SQLALCHEMY_DATABASE_URI': TEST_DATABASE_URI,
+                              'RESULTS_FLUSH_SIZE': 1,
+                              'RESULTS_FLUSH_INTERVAL': None,
+                              'RESPONSE_CACHE': False})
+            # load the category cache, the quiz and search indexes and the
+            # leaderboards, so the query budgets hold every request to the
+            # same limits
+            warm_up(app)
+            app.test_client_class = QueryBudgetClient
+            cls.shared_app = app
+        return cls.shared_app
+
+    @classmethod
+    def discard_shared_app(cls):
+        if cls.shared_app is not None:
+            db.get_engine(cls.shared_app).dispose()
+            cls.shared_app = None
 
     def setUp(self):
         """Define test variables and initialize app."""
-        self.app = create_app()
+        TEST_DB.begin()
+        self.app = self.get_shared_app()
         self.client = self.app.test_client
-        self.database_name = "trivia_test"
-        self.database_port = "localhost:5432"
-        self.database_path = "postgresql://{}:{}@{}/{}".format(
-            os.environ['DB_USER'],
-            os.environ['DB_PASSWORD'],
-            self.database_port,
-            self.database_name)
-
-        setup_db(self.app, self.database_path)
 
         self.new_question = {
             'question': TEST_QUESTION_TEXT,
@@ -54,16 +405,10 @@ class TriviaTestCase(unittest.TestCase):
             'category': "3"
         }
 
-        # binds the app to the current context
-        with self.app.app_context():
-            self.db = SQLAlchemy()
-            self.db.init_app(self.app)
-            # create all tables
-            self.db.create_all()
-
     def tearDown(self):
         """Executed after reach test"""
-        pass
+        if TEST_DB.rollback():
+            self.discard_shared_app()
 
     def test_success_get_categories(self):
         """Test success at GET '/categories'"""
@@ -74,6 +419,118 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(len(data['categories']), 6)
         self.assertTrue(data['categories'])
 
+    def test_success_get_categories_not_modified(self):
+        """Test success at GET '/categories' with the ETag of a cached copy,
+         and a new ETag once a question is added"""
+        res = self.client().get('/categories')
+        etag = res.headers['ETag']
+        self.assertEqual(res.status_code, OK)
+        self.assertNotIn('Last-Modified', res.headers)
+        # a date to the second can't tell apart writes within a second
+        res = self.client().get('/categories', headers={
+            'If-Modified-Since': 'Fri, 01 Jan 2100 00:00:00 GMT'})
+        self.assertEqual(res.status_code, OK)
+        res = self.client().get(
+            '/categories', headers={'If-None-Match': etag})
+        self.assertEqual(res.status_code, NOT_MODIFIED)
+        self.assertEqual(res.data, b'')
+        self.client().post('/questions', json=self.new_question)
+        res = self.client().get(
+            '/categories', headers={'If-None-Match': etag})
+        self.assertEqual(res.status_code, OK)
+        self.assertNotEqual(res.headers['ETag'], etag)
+
+    @unittest.skipUnless(hasattr(os, 'fork'), 'workers are forked')
+    def test_success_forked_workers_etags(self):
+        """Test a worker forked from a preloaded app tags its responses
+         apart from its parent's, and workers sharing a SQLite content
+         version see each other's writes"""
+        with tempfile.TemporaryDirectory() as directory:
+            in_process_version = InProcessContentVersion()
+            shared_version = SqliteContentVersion(
+                os.path.join(directory, 'version.db'))
+            version, _ = shared_version.current()
+            read_end, write_end = os.pipe()
+            pid = os.fork()
+            if pid == 0:
+                try:
+                    shared_version.bump()
+                    os.write(write_end,
+                             in_process_version.etag_prefix.encode())
+                finally:
+                    os._exit(0)
+            os.close(write_end)
+            with os.fdopen(read_end) as child:
+                child_prefix = child.read()
+            os.waitpid(pid, 0)
+            self.assertEqual(len(child_prefix), 8)
+            self.assertNotEqual(child_prefix, in_process_version.etag_prefix)
+            self.assertEqual(shared_version.current()[0], version + 1)
+            other_worker = SqliteContentVersion(
+                os.path.join(directory, 'version.db'))
+            self.assertEqual(other_worker.etag_prefix,
+                             shared_version.etag_prefix)
+            other_worker.bump()
+            self.assertEqual(shared_version.current()[0], version + 2)
+
+    def test_success_get_categories_from_cache(self):
+        """Test success at GET '/categories' served from memory, and
+         reloaded once a category is added"""
+        client = create_app(
+            {'SQLALCHEMY_DATABASE_URI': TEST_DATABASE_URI}).test_client()
+        client.get('/categories')
+        with QueryCounter() as counter:
+            res = client.get('/categories')
+        self.assertEqual(counter.statements, [])
+        self.assertEqual(len(json.loads(res.data)['categories']), 6)
+        with self.app.app_context():
+            db.session.add(Category('Music'))
+            db.session.commit()
+        data = json.loads(client.get('/categories').data)
+        self.assertEqual(len(data['categories']), 6 + 1)
+        self.assertIn('Music', data['categories'].values())
+
+    def test_success_category_cache_reloaded_after_commit(self):
+        """Test the category cache is reloaded once a category is added,
+         even when it was loaded between the flush and the commit"""
+        category_cache = CategoryCache()
+        with self.app.app_context():
+            rows = db.session.execute(categories_statement()).fetchall()
+            category_cache.get_formatted()
+            db.session.add(Category('Music'))
+            db.session.flush()
+            # as read by another session, the insert isn't committed yet
+            category_cache.load(rows)
+            db.session.commit()
+            with QueryCounter() as counter:
+                categories = category_cache.get_formatted()
+        self.assertEqual(len(counter.statements), 1)
+        self.assertIn('Music', categories.values())
+
+    def test_fail_get_questions_of_unknown_category_from_cache(self):
+        """Test fail at GET '/categories/1000/questions' answered from
+         memory, the categories are only reloaded after miss_max_age"""
+        client = create_app(
+            {'SQLALCHEMY_DATABASE_URI': TEST_DATABASE_URI}).test_client()
+        client.get('/categories')
+        with QueryCounter() as counter:
+            statuses = [client.get('/categories/1000/questions').status_code
+                        for _ in range(3)]
+        self.assertEqual(statuses, [UNPROCESSABLE_ENTITY] * 3)
+        self.assertEqual(counter.statements, [])
+        with self.app.app_context():
+            rows = db.session.execute(categories_statement()).fetchall()
+            # loaded from rows queried elsewhere, as the async mode does
+            category_cache = CategoryCache()
+            category_cache.load(rows)
+            self.assertFalse(category_cache.is_stale())
+            self.assertFalse(category_cache.is_miss_stale())
+            category_cache = CategoryCache(miss_max_age=0)
+            category_cache.load(rows)
+            with QueryCounter() as counter:
+                self.assertIsNone(category_cache.get_type(1000))
+            self.assertEqual(len(counter.statements), 1)
+
     def test_fail_post_categories(self):
         """Test fail a POST to '/categories'"""
         res = self.client().post('/categories')
@@ -119,6 +576,182 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['current_category'], category_name)
         self.assertEqual(data['total_questions'], total_questions)
 
+    def test_success_get_questions_with_cursor(self):
+        """Test success at GET '/questions' with cursor pagination"""
+        total_questions = 36
+        seen_ids = []
+        next_cursor = 0
+        while next_cursor is not None:
+            res = self.client().get(
+                f'/questions?after={next_cursor}&limit=15')
+            data = json.loads(res.data)
+            self.assertEqual(res.status_code, OK)
+            self.assertEqual(data['success'], True)
+            self.assertTrue(len(data['questions']) <= 15)
+            self.assertEqual(data['total_questions'], total_questions)
+            seen_ids += [question['id'] for question in data['questions']]
+            next_cursor = data['next_cursor']
+        self.assertEqual(len(seen_ids), total_questions)
+        self.assertEqual(seen_ids, sorted(seen_ids))
+
+    def test_success_get_questions_of_category_with_cursor(self):
+        """Test success at GET '/categories/<int:category_id>/questions'
+         with cursor pagination"""
+        category_id = 1
+        res = self.client().get(
+            f'/categories/{category_id}/questions?after=20&limit=2')
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, OK)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(
+            [question['id'] for question in data['questions']], [21, 22])
+        self.assertEqual(data['next_cursor'], 22)
+
+    def test_success_get_questions_without_count(self):
+        """Test success at GET '/questions' with count=none"""
+        res = self.client().get('/questions?count=none')
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, OK)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(len(data['questions']), 10)
+        self.assertEqual(data['total_questions'], None)
+
+    def test_success_get_questions_with_fields(self):
+        """Test success at GET '/questions' with only some fields"""
+        res = self.client().get('/questions?fields=id,question&after=0')
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, OK)
+        self.assertEqual(len(data['questions']), 10)
+        self.assertEqual(data['next_cursor'], data['questions'][-1]['id'])
+        for question in data['questions']:
+            self.assertEqual(set(question), {'id', 'question'})
+
+    def test_success_get_questions_of_category_without_id(self):
+        """Test success at GET '/categories/<id>/questions' with fields
+         leaving out the id"""
+        res = self.client().get('/categories/1/questions?fields=answer')
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, OK)
+        self.assertEqual(data['total_questions'], 6)
+        self.assertEqual(data['questions'][0], {'answer': 'The Liver'})
+
+    def test_fail_get_questions_with_unknown_field(self):
+        """Test fail at GET '/questions' w a field questions don't have"""
+        res = self.client().get('/questions?fields=id,question_hash')
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, UNPROCESSABLE_ENTITY)
+        self.assertEqual(data['success'], False)
+
+    def test_success_get_questions_past_last_page(self):
+        """Test success at GET '/questions' with a page past the end"""
+        total_questions = 36
+        res = self.client().get('/questions?page=9')
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, OK)
+        self.assertEqual(data['questions'], [])
+        self.assertEqual(data['total_questions'], total_questions)
+
+    def test_success_get_questions_gzip_compressed(self):
+        """Test success at GET '/questions' with gzip accepted"""
+        res = self.client().get(
+            '/questions', headers={'Accept-Encoding': 'gzip'})
+        data = json.loads(gzip.decompress(res.data))
+        self.assertEqual(res.status_code, OK)
+        self.assertEqual(res.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(data['success'], True)
+        self.assertEqual(len(data['questions']), 10)
+
+    def test_success_get_questions_server_timing(self):
+        """Test success at GET '/questions' reports its query count and
+         timings in a Server-Timing header"""
+        res = self.client().get('/questions')
+        server_timing = res.headers['Server-Timing']
+        self.assertEqual(res.status_code, OK)
+        self.assertRegex(server_timing,
+                         r'db;dur=[\d.]+;desc="[1-9]\d* queries"')
+        self.assertIn('serialize;dur=', server_timing)
+        self.assertIn('total;dur=', server_timing)
+
+    def test_success_get_metrics(self):
+        """Test success at GET '/metrics' with histograms by endpoint"""
+        client = create_app(
+            {'SQLALCHEMY_DATABASE_URI': TEST_DATABASE_URI}).test_client()
+        client.get('/questions')
+        client.get('/questions/1000')
+        res = client.get('/metrics')
+        metrics = res.data.decode()
+        self.assertEqual(res.status_code, OK)
+        self.assertTrue(res.content_type.startswith('text/plain'))
+        self.assertNotIn('ETag', res.headers)
+        self.assertIn('# TYPE trivia_request_duration_seconds histogram',
+                      metrics)
+        self.assertIn('trivia_request_duration_seconds_count{method="GET",'
+                      'endpoint="/questions",status="200"} 1', metrics)
+        self.assertIn('trivia_request_queries_bucket{method="GET",'
+                      'endpoint="unmatched",status="405",le="0"} 1',
+                      metrics)
+
+    def test_success_every_route_has_query_budget(self):
+        """Test every endpoint of the app declares a query budget"""
+        endpoints = {rule.endpoint for rule in self.app.url_map.iter_rules()
+                     if rule.endpoint != 'static'}
+        self.assertEqual(endpoints, set(QUERY_BUDGETS))
+
+    def test_fail_query_budget_catches_n_plus_one(self):
+        """Test the query budget fails a question fetched per id"""
+        with self.app.app_context():
+            with QueryCounter() as counter:
+                for question_id in [2, 4, 5]:
+                    Question.query.get(question_id)
+        self.assertEqual(len(counter.statements), 3)
+        self.assertEqual(counter.rows, 3)
+        with self.assertRaisesRegex(AssertionError, 'N\\+1'):
+            counter.assert_within(QueryBudget(queries=3, rows=3), 'loop')
+        with self.assertRaisesRegex(AssertionError, 'budget is 2'):
+            counter.assert_within(QueryBudget(queries=2, rows=3), 'loop')
+
+    def test_success_create_app_runs_no_sql(self):
+        """Test creating the app doesn't touch the DB, and warming it up
+         leaves the first quiz draw only its question to fetch"""
+        with QueryCounter() as counter:
+            app = create_app({'SQLALCHEMY_DATABASE_URI': TEST_DATABASE_URI})
+        self.assertEqual(counter.statements, [])
+        warm_up(app)
+        with QueryCounter() as counter:
+            res = app.test_client().post('/quizzes', json={
+                'previous_questions': [], 'quiz_category': {'id': 0}})
+        self.assertEqual(res.status_code, OK)
+        self.assertEqual(len(counter.statements), 1)
+
+    @unittest.skipUnless(hasattr(os, 'fork'), 'needs os.fork')
+    def test_success_forked_worker_opens_own_connections(self):
+        """Test a forked worker neither reuses the pooled connections nor
+         writes the buffered quiz results of its parent"""
+        with tempfile.TemporaryDirectory() as db_dir:
+            engine = create_engine(f'sqlite:///{db_dir}/fork.db',
+                                   poolclass=QueuePool)
+            with engine.connect() as connection:
+                parent_connection = connection.connection.connection
+            writer = ResultWriter(self.app, flush_interval=None)
+            writer.add(new_result('Ada', 1, 3, 5))
+            read_end, write_end = os.pipe()
+            pid = os.fork()
+            if pid == 0:
+                with engine.connect() as connection:
+                    is_shared = connection.connection.connection is \
+                        parent_connection
+                os.write(write_end, json.dumps(
+                    [is_shared, len(writer.pending())]).encode())
+                os._exit(0)
+            os.waitpid(pid, 0)
+            is_shared, child_pending = json.loads(os.read(read_end, 100))
+            os.close(read_end)
+            os.close(write_end)
+            engine.dispose()
+        self.assertFalse(is_shared)
+        self.assertEqual(child_pending, 0)
+        self.assertEqual(len(writer.pending()), 1)
+
     def test_fail_delete_questions_at_base_question_url(self):
         """Test fail DELETE at '/questions'"""
         res = self.client().delete('/questions')
@@ -156,6 +789,23 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['total_questions'], questions_in_category)
         self.assertTrue(data['questions'])
 
+    def test_success_category_is_indexed_foreign_key(self):
+        """Test questions.category is an indexed integer foreign key"""
+        with self.app.app_context():
+            inspector = inspect(db.session.connection())
+            columns = {column['name']: column['type']
+                       for column in inspector.get_columns('questions')}
+            foreign_keys = inspector.get_foreign_keys('questions')
+            indexes = {index['name']: index['column_names']
+                       for index in inspector.get_indexes('questions')}
+        self.assertIsInstance(columns['category'], Integer)
+        self.assertEqual(foreign_keys[0]['constrained_columns'], ['category'])
+        self.assertEqual(foreign_keys[0]['referred_table'], 'categories')
+        self.assertEqual(
+            indexes['ix_questions_category_id'], ['category', 'id'])
+        self.assertEqual(indexes['ix_questions_category_difficulty'],
+                         ['category', 'difficulty'])
+
     def test_fail_get_questions_of_missing_category(self):
         """Test fail at GET '/categories/<int:category_id>/questions'
          w category not in DB"""
@@ -171,18 +821,16 @@ class TriviaTestCase(unittest.TestCase):
         """Test success at DELETE '/questions/<int:question_id>"""
         question_id = 2
         question_text = DELETE_QUESTION_TEST
-        question = Question.query.get(question_id)
         res = self.client().delete(f'/questions/{question_id}')
-        removed_question = Question.query.filter_by(
-            id=question_id).one_or_none()
+        with self.app.app_context():
+            removed_question = Question.query.filter_by(
+                id=question_id).one_or_none()
         data = json.loads(res.data)
         self.assertEqual(res.status_code, OK)
         self.assertEqual(data['success'], True)
         self.assertEqual(data['deleted_question_text'], question_text)
         self.assertEqual(data['deleted_question_id'], question_id)
         self.assertEqual(removed_question, None)
-        make_transient(question)
-        Question.insert(question)
 
     def test_fail_delete_question_by_missing_id(self):
         """Test success at DELETE '/questions/<int:question_id>'
@@ -254,6 +902,65 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['questions'], [])
         self.assertTrue(data['current_category'])
 
+    def test_success_search_question_by_answer_text(self):
+        """Test success at POST '/questions' with a searchTerm that is only
+         in an answer, questions matching on their text rank first"""
+        term = "mona lisa"
+        res = self.client().post('/questions', json={'searchTerm': term})
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, OK)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['total_questions'], 2)
+        self.assertEqual(
+            [question['id'] for question in data['questions']], [39, 17])
+
+    def test_success_search_question_by_string_in_category(self):
+        """Test success at POST '/questions' with searchTerm and category"""
+        term = "the"
+        category_id = 2
+        res = self.client().post(
+            '/questions',
+            json={'searchTerm': term, 'category': category_id})
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, OK)
+        self.assertEqual(data['total_questions'], 3)
+        for question in data['questions']:
+            self.assertEqual(f"{question['category']}", f'{category_id}')
+
+    def test_success_search_question_by_string_with_fields(self):
+        """Test success at POST '/questions?fields=' leaving out answers"""
+        res = self.client().post('/questions?fields=id,question',
+                                 json={'searchTerm': 'title'})
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, OK)
+        self.assertEqual(data['total_questions'], 2)
+        for question in data['questions']:
+            self.assertEqual(set(question), {'id', 'question'})
+
+    def test_success_search_after_rolled_back_writes(self):
+        """Test success at POST '/questions' finds no question whose insert
+         was rolled back and still finds one whose delete was"""
+        with self.app.app_context():
+            db.session.add(Question(question='Which bird is the plover?',
+                                    answer='A wader', difficulty=1,
+                                    category='1'))
+            db.session.flush()
+            db.session.rollback()
+            db.session.delete(Question.query.filter(
+                Question.question.contains('Anne Rice')).one())
+            db.session.flush()
+            db.session.rollback()
+        # the rollbacks leave the index to be rebuilt
+        warm_up(self.app, ['search'])
+        data = json.loads(self.client().post(
+            '/questions', json={'searchTerm': 'plover'}).data)
+        self.assertEqual(data['total_questions'], 0)
+        self.assertEqual(data['questions'], [])
+        data = json.loads(self.client().post(
+            '/questions', json={'searchTerm': 'Anne Rice'}).data)
+        self.assertEqual(data['total_questions'], 1)
+        self.assertEqual(len(data['questions']), 1)
+
     def test_fail_search_question_by_string_with_malformed_json(self):
         """Test fail at POST '/questions' with bad json"""
         term = "ignoramus"
@@ -272,8 +979,35 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['question'], TEST_QUESTION_TEXT)
         self.assertTrue(data['total_questions'])
         self.assertTrue(data['new_question_id'])
-        new_id = data['new_question_id']
-        self.client().delete(f'/questions/{new_id}')
+
+    def test_success_add_non_ascii_question_escaped(self):
+        """Test success at POST '/questions' with a non-ASCII question is
+         answered with the same bytes by every JSON provider"""
+        question_text = 'Qu\'est-ce que le café au lait ? 牛奶咖啡'
+        res = self.client().post('/questions', json={
+            **self.new_question, 'question': question_text})
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, OK)
+        self.assertEqual(data['question'], question_text)
+        self.assertIn(b'caf\\u00e9', res.data)
+        self.assertEqual(res.data, StdlibJSONProvider(self.app).dumps(data))
+        self.app.config['JSONIFY_PRETTYPRINT_REGULAR'] = True
+        try:
+            self.assertEqual(self.app.json_provider.dumps(data),
+                             StdlibJSONProvider(self.app).dumps(data))
+        finally:
+            self.app.config['JSONIFY_PRETTYPRINT_REGULAR'] = False
+
+    def test_success_wont_add_reworded_duplicate_question(self):
+        """Test success at POST '/questions' with a DUPLICATE question that
+         only differs in case, punctuation and spacing"""
+        reworded_question = dict(self.duplicate_question)
+        reworded_question['question'] = "what is the  largest LAKE in Africa"
+        res = self.client().post('/questions', json=reworded_question)
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, OK)
+        self.assertEqual(data['success'], False)
+        self.assertTrue(data['total_questions'])
 
     def test_fail_add_question_missing_data(self):
         """Test success at POST '/questions' missing json"""
@@ -293,6 +1027,229 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['question'], DUPLICATE_TEXT)
         self.assertTrue(data['total_questions'])
 
+    def test_success_bulk_import_questions(self):
+        """Test success at POST '/questions/bulk' with NDJSON"""
+        lines = [
+            json.dumps(self.new_question),
+            '{not json',
+            json.dumps(self.duplicate_question),
+        ]
+        res = self.client().post(
+            '/questions/bulk', data='\n'.join(lines),
+            content_type='application/x-ndjson')
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, OK)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['inserted'], 1)
+        self.assertEqual(data['duplicates'], 1)
+        self.assertEqual(data['rejected'], 1)
+        self.assertEqual(data['batches'][0]['rejected'][0]['line'], 2)
+        with self.app.app_context():
+            self.assertEqual(Question.query.filter_by(
+                question=TEST_QUESTION_TEXT).count(), 1)
+
+    def test_success_bulk_import_questions_bounded(self):
+        """Test success at POST '/questions/bulk' with a batch_size past
+         IMPORT_BATCH_SIZE_MAX and more rejects than a batch reports"""
+        client = create_app({'SQLALCHEMY_DATABASE_URI': TEST_DATABASE_URI,
+                             'IMPORT_BATCH_SIZE_MAX': 20}).test_client()
+        lines = ['{not json'] * 25 + [json.dumps(self.new_question)]
+        res = client.post(
+            '/questions/bulk?batch_size=100000000', data='\n'.join(lines),
+            content_type='application/x-ndjson')
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, OK)
+        self.assertEqual(data['inserted'], 1)
+        self.assertEqual(data['rejected'], 25)
+        self.assertEqual([batch['rejected_count']
+                          for batch in data['batches']], [20, 5])
+        self.assertEqual(len(data['batches'][0]['rejected']), 10)
+        self.assertEqual(data['batches'][1]['rejected'][0]['line'], 21)
+
+    def test_fail_bulk_import_questions_partway(self):
+        """Test fail at POST '/questions/bulk' w a line that isn't UTF-8
+         after a committed batch, whose question is then listed, found and
+         drawn"""
+        client = create_app(
+            {'SQLALCHEMY_DATABASE_URI': TEST_DATABASE_URI}).test_client()
+        res = client.get('/questions')
+        total_questions = json.loads(res.data)['total_questions']
+        etag = res.headers['ETag']
+        client.post('/questions', json={'searchTerm': 'James Bond'})
+        client.post('/quizzes', json={'previous_questions': [],
+                                      'quiz_category': {'id': 5}})
+        # past the first chunk the stream is decoded in
+        body = (json.dumps(self.new_question) + '\n' + ' ' * 10000 +
+                '\n').encode() + b'\xff\n'
+        res = client.post('/questions/bulk?batch_size=1', data=body,
+                          content_type='application/x-ndjson')
+        self.assertEqual(res.status_code, UNPROCESSABLE_ENTITY)
+        res = client.get('/questions', headers={'If-None-Match': etag})
+        self.assertEqual(res.status_code, OK)
+        self.assertEqual(json.loads(res.data)['total_questions'],
+                         total_questions + 1)
+        data = json.loads(client.post(
+            '/questions', json={'searchTerm': 'James Bond'}).data)
+        self.assertEqual(data['total_questions'], 1)
+        with self.app.app_context():
+            new_question_id = Question.query.filter_by(
+                question=TEST_QUESTION_TEXT).one().id
+            previous_questions = [
+                question.id for question in Question.query.filter(
+                    Question.category == 5, Question.id != new_question_id)]
+        data = json.loads(client.post('/quizzes', json={
+            'previous_questions': previous_questions,
+            'quiz_category': {'id': 5}}).data)
+        self.assertEqual(data['question']['id'], new_question_id)
+
+    def test_fail_bulk_import_questions_unknown_format(self):
+        """Test fail at POST '/questions/bulk' with an unknown format"""
+        res = self.client().post('/questions/bulk?format=xml', data='<q/>')
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, UNPROCESSABLE_ENTITY)
+        self.assertEqual(data['success'], False)
+
+    def test_success_export_questions(self):
+        """Test success at GET '/questions/export' as NDJSON"""
+        total_questions = 36
+        res = self.client().get('/questions/export')
+        lines = res.data.decode().splitlines()
+        self.assertEqual(res.status_code, OK)
+        self.assertEqual(res.mimetype, 'application/x-ndjson')
+        self.assertEqual(len(lines), total_questions)
+        self.assertEqual(
+            json.loads(lines[0])['question'], DELETE_QUESTION_TEST)
+
+    def test_success_export_questions_as_csv_by_category(self):
+        """Test success at GET '/questions/export' as CSV of one category"""
+        category_id = 6
+        res = self.client().get(
+            f'/questions/export?format=csv&category={category_id}')
+        lines = res.data.decode().splitlines()
+        self.assertEqual(res.status_code, OK)
+        self.assertEqual(res.mimetype, 'text/csv')
+        self.assertEqual(lines[0], 'id,question,answer,difficulty,category')
+        self.assertEqual(len(lines), 3)
+
+    def test_fail_export_questions_unknown_format(self):
+        """Test fail at GET '/questions/export' with an unknown format"""
+        res = self.client().get('/questions/export?format=xml')
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, UNPROCESSABLE_ENTITY)
+        self.assertEqual(data['success'], False)
+
+    def test_success_reads_replicas_until_client_writes(self):
+        """Test GETs are read from the replicas in turn, except for a
+         client that just added a question"""
+        with tempfile.TemporaryDirectory() as db_dir:
+            app = create_app({
+                'SQLALCHEMY_DATABASE_URI': f'sqlite:///{db_dir}/primary.db',
+                'DATABASE_REPLICA_URIS': [
+                    f'sqlite:///{db_dir}/replica_{number}.db'
+                    for number in range(2)],
+            })
+            with app.app_context():
+                db.create_all()
+                for number in range(2):
+                    engine = db.get_engine(app, bind=f'replica_{number}')
+                    db.Model.metadata.create_all(engine)
+                    engine.execute(Question.__table__.insert(), {
+                        'question': f'Replica {number} question',
+                        'answer': 'Replica', 'difficulty': 1,
+                        'category': '1'})
+            reader = app.test_client()
+            replica_questions = {
+                json.loads(reader.get('/questions').data)[
+                    'questions'][0]['question'] for _ in range(2)}
+            writer = app.test_client()
+            res = writer.post('/questions', json=self.new_question)
+            new_question_id = json.loads(res.data)['new_question_id']
+            res = writer.get(f'/questions?after={new_question_id - 1}')
+            data = json.loads(res.data)
+            self.assertEqual(res.status_code, OK)
+            self.assertEqual(replica_questions, {
+                'Replica 0 question', 'Replica 1 question'})
+            self.assertEqual(data['questions'][0]['question'],
+                             TEST_QUESTION_TEXT)
+            self.assertNotIn('ETag', reader.get('/questions').headers)
+
+    def test_success_seed_same_questions_for_same_seed(self):
+        """Test flask seed loads distinct questions, the same ones for the
+         same seed, and skips the ones already loaded"""
+        loaded = []
+        with tempfile.TemporaryDirectory() as db_dir:
+            for name in ['first', 'second']:
+                app = create_app({'SQLALCHEMY_DATABASE_URI':
+                                  f'sqlite:///{db_dir}/{name}.db'})
+                runner = app.test_cli_runner()
+                runner.invoke(args=['migrate'])
+                with app.app_context():
+                    last_id = db.session.query(
+                        func.max(Question.id)).scalar() or 0
+                for _ in range(2):
+                    result = runner.invoke(args=[
+                        'seed', '--questions', '500', '--seed', '7',
+                        '--batch-size', '200'])
+                with app.app_context():
+                    loaded.append([
+                        (question.question, question.answer,
+                         question.difficulty) for question in
+                        Question.query.filter(Question.id > last_id)])
+                    db.session.remove()
+                    db.get_engine(app).dispose()
+        self.assertIn('inserted 0 questions', result.output)
+        self.assertEqual(len(loaded[0]), 500)
+        self.assertEqual(len(set(loaded[0])), 500)
+        self.assertEqual(loaded[0], loaded[1])
+
+    @unittest.skipIf(create_asgi_app is None, 'async mode not installed')
+    @unittest.skipIf(IN_MEMORY_TEST_DATABASE,
+                     'the async driver cannot open an in-memory DB')
+    def test_success_async_mode_serves_same_json(self):
+        """Test the ASGI app answers like the Flask app"""
+        asgi_app = create_asgi_app({
+            'SQLALCHEMY_DATABASE_URI':
+                self.app.config['SQLALCHEMY_DATABASE_URI']})
+        with TestClient(asgi_app) as async_client:
+            for path in ['/categories', '/questions?page=2',
+                         '/questions?page=100', '/categories/3/questions',
+                         '/categories/3/questions?page=5']:
+                res = async_client.get(path)
+                self.assertEqual(res.status_code, OK)
+                self.assertEqual(
+                    res.json(), json.loads(self.client().get(path).data))
+            res = async_client.post('/quizzes', json={
+                'previous_questions': [],
+                'quiz_category': {'type': 'Science', 'id': '1'}})
+            self.assertEqual(res.status_code, OK)
+            self.assertEqual(res.json()['question']['category'], 1)
+            res = async_client.get('/categories/1000/questions')
+            self.assertEqual(res.status_code, UNPROCESSABLE_ENTITY)
+            self.assertEqual(res.json()['message'], UNPROCESSABLE_ENTITY_MSG)
+            question = Question.query.get(2)
+            res = async_client.post('/questions', json={
+                'question': question.question, 'answer': question.answer,
+                'difficulty': question.difficulty,
+                'category': question.category})
+            self.assertEqual(res.status_code, OK)
+            self.assertEqual(res.json()['success'], False)
+
+    @unittest.skipIf(create_asgi_app is None, 'async mode not installed')
+    def test_success_async_mode_spots_duplicate_questions(self):
+        """Test only a unique index rejecting a row counts as a duplicate
+         question in async mode"""
+        connection = sqlite3.connect(':memory:')
+        connection.execute(
+            'CREATE TABLE questions (question_hash TEXT UNIQUE NOT NULL)')
+        connection.execute("INSERT INTO questions VALUES ('a')")
+        with self.assertRaises(sqlite3.IntegrityError) as duplicate:
+            connection.execute("INSERT INTO questions VALUES ('a')")
+        with self.assertRaises(sqlite3.IntegrityError) as missing:
+            connection.execute('INSERT INTO questions VALUES (NULL)')
+        self.assertTrue(is_unique_violation(duplicate.exception))
+        self.assertFalse(is_unique_violation(missing.exception))
+        self.assertFalse(is_unique_violation(ValueError('a')))
+
     def test_success_qet_quiz_question(self):
         """Test success at POST '/quizzes'
          with json providing category and previous question list"""
@@ -328,6 +1285,42 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['question'], None)
         self.assertEqual(data['total_questions'], num_sports_questions_left)
 
+    def test_success_get_quiz_deck(self):
+        """Test success at POST '/quizzes/deck'
+         returns distinct questions of the category in one response"""
+        quiz_category = {"type": "Science", "id": "1"}
+        previous_questions = [20, 21]
+        res = self.client().post('/quizzes/deck', json={
+            'count': 5,
+            'previous_questions': previous_questions,
+            'quiz_category': quiz_category})
+        data = json.loads(res.data)
+        question_ids = [question['id'] for question in data['questions']]
+        self.assertEqual(res.status_code, OK)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['total_questions'], len(question_ids))
+        self.assertEqual(len(set(question_ids)), len(question_ids))
+        self.assertFalse(set(question_ids) & set(previous_questions))
+        for question in data['questions']:
+            self.assertEqual(f"{question['category']}", quiz_category['id'])
+
+    def test_success_get_quiz_deck_of_all_categories(self):
+        """Test success at POST '/quizzes/deck' for all categories"""
+        res = self.client().post('/quizzes/deck', json={
+            'count': 10, 'quiz_category': {"type": "click", "id": 0}})
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, OK)
+        self.assertEqual(data['total_questions'], 10)
+        self.assertEqual(
+            len({question['id'] for question in data['questions']}), 10)
+
+    def test_fail_get_quiz_deck_wout_json(self):
+        """Test fail at POST '/quizzes/deck' without json"""
+        res = self.client().post('/quizzes/deck')
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, UNPROCESSABLE_ENTITY)
+        self.assertEqual(data['success'], False)
+
     def test_fail_qet_quiz_question_wout_json(self):
         """Test fail at POST '/quizzes' without json"""
         res = self.client().post('/quizzes')
@@ -376,6 +1369,442 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], False)
         self.assertEqual(data['message'], METHOD_NOT_ALLOWED_MSG)
 
+    def test_success_quiz_session_plays_whole_category(self):
+        """Test success at POST '/quizzes/sessions' and
+         '/quizzes/sessions/<session_id>/next' until the category is used up"""
+        quiz_category = {"type": "Science", "id": "1"}
+        science_question_ids = {20, 21, 22, 27, 28, 29}
+        res = self.client().post(
+            '/quizzes/sessions', json={'quiz_category': quiz_category})
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, OK)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['quiz_category'], quiz_category)
+        session_id = data['session_id']
+        drawn_ids = set()
+        for _ in science_question_ids:
+            res = self.client().post(f'/quizzes/sessions/{session_id}/next')
+            data = json.loads(res.data)
+            self.assertEqual(res.status_code, OK)
+            drawn_ids.add(data['question']['id'])
+        self.assertEqual(drawn_ids, science_question_ids)
+        res = self.client().post(f'/quizzes/sessions/{session_id}/next')
+        data = json.loads(res.data)
+        self.assertEqual(data['question'], None)
+        self.assertEqual(data['total_questions'], 0)
+
+    def test_success_end_quiz_session(self):
+        """Test success at DELETE '/quizzes/sessions/<session_id>'"""
+        res = self.client().post(
+            '/quizzes/sessions', json={'quiz_category': {"id": 0}})
+        session_id = json.loads(res.data)['session_id']
+        self.client().post(f'/quizzes/sessions/{session_id}/next')
+        res = self.client().delete(f'/quizzes/sessions/{session_id}')
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, OK)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['questions_played'], 1)
+        res = self.client().post(f'/quizzes/sessions/{session_id}/next')
+        self.assertEqual(res.status_code, RESOURCE_NOT_FOUND)
+
+    def test_success_question_bitset_size_follows_ids_seen(self):
+        """Test a quiz session's seen questions take space for the ids
+         seen, however large they are"""
+        for question_ids in [range(1000000, 1000500, 3),
+                             range(1000496, 999999, -7),
+                             [1000000, 3, 2000000, 17, 3000000]]:
+            seen = QuestionBitset(question_ids)
+            question_ids = set(question_ids)
+            self.assertEqual(len(seen), len(question_ids))
+            self.assertEqual(set(seen), question_ids)
+            self.assertLess(len(seen.to_bytes()), 100)
+            for question_id in [2, 3, 17, 18, 1000000, 1000001, 1000496,
+                                1000497, 2000000, 3000000, 3000001]:
+                self.assertEqual(question_id in seen,
+                                 question_id in question_ids)
+            copy = QuestionBitset.from_bytes(seen.to_bytes())
+            self.assertEqual(set(copy), question_ids)
+            self.assertEqual(len(copy), len(question_ids))
+            copy.add(1000001)
+            self.assertIn(1000001, copy)
+        seen.add(17)
+        self.assertEqual(len(seen), 5)
+
+    def test_fail_next_question_of_missing_quiz_session(self):
+        """Test fail at POST '/quizzes/sessions/<session_id>/next'
+         w session not on the server"""
+        res = self.client().post('/quizzes/sessions/missing/next')
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, RESOURCE_NOT_FOUND)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], RESOURCE_NOT_FOUND_MSG)
+
+    def test_success_submit_quiz_results_and_get_leaderboard(self):
+        """Test success at POST '/quizzes/results' and GET '/leaderboard'
+         ranked by score"""
+        for player, score, category_id in [('Ada', 3, 1), ('Grace', 5, 1),
+                                           ('Alan', 4, 1), ('Edsger', 2, 0)]:
+            res = self.client().post('/quizzes/results', json={
+                'player': player, 'score': score, 'total_questions': 5,
+                'quiz_category': {'type': 'Science', 'id': category_id}})
+            data = json.loads(res.data)
+            self.assertEqual(res.status_code, ACCEPTED)
+            self.assertEqual(data['success'], True)
+        self.assertEqual(data['rank'], 1)
+        res = self.client().get('/leaderboard?category=1')
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, OK)
+        self.assertEqual(data['category'], 1)
+        self.assertEqual([result['player'] for result in data['leaderboard']],
+                         ['Grace', 'Alan', 'Ada'])
+        res = self.client().get('/leaderboard')
+        data = json.loads(res.data)
+        self.assertEqual(data['category'], 'all')
+        self.assertEqual([result['score'] for result in data['leaderboard']],
+                         [5, 4, 3, 2])
+        self.assertEqual(data['leaderboard'][-1]['category'], 0)
+
+    def test_success_quiz_results_written_in_batches(self):
+        """Test results are buffered and written in one multi-row insert"""
+        app = create_app({'SQLALCHEMY_DATABASE_URI': TEST_DATABASE_URI,
+                          'RESULTS_FLUSH_SIZE': 3,
+                          'RESULTS_FLUSH_INTERVAL': None,
+                          'LEADERBOARD_SIZE': 2})
+        client = app.test_client()
+        client.get('/leaderboard?category=2')
+        with QueryCounter() as counter:
+            ranks = [json.loads(client.post('/quizzes/results', json={
+                'player': f'player {score}', 'score': score,
+                'total_questions': 10, 'quiz_category': {'id': 2}
+            }).data)['rank'] for score in [6, 8, 7]]
+        inserts = [statement for statement in counter.statements
+                   if statement.startswith('INSERT')]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(ranks, [1, 1, 2])
+        with app.app_context():
+            self.assertEqual(QuizResult.query.filter(
+                QuizResult.category == 2).count(), 3)
+        data = json.loads(client.get('/leaderboard?category=2').data)
+        self.assertEqual([result['score'] for result in data['leaderboard']],
+                         [8, 7])
+
+    def test_success_quiz_results_written_around_rejected_result(self):
+        """Test a result the DB rejects is dropped, the rest of its batch
+         is written, and results past RESULTS_MAX_PENDING are turned away"""
+        writer = ResultWriter(self.app, flush_size=10, flush_interval=None,
+                              max_pending=3)
+        for total_questions in [5, 10 ** 20, 5]:
+            self.assertTrue(writer.add(new_result('Ada', 4, 3,
+                                                  total_questions)))
+        self.assertFalse(writer.add(new_result('Ada', 4, 3, 5)))
+        with self.app.app_context():
+            self.assertEqual(writer.flush(), 2)
+            self.assertEqual(writer.pending(), [])
+            self.assertEqual(QuizResult.query.filter(
+                QuizResult.category == 4).count(), 2)
+        client = create_app({'SQLALCHEMY_DATABASE_URI': TEST_DATABASE_URI,
+                             'RESULTS_FLUSH_SIZE': 10,
+                             'RESULTS_FLUSH_INTERVAL': None,
+                             'RESULTS_MAX_PENDING': 1}).test_client()
+        statuses = [client.post('/quizzes/results', json={
+            'player': 'Ada', 'score': 3, 'total_questions': 5,
+            'quiz_category': {'id': 4}}).status_code for _ in range(2)]
+        self.assertEqual(statuses, [ACCEPTED, SERVICE_UNAVAILABLE])
+
+    def test_fail_submit_quiz_result_with_bad_score(self):
+        """Test fail at POST '/quizzes/results' w more right answers
+         than questions, or more questions than any game plays"""
+        res = self.client().post('/quizzes/results', json={
+            'player': 'Ada', 'score': 6, 'total_questions': 5,
+            'quiz_category': {'id': 1}})
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, UNPROCESSABLE_ENTITY)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], UNPROCESSABLE_ENTITY_MSG)
+        res = self.client().post('/quizzes/results', json={
+            'player': 'Ada', 'score': 1, 'total_questions': 10 ** 20,
+            'quiz_category': {'id': 1}})
+        self.assertEqual(res.status_code, UNPROCESSABLE_ENTITY)
+
+    def test_fail_submit_quiz_result_of_missing_category(self):
+        """Test fail at POST '/quizzes/results' w category not in DB"""
+        res = self.client().post('/quizzes/results', json={
+            'player': 'Ada', 'score': 1, 'total_questions': 5,
+            'quiz_category': {'id': 1000}})
+        self.assertEqual(res.status_code, UNPROCESSABLE_ENTITY)
+
+    def test_fail_get_leaderboard_of_missing_category(self):
+        """Test fail at GET '/leaderboard' w category not in DB"""
+        res = self.client().get('/leaderboard?category=1000')
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, UNPROCESSABLE_ENTITY)
+        self.assertEqual(data['success'], False)
+
+    def test_success_get_questions_from_response_cache(self):
+        """Test success at GET '/questions' answered again from the response
+         cache, without SQL, and counted at GET '/metrics'"""
+        client = create_app(
+            {'SQLALCHEMY_DATABASE_URI': TEST_DATABASE_URI}).test_client()
+        res = client.get('/questions?page=2')
+        with QueryCounter() as counter:
+            cached_res = client.get('/questions?page=2')
+        self.assertEqual(res.status_code, OK)
+        self.assertEqual(cached_res.status_code, OK)
+        self.assertEqual(counter.statements, [])
+        self.assertEqual(cached_res.data, res.data)
+        self.assertEqual(cached_res.headers['ETag'], res.headers['ETag'])
+        res = client.get('/questions?page=2&fields=id,question')
+        self.assertNotIn('answer', json.loads(res.data)['questions'][0])
+        metrics = client.get('/metrics').data.decode()
+        self.assertIn(
+            'trivia_response_cache_hits_total{route="get_questions"} 1',
+            metrics)
+        self.assertIn(
+            'trivia_response_cache_misses_total{route="get_questions"} 2',
+            metrics)
+
+    def test_success_response_cache_invalidated_by_insert_and_delete(self):
+        """Test success at GET '/categories/5/questions' after a question
+         of category 5 is added, and after it is deleted"""
+        client = create_app(
+            {'SQLALCHEMY_DATABASE_URI': TEST_DATABASE_URI}).test_client()
+        total_questions = json.loads(client.get(
+            '/categories/5/questions').data)['total_questions']
+        res = client.post('/questions', json=self.new_question)
+        new_question_id = json.loads(res.data)['new_question_id']
+        data = json.loads(client.get('/categories/5/questions').data)
+        self.assertEqual(data['total_questions'], total_questions + 1)
+        client.delete(f'/questions/{new_question_id}')
+        data = json.loads(client.get('/categories/5/questions').data)
+        self.assertEqual(data['total_questions'], total_questions)
+
+    def test_success_search_response_cache_ignores_case(self):
+        """Test success at POST '/questions' answered from the response
+         cache for a search term differing only in case"""
+        client = create_app(
+            {'SQLALCHEMY_DATABASE_URI': TEST_DATABASE_URI}).test_client()
+        res = client.post('/questions', json={'searchTerm': 'Title'})
+        with QueryCounter() as counter:
+            cached_res = client.post('/questions',
+                                     json={'searchTerm': 'tITLE'})
+        self.assertEqual(counter.statements, [])
+        self.assertEqual(cached_res.data, res.data)
+        client.post('/questions', json={'searchTerm': 'title',
+                                        'category': 4})
+        metrics = client.get('/metrics').data.decode()
+        self.assertIn(
+            'trivia_response_cache_hits_total{route="search_questions"} 1',
+            metrics)
+        self.assertIn(
+            'trivia_response_cache_misses_total{route="search_questions"} 2',
+            metrics)
+
+    def test_success_response_stores_evict_and_expire(self):
+        """Test the in-process store evicts its least recently used entries
+         and a SQLite store is shared by every store on its file"""
+        store = InProcessResponseStore(max_entries=2, max_bytes=8)
+        store.set('a', b'1234')
+        store.set('b', b'1234')
+        store.get('a')
+        store.set('c', b'1234')
+        self.assertIsNone(store.get('b'))
+        self.assertEqual(store.get('a'), b'1234')
+        store.set('d', b'123456')
+        self.assertEqual(len(store), 1)
+        store.set('e', b'123456789')
+        self.assertIsNone(store.get('e'))
+        expired_store = InProcessResponseStore(ttl=0)
+        expired_store.set('a', b'1')
+        self.assertIsNone(expired_store.get('a'))
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'responses.db')
+            SqliteResponseStore(path, max_entries=2).set('a', b'1')
+            shared_store = SqliteResponseStore(path, max_entries=2)
+            self.assertEqual(shared_store.get('a'), b'1')
+            shared_store.set('b', b'2')
+            shared_store.set('c', b'3')
+            self.assertIsNone(shared_store.get('a'))
+            self.assertEqual(len(shared_store), 2)
+            shared_store.clear()
+            self.assertIsNone(shared_store.get('c'))
+
+    @unittest.skipUnless(hasattr(os, 'fork'), 'workers are forked')
+    def test_success_shared_response_store_keys_follow_workers(self):
+        """Test workers forked from one app never hit each other's entries
+         in a shared response store, nor empty it, unless they share their
+         content version too"""
+        with tempfile.TemporaryDirectory() as directory:
+            store = SqliteResponseStore(
+                os.path.join(directory, 'responses.db'))
+            cache = ResponseCache(store, InProcessContentVersion())
+            key = cache.key('get_questions', page=1)
+            cache.set(key, b'parent')
+            pid = os.fork()
+            if pid == 0:
+                status = 1
+                try:
+                    child_key = cache.key('get_questions', page=1)
+                    if cache.get('get_questions', child_key) is None:
+                        cache.set(child_key, b'child')
+                        cache.content_version.bump()
+                        cache.key('get_questions', page=1)
+                        status = 0
+                finally:
+                    os._exit(status)
+            _, status = os.waitpid(pid, 0)
+            self.assertEqual(status, 0)
+            self.assertEqual(cache.get('get_questions', key), b'parent')
+            self.assertEqual(len(store), 2)
+            workers = [ResponseCache(store, SqliteContentVersion(
+                os.path.join(directory, 'version.db'))) for _ in range(2)]
+            key = workers[0].key('get_questions', page=1)
+            workers[0].set(key, b'shared')
+            self.assertEqual(workers[1].key('get_questions', page=1), key)
+            self.assertEqual(workers[1].get('get_questions', key), b'shared')
+            workers[1].content_version.bump()
+            self.assertNotEqual(workers[0].key('get_questions', page=1), key)
+
+    def test_fail_reads_shed_over_concurrency_limit(self):
+        """Test fail at GET '/questions' and searches w no read admitted,
+         answered with a 503 and Retry-After, while the quiz is served"""
+        client = create_app({'SQLALCHEMY_DATABASE_URI': TEST_DATABASE_URI,
+                             'ADMISSION_LIMITS': {'reads': 0},
+                             'ADMISSION_RETRY_AFTER': 2}).test_client()
+        for res in [client.get('/questions'),
+                    client.post('/questions', json={'searchTerm': 'title'})]:
+            data = json.loads(res.data)
+            self.assertEqual(res.status_code, SERVICE_UNAVAILABLE)
+            self.assertEqual(res.headers['Retry-After'], '2')
+            self.assertEqual(data['success'], False)
+            self.assertEqual(data['message'], SERVICE_UNAVAILABLE_MSG)
+        res = client.post('/quizzes/sessions', json={
+            'quiz_category': {'type': 'Science', 'id': 1}})
+        self.assertEqual(res.status_code, OK)
+        metrics = client.get('/metrics').data.decode()
+        self.assertIn('trivia_requests_shed_total{route_class="reads",'
+                      'reason="overloaded"} 2', metrics)
+
+    def test_success_concurrency_limiter_queue_deadline(self):
+        """Test a request waits for a slot until its queue deadline, and is
+         admitted when a slot frees up before it"""
+        limiter = ConcurrencyLimiter(1, queue_timeout=0.05)
+        self.assertTrue(limiter.acquire())
+        start = time.monotonic()
+        self.assertFalse(limiter.acquire())
+        self.assertGreaterEqual(time.monotonic() - start, 0.05)
+        limiter = ConcurrencyLimiter(1, queue_timeout=5)
+        self.assertTrue(limiter.acquire())
+        threading.Timer(0.05, limiter.release).start()
+        start = time.monotonic()
+        self.assertTrue(limiter.acquire())
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual((limiter.active, limiter.waiting), (1, 0))
+        limiter = ConcurrencyLimiter(1, queue_timeout=5, max_waiting=0)
+        limiter.acquire()
+        start = time.monotonic()
+        self.assertFalse(limiter.acquire())
+        self.assertLess(time.monotonic() - start, 1)
+
+    def test_fail_client_over_rate_limit(self):
+        """Test fail at GET '/questions' w a client over its read rate,
+         answered with a 429 and Retry-After, while other clients and
+         its writes are served"""
+        client = create_app({'SQLALCHEMY_DATABASE_URI': TEST_DATABASE_URI,
+                             'RATE_LIMITS': {'reads': (1, 2)}}).test_client()
+        statuses = [client.get('/categories').status_code for _ in range(3)]
+        self.assertEqual(statuses, [OK, OK, TOO_MANY_REQUESTS])
+        res = client.get('/categories')
+        self.assertEqual(res.headers['Retry-After'], '1')
+        self.assertEqual(json.loads(res.data)['success'], False)
+        res = client.get('/categories',
+                         environ_base={'REMOTE_ADDR': '10.0.0.2'})
+        self.assertEqual(res.status_code, OK)
+        res = client.post('/quizzes/sessions', json={
+            'quiz_category': {'type': 'Science', 'id': 1}})
+        self.assertEqual(res.status_code, OK)
+
+    def test_fail_get_questions_w_db_pool_exhausted(self):
+        """Test fail at GET '/questions' w no free DB connection answered
+         with a 503 rather than a 422"""
+        with tempfile.TemporaryDirectory() as db_dir:
+            app = create_app({
+                'SQLALCHEMY_DATABASE_URI': f'sqlite:///{db_dir}/pool.db',
+                'SQLALCHEMY_ENGINE_OPTIONS': {
+                    'poolclass': QueuePool, 'pool_size': 1,
+                    'max_overflow': 0, 'pool_timeout': 0.01}})
+            with app.app_context():
+                held_connection = db.get_engine(app).connect()
+                res = app.test_client().get('/questions')
+                held_connection.close()
+                db.get_engine(app).dispose()
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, SERVICE_UNAVAILABLE)
+        self.assertEqual(res.headers['Retry-After'], '1')
+        self.assertEqual(data['message'], SERVICE_UNAVAILABLE_MSG)
+
+    def test_success_draw_ids_skip_excluded_and_drawn_ids(self):
+        """Test drawn ids are distinct, never excluded, and cover every
+         category when the category id is 0"""
+        engine = QuizDrawEngine(max_age=None)
+        engine.load([(question_id, question_id % 3 + 1)
+                     for question_id in range(1, 101)])
+        for excluded_count in [0, 10, 50, 90]:
+            excluded = set(range(1, excluded_count + 1))
+            drawn = engine.draw_ids(0, excluded, 20)
+            self.assertEqual(len(drawn), min(20, 100 - excluded_count))
+            self.assertEqual(len(set(drawn)), len(drawn))
+            self.assertFalse(set(drawn) & excluded)
+        self.assertEqual(set(engine.draw_ids(0, (), 100)),
+                         set(range(1, 101)))
+        drawn = engine.draw_ids(2, (), 100)
+        self.assertEqual(set(drawn), set(range(1, 101, 3)))
+
+    def test_success_draw_ids_scan_once_probes_are_exhausted(self):
+        """Test the ids left are found by a scan when random probes keep
+         hitting asked questions, or when no probes are allowed"""
+        engine = QuizDrawEngine(max_age=None, max_probes=1)
+        engine.load([(question_id, 1) for question_id in range(1, 1001)])
+        excluded = set(range(1, 1001)) - {500}
+        self.assertEqual(engine.draw_ids(1, excluded, 1), [500])
+        engine = QuizDrawEngine(max_age=None, max_probes=0)
+        engine.load([(question_id, 1) for question_id in range(1, 11)])
+        self.assertEqual(sorted(engine.draw_ids(1, {1, 2, 3}, 10)),
+                         list(range(4, 11)))
+        self.assertEqual(engine.draw_ids(1, set(range(1, 11)), 1), [])
+
+    def test_success_draw_engine_invalidated_by_insert_and_delete(self):
+        """Test the quiz index is rebuilt after a question is added, and
+         after one is deleted"""
+        engine = QuizDrawEngine(max_age=None)
+        with self.app.app_context():
+            all_ids = set(engine.get_ids(0))
+            self.assertFalse(engine.is_stale())
+            question = Question(question=TEST_QUESTION_TEXT,
+                                answer='Seven', difficulty=4, category='5')
+            question.insert()
+            self.assertTrue(engine.is_stale())
+            self.assertEqual(set(engine.get_ids(0)),
+                             all_ids | {question.id})
+            question.delete()
+            self.assertTrue(engine.is_stale())
+            self.assertEqual(set(engine.get_ids(0)), all_ids)
+
+    def test_success_draw_engine_invalidated_on_commit(self):
+        """Test the quiz index is rebuilt after a question is added even
+         when another thread rebuilt it between the flush and the commit"""
+        engine = QuizDrawEngine(max_age=None)
+        with self.app.app_context():
+            all_ids = set(engine.get_ids(0))
+            question = Question(question=TEST_QUESTION_TEXT,
+                                answer='Seven', difficulty=4, category='5')
+            db.session.add(question)
+            db.session.flush()
+            # as read by another session, the insert isn't committed yet
+            engine.load((question_id, 1) for question_id in all_ids)
+            db.session.commit()
+            self.assertTrue(engine.is_stale())
+            self.assertIn(question.id, engine.get_ids(0))
+
 
 # Make the tests conveniently executable
 if __name__ == "__main__":
@@ -11,12 +11,15 @@ class QuizView extends Component {
     this.state = {
         quizCategory: null,
         previousQuestions: [], 
+        deck: [],
         showAnswer: false,
         categories: {},
         numCorrect: 0,
         currentQuestion: {},
         guess: '',
-        forceEnd: false
+        forceEnd: false,
+        player: '',
+        scoreRank: undefined
     }
   }
 
@@ -36,24 +39,23 @@ class QuizView extends Component {
   }
 
   selectCategory = ({type, id=0}) => {
-    this.setState({quizCategory: {type, id}}, this.getNextQuestion)
+    this.setState({quizCategory: {type, id}}, this.getDeck)
   }
 
   handleChange = (event) => {
     this.setState({[event.target.name]: event.target.value})
   }
 
-  getNextQuestion = () => {
-    const previousQuestions = [...this.state.previousQuestions]
-    if(this.state.currentQuestion.id) { previousQuestions.push(this.state.currentQuestion.id) }
-
+  getDeck = () => {
+    // one request fetches every question of the game
     $.ajax({
-      url: '/quizzes', //TODO: update request URL
+      url: '/quizzes/deck',
       type: "POST",
       dataType: 'json',
       contentType: 'application/json',
       data: JSON.stringify({
-        previous_questions: previousQuestions,
+        count: questionsPerPlay,
+        previous_questions: this.state.previousQuestions,
         quiz_category: this.state.quizCategory
       }),
       xhrFields: {
@@ -61,22 +63,31 @@ class QuizView extends Component {
       },
       crossDomain: true,
       success: (result) => {
-        this.setState({
-          showAnswer: false,
-          previousQuestions: previousQuestions,
-          currentQuestion: result.question,
-          guess: '',
-          forceEnd: result.question ? false : true
-        })
+        this.setState({deck: result.questions}, this.getNextQuestion)
         return;
       },
       error: (error) => {
-        alert('Unable to load question. Please try your request again')
+        alert('Unable to load questions. Please try your request again')
         return;
       }
     })
   }
 
+  getNextQuestion = () => {
+    const previousQuestions = [...this.state.previousQuestions]
+    if(this.state.currentQuestion.id) { previousQuestions.push(this.state.currentQuestion.id) }
+    const [nextQuestion, ...deck] = this.state.deck
+
+    this.setState({
+      showAnswer: false,
+      previousQuestions: previousQuestions,
+      deck: deck,
+      currentQuestion: nextQuestion || {},
+      guess: '',
+      forceEnd: nextQuestion ? false : true
+    })
+  }
+
   submitGuess = (event) => {
     event.preventDefault();
     const formatGuess = this.state.guess.replace(/[.,\/#!$%\^&\*;:{}=\-_`~()]/g,"").toLowerCase()
@@ -87,15 +98,45 @@ class QuizView extends Component {
     })
   }
 
+  submitScore = (event) => {
+    event.preventDefault();
+    $.ajax({
+      url: '/quizzes/results',
+      type: "POST",
+      dataType: 'json',
+      contentType: 'application/json',
+      data: JSON.stringify({
+        player: this.state.player,
+        score: this.state.numCorrect,
+        total_questions: this.state.previousQuestions.length,
+        quiz_category: this.state.quizCategory
+      }),
+      xhrFields: {
+        withCredentials: true
+      },
+      crossDomain: true,
+      success: (result) => {
+        this.setState({scoreRank: result.rank})
+        return;
+      },
+      error: (error) => {
+        alert('Unable to save your score. Please try your request again')
+        return;
+      }
+    })
+  }
+
   restartGame = () => {
     this.setState({
       quizCategory: null,
       previousQuestions: [], 
+      deck: [],
       showAnswer: false,
       numCorrect: 0,
       currentQuestion: {},
       guess: '',
-      forceEnd: false
+      forceEnd: false,
+      scoreRank: undefined
     })
   }
 
@@ -125,6 +166,15 @@ class QuizView extends Component {
     return(
       <div className="quiz-play-holder">
         <div className="final-header"> Your Final Score is {this.state.numCorrect}</div>
+        {this.state.scoreRank === undefined
+          ? (
+            <form onSubmit={this.submitScore}>
+              <input type="text" name="player" placeholder="Your name" maxLength="50" value={this.state.player} onChange={this.handleChange}/>
+              <input className="submit-guess button" type="submit" value="Save Score" />
+            </form>
+          )
+          : <div className="final-header">{this.state.scoreRank ? `You're #${this.state.scoreRank} on the leaderboard!` : 'Score saved'}</div>
+        }
         <div className="play-again button" onClick={this.restartGame}> Play Again? </div>
       </div>
     )